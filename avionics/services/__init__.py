@@ -1,3 +1,11 @@
+from .boot import *
 from .data_station_handler import *
 from .navigation import *
 from .status_handler import *
+from .heartbeat import *
+from .history import *
+from .offload import *
+from .catalog import *
+from .profiler import *
+from .segment_store import *
+from .tracing import *
@@ -0,0 +1 @@
+from .boot import BootTimeline, preload, timeline
@@ -0,0 +1,82 @@
+import importlib
+import logging
+import threading
+import time
+
+class BootTimeline(object):
+
+    """Start-up phase timeline from process start to READY
+
+    Services mark phases as they complete, from whichever thread they run
+    on. When READY is reached the whole timeline is logged, along with the
+    time since power-on (system uptime) where the platform reports it.
+
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.start_uptime = _uptime()
+        self.phases = []                # (seconds since start, thread name, phase)
+        self.is_ready = False
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """Record that a phase has completed"""
+        elapsed = time.monotonic() - self.start
+        with self._lock:
+            self.phases.append((elapsed, threading.current_thread().name, phase))
+        logging.info("Boot +%.2f s: %s", elapsed, phase)
+
+    def ready(self):
+        """Record READY and log the timeline, the first time only"""
+        with self._lock:
+            if self.is_ready:
+                return
+            self.is_ready = True
+
+        self.mark('READY')
+
+        with self._lock:
+            phases = list(self.phases)
+
+        logging.info("Boot timeline:")
+        previous = 0.0
+        for elapsed, thread_name, phase in phases:
+            logging.info("  +%7.2f s (%+6.2f s)  %-12s %s", elapsed, elapsed-previous, thread_name, phase)
+            previous = elapsed
+
+        if self.start_uptime != None:
+            logging.info("READY %.1f s after power-on (process started at %.1f s)",
+                         self.start_uptime + phases[-1][0], self.start_uptime)
+
+
+def preload(modules):
+    """
+    Import slow modules on a background thread
+
+    Services import their heavy dependencies where they first need them.
+    Preloading overlaps those imports with the rest of start-up, and any
+    service that gets there first simply waits on the module's import lock.
+    """
+    def load():
+        for module in modules:
+            try:
+                importlib.import_module(module)
+                timeline.mark('%s imported' % module)
+            except ImportError as e:
+                logging.error("Unable to preload %s: %s", module, e)
+
+    thread = threading.Thread(target=load, name='Preload')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def _uptime():
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (IOError, ValueError, IndexError):
+        return None
+
+# Shared by all services, started as soon as the package is imported
+timeline = BootTimeline()
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from . import exif
+
+class Catalog(object):
+
+    """On-board index of downloaded field data
+
+    Files are added as they finish downloading. Hashing and EXIF parsing
+    happen on a background thread, which writes to an SQLite database in
+    batches so the transfer itself is never held up by the index.
+
+    The same database is queried on the payload and, once offloaded, on the
+    ground, e.g. all images from station 321 in the last week:
+
+        Catalog(path).query(station='321', kind='image', since=time.time()-7*86400)
+
+    """
+
+    DEFAULT_PATH = '/srv/flight-data/catalog.db'
+
+    BATCH_SIZE = 100
+    FLUSH_SECS = 2
+    HASH_CHUNK_BYTES = 1024*1024
+
+    COLUMNS = ('local_path', 'station', 'remote_path', 'kind', 'size', 'mtime', 'sha256',
+               'captured_at', 'indexed_at')
+
+    KINDS = {
+        '.jpg': 'image', '.jpeg': 'image', '.png': 'image',
+        '.mp4': 'video', '.avi': 'video', '.mov': 'video',
+        '.wav': 'audio', '.mp3': 'audio',
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            local_path TEXT PRIMARY KEY,
+            station TEXT NOT NULL,
+            remote_path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            captured_at REAL NOT NULL,     -- EXIF capture time, or mtime without one
+            indexed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_station_kind_captured ON files (station, kind, captured_at);
+        CREATE INDEX IF NOT EXISTS files_captured ON files (captured_at);
+        CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+    """
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        connection = self._connect()
+        connection.executescript(self.SCHEMA)
+        connection.close()
+
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()    # Files arrive on several transfer threads at once
+
+    def add(self, station, remote_path, local_path, store=None, indexed=None):
+        """
+        Queue a downloaded file for indexing
+
+        Given the SegmentStore the file was written to, it's read from there
+        and local_path is where export() would put it. `indexed` is called
+        with the file's row (a dict) once it's committed to the database.
+        """
+        with self._writer_lock:
+            if self._writer == None:
+                self._writer = threading.Thread(target=self._write, name='Catalog')
+                self._writer.daemon = True
+                self._writer.start()
+
+            self._queue.put((station, remote_path, local_path, store, indexed))
+
+    def close(self):
+        """Index everything queued so far and stop the writer"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+            if writer != None:
+                self._queue.put(None)
+        if writer != None:
+            writer.join()
+
+    def query(self, station=None, kind=None, since=None, until=None):
+        """Return matching files as dicts, oldest capture first"""
+        clauses = []
+        parameters = []
+        for clause, value in (('station = ?', station), ('kind = ?', kind),
+                              ('captured_at >= ?', since), ('captured_at < ?', until)):
+            if value != None:
+                clauses.append(clause)
+                parameters.append(value)
+
+        sql = 'SELECT * FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY captured_at'
+
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        # Readers (e.g. a query on the ground) don't block the writer
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _write(self):
+        connection = self._connect()
+        batch = []
+        callbacks = []
+        last_flush = time.monotonic()
+        done = False
+
+        while not done:
+            try:
+                item = self._queue.get(timeout=self.FLUSH_SECS)
+            except queue.Empty:
+                item = False
+
+            if item == None:
+                done = True
+            elif item:
+                station, remote_path, local_path, store, indexed = item
+                row = self._describe(station, remote_path, local_path, store)
+                if row != None:
+                    batch.append(row)
+                    if indexed != None:
+                        callbacks.append((indexed, row))
+
+            if batch and (done or len(batch) >= self.BATCH_SIZE or
+                          time.monotonic() - last_flush >= self.FLUSH_SECS):
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?)', batch)
+                logging.debug("Catalog indexed %i files", len(batch))
+                batch = []
+                last_flush = time.monotonic()
+
+                for indexed, row in callbacks:
+                    try:
+                        indexed(dict(zip(self.COLUMNS, row)))
+                    except Exception as e:
+                        logging.error("Catalog callback failed: %s", e)
+                callbacks = []
+
+        connection.close()
+
+    def _describe(self, station, remote_path, local_path, store=None):
+        if store != None:
+            return self._describe_stored(station, remote_path, local_path, store)
+
+        try:
+            stat = os.stat(local_path)
+            sha256 = hashlib.sha256()
+            with open(local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.HASH_CHUNK_BYTES), b''):
+                    sha256.update(chunk)
+        except (IOError, OSError) as e:
+            logging.error("Unable to catalog %s: %s", local_path, e)
+            return None
+
+        kind = self.KINDS.get(os.path.splitext(local_path)[1].lower(), 'other')
+
+        captured_at = None
+        if kind == 'image':
+            captured_at = exif.capture_time(local_path)
+        if captured_at == None:
+            captured_at = stat.st_mtime
+
+        return (local_path, station, remote_path, kind, stat.st_size, stat.st_mtime,
+                sha256.hexdigest(), captured_at, time.time())
+
+    def _describe_stored(self, station, remote_path, local_path, store):
+        try:
+            entry = store.entry(os.path.basename(local_path))
+        except KeyError:
+            logging.error("Unable to catalog %s: not in segment store", local_path)
+            return None
+
+        kind = self.KINDS.get(os.path.splitext(local_path)[1].lower(), 'other')
+        mtime = entry['mtime'] if entry['mtime'] != None else time.time()
+
+        captured_at = None
+        if kind == 'image':
+            captured_at = exif.header_capture_time(store.read(entry['name']))
+        if captured_at == None:
+            captured_at = mtime
+
+        # Hashed as it was written, no need to read it all back
+        return (local_path, station, remote_path, kind, entry['size'], mtime,
+                entry['sha256'], captured_at, time.time())
@@ -0,0 +1,90 @@
+"""
+Minimal JPEG EXIF reader, just enough to get the capture timestamp out of
+camera trap images without pulling in an imaging library.
+"""
+
+import calendar
+import struct
+import time
+
+DATE_TIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+
+MAX_HEADER_BYTES = 128*1024 # EXIF lives in the first APP1 segment
+
+def capture_time(path):
+    """
+    Return the capture time of a JPEG as seconds since the epoch, or None.
+
+    Cameras record local time with no zone, so the time is taken as UTC.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(MAX_HEADER_BYTES)
+    except IOError:
+        return None
+
+    return header_capture_time(data)
+
+def header_capture_time(data):
+    """As capture_time(), given the first MAX_HEADER_BYTES of the file"""
+    data = bytes(data[:MAX_HEADER_BYTES])
+    if data[0:2] != b'\xff\xd8':
+        return None
+
+    tiff = _exif_segment(data)
+    if tiff == None:
+        return None
+
+    try:
+        return _parse_tiff(tiff)
+    except (struct.error, ValueError, IndexError):
+        return None
+
+def _exif_segment(data):
+    offset = 2
+    while offset + 4 <= len(data) and data[offset] == 0xff:
+        marker = data[offset+1]
+        length = struct.unpack('>H', data[offset+2:offset+4])[0]
+        if marker == 0xe1 and data[offset+4:offset+10] == b'Exif\x00\x00':
+            return data[offset+10:offset+2+length]
+        if marker == 0xda: # Start of scan, no more metadata
+            break
+        offset += 2 + length
+    return None
+
+def _parse_tiff(tiff):
+    byte_order = {b'II': '<', b'MM': '>'}[tiff[0:2]]
+
+    def ifd_entries(ifd_offset):
+        count = struct.unpack(byte_order + 'H', tiff[ifd_offset:ifd_offset+2])[0]
+        for i in range(count):
+            entry = ifd_offset + 2 + i*12
+            tag, kind, n, value = struct.unpack(byte_order + 'HHII', tiff[entry:entry+12])
+            yield tag, n, value, entry+8
+
+    def ascii_value(n, value, value_offset):
+        start = value_offset if n <= 4 else value
+        return tiff[start:start+n].rstrip(b'\x00').decode('ascii')
+
+    ifd0 = struct.unpack(byte_order + 'I', tiff[4:8])[0]
+
+    date_time = None
+    exif_ifd = None
+    for tag, n, value, value_offset in ifd_entries(ifd0):
+        if tag == DATE_TIME:
+            date_time = ascii_value(n, value, value_offset)
+        elif tag == EXIF_IFD_POINTER:
+            exif_ifd = value
+
+    if exif_ifd != None:
+        for tag, n, value, value_offset in ifd_entries(exif_ifd):
+            if tag == DATE_TIME_ORIGINAL:
+                date_time = ascii_value(n, value, value_offset)
+                break
+
+    if not date_time:
+        return None
+
+    return float(calendar.timegm(time.strptime(date_time, '%Y:%m:%d %H:%M:%S')))
@@ -0,0 +1,114 @@
+"""
+Transfer budget shared by the data station sessions running at once.
+
+The payload has one Wi-Fi radio and one CPU for cipher work however many
+stations are in range, so concurrent sessions split a global number of
+transfer slots and, optionally, a bandwidth cap between them. Each session
+holds a share that is rebalanced as sessions start and finish.
+
+Shares live in shared memory and are only ever written by the handler, so a
+download process that gets killed can't leak part of the budget.
+"""
+
+import multiprocessing
+import threading
+import time
+
+class TransferBudget(object):
+    """
+    Global transfer slots and bandwidth (bytes/s, None for no cap), split
+    evenly between the active sessions' shares.
+    """
+
+    def __init__(self, _slots, _bytes_per_sec=None):
+        self.slots = _slots
+        self.bytes_per_sec = _bytes_per_sec
+
+        self._shares = []
+        self._lock = threading.Lock()
+
+    def join(self):
+        """A share for a new session, taken from the others"""
+        share = BudgetShare()
+        with self._lock:
+            self._shares.append(share)
+            self._rebalance()
+        return share
+
+    def leave(self, share):
+        """Return a finished session's share to the others"""
+        with self._lock:
+            if share in self._shares:
+                self._shares.remove(share)
+                self._rebalance()
+
+    def _rebalance(self):
+        if not self._shares:
+            return
+
+        slots, extra = divmod(self.slots, len(self._shares))
+        for i, share in enumerate(self._shares):
+            # Every session gets at least one transfer, earlier ones any remainder
+            share.concurrency = max(1, slots + (1 if i < extra else 0))
+            share.bytes_per_sec = self.bytes_per_sec / len(self._shares) if self.bytes_per_sec else 0.0
+
+
+class BudgetShare(object):
+    """
+    One session's part of the budget. The download reads its concurrency
+    limit and calls throttle() with the bytes it receives.
+    """
+
+    BURST_SECS = 0.5
+
+    def __init__(self):
+        # Written by the handler only, so without a lock the download could die holding
+        self._concurrency = multiprocessing.Value('i', 1, lock=False)
+        self._bytes_per_sec = multiprocessing.Value('d', 0.0, lock=False)
+
+        # Token bucket, local to the process doing the transfers
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return self._concurrency.value
+
+    @concurrency.setter
+    def concurrency(self, value):
+        self._concurrency.value = value
+
+    @property
+    def bytes_per_sec(self):
+        """Bandwidth cap, 0 for none"""
+        return self._bytes_per_sec.value
+
+    @bytes_per_sec.setter
+    def bytes_per_sec(self, value):
+        self._bytes_per_sec.value = value
+
+    def throttle(self, count):
+        """Account for bytes received, sleeping if they put us over our bandwidth"""
+        rate = self.bytes_per_sec
+        if not rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._refilled) * rate, rate * self.BURST_SECS)
+            self._refilled = now
+            self._tokens -= count
+            deficit = -self._tokens
+
+        if deficit > 0:
+            time.sleep(deficit / rate)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
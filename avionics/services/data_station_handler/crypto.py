@@ -0,0 +1,69 @@
+"""
+SSH algorithm preference profiles for data station transports.
+
+Paramiko's default negotiation isn't tuned for the payload's ARM CPU. A
+profile lists preferred ciphers, MACs and key exchanges, most preferred
+first; algorithms this paramiko doesn't support are skipped and the rest
+of paramiko's own list is kept as a fallback so negotiation still succeeds
+against any data station. A 'strict' profile offers only its own lists.
+
+Run `python avionics crypto-benchmark` on the payload to measure each
+combination and pick a profile.
+"""
+
+import logging
+
+PROFILES = {
+    # Paramiko's own order
+    'default': {},
+
+    # No AES instructions on the Pi's Cortex-A53: the fastest software
+    # cipher, a cheap MAC, and elliptic curve key exchange for quick set-up
+    'arm': {
+        'ciphers': ('aes128-ctr',),
+        'digests': ('hmac-sha1', 'hmac-sha2-256'),
+        'kex': ('curve25519-sha256@libssh.org', 'ecdh-sha2-nistp256'),
+    },
+
+    # Strongest available, for when transfer time doesn't matter
+    'strong': {
+        'ciphers': ('aes256-ctr',),
+        'digests': ('hmac-sha2-512-etm@openssh.com', 'hmac-sha2-512'),
+        'kex': ('curve25519-sha256@libssh.org', 'diffie-hellman-group16-sha512'),
+    },
+}
+
+# Transport security option for each kind of algorithm
+KINDS = ('ciphers', 'digests', 'kex')
+
+def resolve(profile):
+    """
+    Profile name or {kind: preferred algorithms} dict to a profile dict
+    """
+    if profile == None:
+        return {}
+    if isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        logging.warning("Unknown crypto profile %s, using paramiko defaults" % (profile))
+        return {}
+    return PROFILES[profile]
+
+def apply(transport, profile):
+    """
+    Reorder a transport's algorithm preferences, must be called before connect()
+    """
+    options = transport.get_security_options()
+    for kind in KINDS:
+        preferred = profile.get(kind)
+        if not preferred:
+            continue
+
+        supported = getattr(options, kind)
+        chosen = [a for a in preferred if a in supported]
+        if not chosen:
+            logging.warning("No supported %s in crypto profile, using paramiko defaults" % (kind))
+            continue
+        if not profile.get('strict'):
+            chosen += [a for a in supported if a not in chosen]
+        setattr(options, kind, tuple(chosen))
@@ -5,9 +5,16 @@ import random
 import time
 import threading
 
+from ..history import StationHistory
+from ..tracing import tracer
+from .budget import TransferBudget
 from .timer import Timer
 from .download import Download
+from .download_process import DownloadProcess
+from .progress import Progress
+from .resolver import StationResolver
 from .xbee import XBee
+from .xbee_scheduler import XBeeScheduler
 
 class DataStationHandler(object):
     """Communication handler for data stations (XBee station wakeup and SFTP download)
@@ -17,22 +24,75 @@ class DataStationHandler(object):
 
     SFTP Download:
         Each download is spawned as a worker thread to isolate the effect
-        of failure in case of unexpected socket exceptions.
+        of failure in case of unexpected socket exceptions. With
+        `_isolate_download` the worker is a separate process instead, which
+        is killed outright if it outlives the overall download timeout.
 
     XBee Wakeup:
         When the UAV arrives at a data station, the station is woken up with
         an XBee RF signal including its data station ID ('redwood', 'streetcat', etc.)
 
+        Every session's commands go through one XBeeScheduler, which
+        interleaves stations on the serial link and sends POWER_ON first.
+        A session hands its station's POWER_OFF to the scheduler and is
+        done; `shutdowns` tracks each until it's acknowledged.
+
+    Station addresses are cached between flights (see StationResolver), so
+    connecting doesn't wait on mDNS.
+
+    Each visit's wake, connect and transfer performance is recorded in the
+    station history, which sizes the next visit's POWER_ON retry window and
+    download timeout.
+
+    Sessions:
+        Navigation queues every station in Wi-Fi range of the same loiter
+        point at once. Each gets a session thread of its own that wakes,
+        downloads from and shuts down its station, with up to MAX_SESSIONS
+        downloading at a time. Their transfers share TRANSFER_SLOTS and, if
+        set, BANDWIDTH_BYTES_PER_SEC between them.
+
     """
 
+    # POWER_ON retry window for stations without history
+    WAKE_TIMEOUT_SECS = 240
+
+    # Shortest download timeout, however little a station is expected to hold
+    MIN_DOWNLOAD_TIMEOUT_SECS = 120
+
+    # Retry window for a station's POWER_OFF, which runs in the background
+    POWER_OFF_TIMEOUT_SECS = 20
+
+    # Stations downloading at once, and the transfers and bandwidth they share
+    MAX_SESSIONS = 3
+    TRANSFER_SLOTS = 6
+    BANDWIDTH_BYTES_PER_SEC = None
+
     def __init__(self, _connection_timeout_millis, _read_write_timeout_millis,
-        _overall_timeout_millis, _rx_queue):
+        _overall_timeout_millis, _rx_queue, _isolate_download=False, _history=None, _resolver=None,
+        _xbee=None):
 
         self.connection_timeout_millis = _connection_timeout_millis
         self.read_write_timeout_millis = _read_write_timeout_millis
         self.overall_timeout_millis = _overall_timeout_millis
         self.rx_queue = _rx_queue
-        self.xbee = XBee()
+        self.isolate_download = _isolate_download
+        if self.isolate_download:
+            DownloadProcess.start_server()
+        self.xbee = _xbee if _xbee != None else XBee()
+        self.history = _history if _history != None else StationHistory()
+
+        # Data station ID -> (host, port), for stations not found by hostname
+        self.station_addresses = {}
+        self.resolver = _resolver if _resolver != None else StationResolver()
+
+        self.budget = TransferBudget(self.TRANSFER_SLOTS, self.BANDWIDTH_BYTES_PER_SEC)
+        self._downloads = threading.BoundedSemaphore(self.MAX_SESSIONS)
+
+        # Commands for every session's station share the one XBee link
+        self.xbee_scheduler = XBeeScheduler(self.xbee)
+        self.shutdowns = {}                      # Data station ID -> its latest POWER_OFF XBeeCommand
+        self._awake = 0                          # Sessions from wakeup until their station's shutdown is handed off
+        self._awake_lock = threading.Lock()
         self._alive = True
 
     def connect(self):
@@ -50,7 +110,7 @@ class DataStationHandler(object):
 
             # Do the thing
             is_downloading.set()
-            self._wake_download_and_sleep(wakeup_event, download_event, is_downloading, is_awake)
+            self._serve_stations(wakeup_event, download_event, is_downloading, is_awake)
             new_ds.clear()
             is_downloading.clear()
 
@@ -60,39 +120,104 @@ class DataStationHandler(object):
         logging.info("Stopping data station handler...")
         self._alive = False
 
-    def _wake_download_and_sleep(self, wakeup_event, download_event, is_downloading, is_awake):
-
-        # Get data station ID as message from rx_queue
-        data_station_id = self.rx_queue.get().strip() # Removes invisible characters
+        # Don't leave stations running
+        if not self.wait_for_shutdowns(self.POWER_OFF_TIMEOUT_SECS):
+            logging.error("Data station shutdowns still under way")
+        self.xbee_scheduler.stop()
+
+    def _serve_stations(self, wakeup_event, download_event, is_downloading, is_awake):
+        """
+        Service every station navigation has queued, each in a session of
+        its own, and return when all of them are done
+        """
+        data_station_ids = [self.rx_queue.get()]
+        while True:
+            try:
+                data_station_ids.append(self.rx_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(data_station_ids) == 1:
+            self._wake_download_and_sleep(wakeup_event, download_event, is_downloading, is_awake,
+                                          data_station_ids[0])
+            return
+
+        logging.info("Servicing %i data stations at once: %s", len(data_station_ids),
+                     ', '.join(i.strip() for i in data_station_ids))
+
+        sessions = []
+        for data_station_id in data_station_ids:
+            session = threading.Thread(target=self._wake_download_and_sleep,
+                                       args=(wakeup_event, download_event, is_downloading, is_awake,
+                                             data_station_id),
+                                       name='Session %s' % data_station_id.strip())
+            session.daemon = True
+            session.start()
+            sessions.append(session)
+
+        for session in sessions:
+            session.join()
+
+    def _wake_download_and_sleep(self, wakeup_event, download_event, is_downloading, is_awake,
+        data_station_id=None):
+
+        # Get data station ID as message from rx_queue, unless already taken from it
+        if data_station_id == None:
+            data_station_id = self.rx_queue.get()
+        data_station_id = data_station_id.strip() # Removes invisible characters
 
         logging.info('Data station arrival: %s', data_station_id)
 
         # Wait for navigation to give the wakeup goahead
-        wakeup_event.wait()
+        with tracer.span('wait for wakeup', 'session', station=data_station_id):
+            wakeup_event.wait()
+
+        # Nothing is downloaded in testing and development
+        simulated = os.getenv('TESTING') == 'True' or os.getenv('DEVELOPMENT') == 'True'
+
+        # Look the station up again while it boots, in case its address has changed
+        if data_station_id not in self.station_addresses and not simulated:
+            self.resolver.refresh(data_station_id)
 
         # Wake up data station
-        logging.info('Waking up over XBee...')
-        self.xbee.send_command(data_station_id, 'POWER_ON')
-
-        xbee_wake_command_timer = Timer()
-        wakeup_successful = True
-        if not (os.getenv('TESTING') == 'True'):
-            while not self.xbee.acknowledge(data_station_id, 'POWER_ON'):
-                logging.debug("POWER_ON data station %s", data_station_id)
-                self.xbee.send_command(data_station_id, 'POWER_ON')
-                time.sleep(0.5) # Try again in 0.5s
-
-                # Will try waking up data station over XBee for minimum 4 min before moving on
-                if download_event.is_set() and xbee_wake_command_timer.time_elapsed() > 240:
-                    wakeup_successful = False
+        with tracer.span('wake', 'session', station=data_station_id) as span:
+            logging.info('Waking up over XBee...')
+            wake_started = time.monotonic()
+            wake_secs = None
+
+            # Sent until acknowledged, ahead of any other station's shutdown
+            testing = os.getenv('TESTING') == 'True'
+            power_on = self.xbee_scheduler.submit(data_station_id, 'POWER_ON', expect_ack=not testing)
+
+            xbee_wake_command_timer = Timer()
+            wake_timeout = self.history.wake_timeout(data_station_id, self.WAKE_TIMEOUT_SECS)
+            wakeup_successful = True
+            if not testing:
+                while not power_on.wait(0.5):
+                    # Will try waking up data station over XBee for minimum 4 min (longer for
+                    # stations known to boot slowly) before moving on
+                    if download_event.is_set() and xbee_wake_command_timer.time_elapsed() > wake_timeout:
+                        power_on.cancel()
+                        break
+                wakeup_successful = power_on.acknowledged == True
+
+                wake_secs = time.monotonic() - wake_started
+                if wakeup_successful:
+                    logging.info("Data station %s awake after %.1f s", data_station_id, wake_secs)
+                else:
                     logging.error("POWER_ON command ACK failure. Moving on...")
-                    break
+                    # Still asleep, so booting takes at least this long
+                    self.history.record(data_station_id, wake_secs, completed=False)
+            span.args['acknowledged'] = wakeup_successful
 
-        is_awake.set()
-        download_event.wait()
+        with self._awake_lock:
+            self._awake += 1
+            is_awake.set()
+        with tracer.span('wait for download', 'session', station=data_station_id):
+            download_event.wait()
 
         # Don't actually download
-        if (os.getenv('TESTING') == 'True' or os.getenv('DEVELOPMENT') == 'True'):
+        if simulated:
             r = random.randint(10,20)
 
             logging.debug('Simulating download for %i seconds', r)
@@ -103,47 +228,124 @@ class DataStationHandler(object):
 
             logging.info('XBee ACK received, beginning download...')
 
-            # '.local' ensures visibility on the network
-            download_worker = Download(data_station_id.strip()+'.local',
-                                       self.connection_timeout_millis)
-
-            try:
-                # This throws an error if the connection times out
-                download_worker.start()
-
-                # Attempt to join the thread after timeout.
-                download_worker.join(self.overall_timeout_millis/1000)
-
-                # If still alive, we know that the download timed out.
-                if download_worker.is_alive():
-                    logging.info("Download timeout: Download cancelled")
+            download_timeout = self.history.download_timeout(data_station_id, self.MIN_DOWNLOAD_TIMEOUT_SECS,
+                                                             self.overall_timeout_millis/1000)
+            backlog = self.history.expected_backlog(data_station_id)
+            if backlog != None:
+                logging.info("Expecting about %i bytes, allowing %i s", backlog, download_timeout)
+
+            # Other sessions may be using all the download slots, for no longer
+            # than this station's download would have been allowed
+            with tracer.span('wait for download slot', 'session', station=data_station_id) as span:
+                slot = self._downloads.acquire(timeout=download_timeout)
+                span.args['acquired'] = slot
+
+            if not slot:
+                logging.error("No download slot free after %i s, skipping data station %s",
+                              download_timeout, data_station_id)
+                self.history.record(data_station_id, wake_secs, completed=False)
+            else:
+                share = self.budget.join()
+
+                progress = Progress()
+                address = self.station_addresses.get(data_station_id)
+
+                # '.local' ensures visibility on the network
+                if self.isolate_download:
+                    download_worker = DownloadProcess(data_station_id.strip()+'.local',
+                                                      self.connection_timeout_millis, progress, address, share,
+                                                      self.resolver)
                 else:
-                    logging.info("Download complete")
-
-            except Exception as e:
-                logging.error(e)
-
-        # Wake up data station
+                    download_worker = Download(data_station_id.strip()+'.local',
+                                               self.connection_timeout_millis, progress, address, share,
+                                               self.resolver)
+
+                completed = False
+                try:
+                    with tracer.span('download', 'session', station=data_station_id, timeout=download_timeout) as span:
+                        # This throws an error if the connection times out
+                        download_worker.start()
+
+                        # Attempt to join the thread after timeout.
+                        download_worker.join(download_timeout)
+
+                        # If still alive, we know that the download timed out.
+                        if download_worker.is_alive():
+                            logging.info("Download timeout: Download cancelled")
+                            if self.isolate_download:
+                                download_worker.cancel()
+                        else:
+                            logging.info("Download complete")
+                            completed = True
+                        span.args.update(completed=completed, files=progress.files_completed,
+                                         bytes=progress.bytes_transferred)
+
+                except Exception as e:
+                    logging.error(e)
+                finally:
+                    if download_worker.is_alive():
+                        # A download thread can't be stopped, so its transfers keep their share until it ends
+                        self._release_when_stopped(data_station_id, download_worker, share)
+                    else:
+                        self.budget.leave(share)
+                        self._downloads.release()
+                    if self.isolate_download:
+                        download_worker.finish()
+
+                logging.info("Transferred %i files (%i bytes) from data station %s",
+                             progress.files_completed, progress.bytes_transferred, data_station_id)
+
+                self._record_visit(data_station_id, wake_secs, progress, completed)
+
+        # Shut the data station down in the background, so the next one needn't wait.
+        # If it actually turned on and we're not in test mode, keep at it until it ACKs.
         logging.info('Shutting down data station %s...', data_station_id)
-        self.xbee.send_command(data_station_id, 'POWER_OFF')
-
-        xbee_sleep_command_timer = Timer()
-        # If the data station actually turned on and we're not in test mode, shut it down
-        if not ((os.getenv('TESTING') == 'True') or os.getenv('DEVELOPMENT') == 'True') and \
-            (wakeup_successful == True):
-            while not self.xbee.acknowledge(data_station_id, 'POWER_OFF'):
-                logging.debug("POWER_OFF data station %s", data_station_id)
-                self.xbee.send_command(data_station_id, 'POWER_OFF')
-                time.sleep(0.5) # Try again in 0.5s
+        expect_ack = not ((os.getenv('TESTING') == 'True') or os.getenv('DEVELOPMENT') == 'True') and \
+            (wakeup_successful == True)
+        self.shutdowns[data_station_id] = self.xbee_scheduler.submit(data_station_id, 'POWER_OFF',
+                                                                     self.POWER_OFF_TIMEOUT_SECS, expect_ack)
 
-                # Will try shutting down data station over XBee for 20 seconds before moving on
-                if xbee_sleep_command_timer.time_elapsed() > 20:
-                    logging.error("POWER_OFF command ACK failure")
-                    break
-
-        is_awake.clear()
+        with self._awake_lock:
+            self._awake -= 1
+            if self._awake == 0:
+                is_awake.clear()
 
         # Mark task as complete, even if it fails
         self.rx_queue.task_done()
 
         logging.debug("Moving on...")
+
+    def _release_when_stopped(self, data_station_id, download_worker, share):
+        def release():
+            download_worker.join()
+            logging.info("Timed out download from data station %s finished", data_station_id)
+            self.budget.leave(share)
+            self._downloads.release()
+
+        releaser = threading.Thread(target=release, name='Release %s' % data_station_id)
+        releaser.daemon = True
+        releaser.start()
+
+    def wait_for_shutdowns(self, timeout=None):
+        """
+        Wait for every station's POWER_OFF to be acknowledged or given up
+        on, return whether they all were
+        """
+        deadline = time.monotonic() + timeout if timeout != None else None
+        for command in list(self.shutdowns.values()):
+            if not command.wait(max(deadline - time.monotonic(), 0) if deadline != None else None):
+                return False
+        return True
+
+    def _record_visit(self, data_station_id, wake_secs, progress, completed):
+        # Nothing to learn about the link or backlog if we never connected
+        if progress.connect_secs == None:
+            self.history.record(data_station_id, wake_secs, completed=False)
+            return
+
+        throughput = None
+        if progress.bytes_transferred > 0 and progress.transfer_secs > 0:
+            throughput = progress.bytes_transferred / progress.transfer_secs
+
+        self.history.record(data_station_id, wake_secs, progress.connect_secs, throughput,
+                            progress.bytes_transferred, completed)
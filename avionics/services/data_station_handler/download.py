@@ -1,8 +1,16 @@
 import logging
+import os
+import queue
+import random
 import threading
+import time
 
+from ..catalog import Catalog
+from ..tracing import tracer
+from .link_controller import LinkController
 from .sftp import SFTPClient
 from .timer import Timer
+from .wireless import WirelessSignal
 
 class Download(threading.Thread):
 
@@ -10,61 +18,223 @@ class Download(threading.Thread):
     An instance of this class is created when the payload is notified that
     the UAV has reached the data station. It handles downloading (and errors)
     and then exits when the download is complete.
+
+    Connecting races staggered attempts: while one is still waiting on a
+    station that's booting, another starts every ATTEMPT_STAGGER_SECS, up
+    to ATTEMPTS_IN_FLIGHT at once. The first to authenticate is kept and
+    any others are closed as they finish. After an attempt fails, the next
+    waits an exponentially growing, jittered backoff so a station still
+    bringing up sshd isn't hammered. Every attempt is kept in `attempts`
+    and logged.
     """
 
-    def __init__(self, _data_station_id, _connection_timeout_millis=120000):
+    ATTEMPT_STAGGER_SECS = 2
+    ATTEMPTS_IN_FLIGHT = 3
+    BACKOFF_INITIAL_SECS = 0.5
+    BACKOFF_MAX_SECS = 8
+
+    # Remove field data from the data station once it's downloaded and
+    # verified, overridden by the DELETE_AFTER_DOWNLOAD environment variable
+    DELETE_AFTER_DOWNLOAD = False
+
+    def __init__(self, _data_station_id, _connection_timeout_millis=120000, _progress=None,
+        _address=None, _share=None, _resolver=None, _catalog=None):
 
         super(Download, self).__init__()
 
         self.__data_station_id = _data_station_id # Reference to DataStation object monitored by Navigation
         self.__connection_timeout_millis = _connection_timeout_millis
+        self.__progress = _progress
+
+        # Connection attempts: {'attempt', 'started', 'ended' (s since connecting began), 'result', 'error'}
+        self.attempts = []
+
+        # Files are indexed as they arrive
+        self.__catalog = _catalog if _catalog != None else Catalog()
 
         # TODO: change this to dynamically distribute required certificate
-        self.__sftp = SFTPClient('pi', 'raspberry', self.__data_station_id)
+        self.__sftp = SFTPClient('pi', 'raspberry', self.__data_station_id, _progress,
+                                 self.__catalog, _address, _share=_share, _resolver=_resolver)
+
+        # Link adaptation needs the progress counters to measure throughput
+        self.__link_controller = None
+        if _progress != None:
+            self.__link_controller = LinkController(_progress, WirelessSignal(), _share)
 
     def _connect(self):
+        with tracer.span('connect', 'download', station=self.__data_station_id) as span:
+            try:
+                self._keep_connecting()
+            finally:
+                span.args['attempts'] = len(self.attempts)
+
+    def _keep_connecting(self):
         # Try to connect until SFTP client is connected or timeout event happens
         data_station_connection_timer = Timer()
         while not self.__sftp.is_connected:
 
-            if data_station_connection_timer.time_elapsed() > self.__connection_timeout_millis/1000:
+            remaining = self.__connection_timeout_millis/1000 - data_station_connection_timer.time_elapsed()
+            transport = self._race(remaining) if remaining > 0 else None
+            if transport == None:
                 logging.error("Connection to data station %s failed permanently" % (self.__data_station_id))
                 break
 
             # Sets low level SSH socket read/write timeout for all operations (listdir, get, etc)
-            self.__sftp.connect()
+            self.__sftp.connect(transport=transport)
+            if not self.__sftp.is_connected:
+                transport.close()
+
+        self._log_attempts()
 
         #self.__sftp.downloadAllFieldData()
         # Throw an error to tell navigation to continue on
         if not self.__sftp.is_connected:
             raise Exception("Connection Timeout")
 
+        if self.__progress != None:
+            self.__progress.connected()
 
-    def _start(self):
+
+    def _race(self, timeout):
         """
-        For desired data station:
-            1) Download field data and data station logs to drone
-            2) Delete successfully transferred field data and logs from data station
+        Open transports with staggered, backed off attempts until one
+        authenticates, return it (None if none did within `timeout`)
         """
+        started = time.monotonic()
+        deadline = started + timeout
+        results = queue.Queue()
+        lock = threading.Lock()
+        finished = []               # Set once the race is decided, for attempts still under way
+
+        def attempt(record):
+            try:
+                with tracer.span('attempt', 'download', station=self.__data_station_id, attempt=record['attempt']):
+                    transport = self.__sftp.openTransport()
+            except Exception as e:
+                with lock:
+                    record.update(ended=time.monotonic() - started, result='failed', error=str(e))
+                results.put((record, None))
+                return
+
+            # Handed over under the lock, or the race could be decided and the results
+            # drained between our check and the put, leaving the transport open
+            with lock:
+                record['ended'] = time.monotonic() - started
+                if finished:
+                    record['result'] = 'closed'
+                    transport.close()
+                    return
+                results.put((record, transport))
+
+        winner = None
+        in_flight = 0
+        failures = 0
+        next_attempt = started
+        while winner == None:
+            now = time.monotonic()
+            if now >= deadline:
+                break
 
-        # Prioritizes field data transfer over log data
-        self.__sftp.downloadAllFieldData()
-        #self.__sftp.downloadAllLogData()
+            if in_flight < self.ATTEMPTS_IN_FLIGHT and now >= next_attempt:
+                record = {'attempt': len(self.attempts) + 1, 'started': now - started, 'ended': None,
+                          'result': 'pending', 'error': None}
+                self.attempts.append(record)
+                thread = threading.Thread(target=attempt, args=(record,),
+                                          name='Connect %s #%i' % (self.__data_station_id, record['attempt']))
+                thread.daemon = True
+                thread.start()
+                in_flight += 1
+                next_attempt = now + self.ATTEMPT_STAGGER_SECS
+
+            wait = min(next_attempt, deadline) - time.monotonic()
+            if in_flight >= self.ATTEMPTS_IN_FLIGHT:
+                wait = deadline - time.monotonic()
+            try:
+                record, transport = results.get(timeout=max(wait, 0.01))
+            except queue.Empty:
+                continue
+
+            in_flight -= 1
+            if transport != None:
+                record['result'] = 'connected'
+                winner = transport
+            else:
+                failures += 1
+                next_attempt = time.monotonic() + self._backoff(failures)
+
+        with lock:
+            finished.append(True)
+            for record in self.attempts:
+                if record['result'] == 'pending':
+                    record['result'] = 'abandoned'
+
+        # Authenticated after the winner, or too late
+        while True:
+            try:
+                record, transport = results.get_nowait()
+            except queue.Empty:
+                break
+            if transport != None:
+                record['result'] = 'closed'
+                transport.close()
 
-        logging.info("Download complete")
+        return winner
 
-        logging.debug("Beginning removal of successfully transferred files...")
+    def _backoff(self, failures):
+        """Seconds to wait after the latest of `failures` failed attempts in a row"""
+        backoff = min(self.BACKOFF_INITIAL_SECS * 2**(failures - 1), self.BACKOFF_MAX_SECS)
+        # Jittered over its upper half, so retries don't fall into step with the station's boot
+        return random.uniform(backoff/2, backoff)
 
-        # Removes only files that are successfully transferred to vehicle
-        # TODO: uncomment this out when system is more stable
-        # self.__sftp.deleteAllFieldData()
-        # self.__sftp.deleteAllLogData()
+    def _log_attempts(self):
+        for record in self.attempts:
+            logging.info("Connection attempt %i to %s: %.2f-%s s %s%s", record['attempt'], self.__data_station_id,
+                         record['started'], '%.2f' % record['ended'] if record['ended'] != None else '?',
+                         record['result'], ' (%s)' % record['error'] if record['error'] else '')
 
-        #logging.info("Removal of successfully transferred files complete")
+    def _start(self):
+        """
+        For desired data station:
+            1) Download field data and data station logs to drone
+            2) Delete successfully transferred field data and logs from data station
+        """
 
-        # Close connection to data station
-        logging.debug("Closing SFTP connection...")
-        self.__sftp.close()
+        delete = (os.getenv('DELETE_AFTER_DOWNLOAD') or str(self.DELETE_AFTER_DOWNLOAD)) == 'True'
+
+        try:
+            try:
+                # Prioritizes field data transfer over log data
+                if self.__link_controller != None:
+                    self.__link_controller.start()
+                try:
+                    with tracer.span('field data', 'download', station=self.__data_station_id):
+                        self.__sftp.downloadAllFieldData(self.__link_controller, delete)
+                finally:
+                    if self.__link_controller != None:
+                        self.__link_controller.stop()
+                with tracer.span('log data', 'download', station=self.__data_station_id):
+                    self.__sftp.downloadAllLogData()
+
+                logging.info("Download complete")
+            finally:
+                # Finish indexing what's been downloaded, even if not all of
+                # it, while the segment store (if any) is still open to read from
+                with tracer.span('index', 'download', station=self.__data_station_id):
+                    self.__catalog.close()
+
+            # Removes only files that are successfully transferred to vehicle and
+            # indexed, started as each was, so this waits for the last few
+            if delete:
+                logging.debug("Finishing removal of successfully transferred files...")
+                with tracer.span('delete', 'download', station=self.__data_station_id):
+                    self.__sftp.deleteAllFieldData()
+                    self.__sftp.deleteAllLogData()
+                logging.info("Removal of successfully transferred files complete")
+        finally:
+            # Close connection to data station, waiting for any removals
+            # already started
+            logging.debug("Closing SFTP connection...")
+            self.__sftp.close()
 
 
     def run(self):
@@ -0,0 +1,155 @@
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import pickle
+import signal
+import tempfile
+import uuid
+
+from ..catalog import Catalog
+from ..tracing import tracer
+from .download import Download
+from .link_controller import LinkController
+from .remote_delete import RemoteDeleter
+from .sftp import SFTPClient
+
+# Download processes are forked from a server process started early and
+# single-threaded, not from the handler, whose other threads may hold locks
+# (logging's, the XBee's) that a forked child would find held forever
+_context = multiprocessing.get_context('forkserver')
+_context.set_forkserver_preload(['paramiko'])
+
+# Whose class-level settings (paths, limits) a download process is given as
+# they are here, overrides included
+_CONFIGURED = (Catalog, Download, LinkController, RemoteDeleter, SFTPClient)
+
+class DownloadProcess(_context.Process):
+
+    """
+    Runs a Download in a separate process rather than a thread.
+
+    A download thread can't be stopped once it's past its timeout, so a
+    stuck transfer keeps using the link (and the GIL) while the next data
+    station is being serviced. A process can be killed outright, and its
+    SSH crypto and compression run on another core. Progress is reported
+    through the shared memory counters of a Progress object.
+
+    The process starts out with this one's environment and settings, and
+    its log records are handled here. It traces into its own tracer, which
+    it leaves in a file for finish() to merge into ours once it's done.
+    """
+
+    TERMINATE_GRACE_SECS = 2
+
+    def __init__(self, _data_station_id, _connection_timeout_millis, _progress, _address=None,
+        _share=None, _resolver=None):
+
+        super(DownloadProcess, self).__init__()
+
+        self.name = 'Download'
+        self.daemon = True
+
+        self.__data_station_id = _data_station_id
+        self.__connection_timeout_millis = _connection_timeout_millis
+        self.progress = _progress
+        self.__address = _address
+        self.__share = _share
+        self.__resolver = _resolver
+
+        self.__environment = dict(os.environ)
+        self.__settings = [(cls, name, value) for cls in _CONFIGURED
+                           for name, value in vars(cls).items() if name.isupper()]
+
+        self.__log_levels = dict((name, logger.level) for name, logger in logging.root.manager.loggerDict.items()
+                                 if isinstance(logger, logging.Logger) and logger.level)
+        self.__log_levels[None] = logging.getLogger().level
+        self.__log_queue = _context.Queue()
+        self.__log_listener = logging.handlers.QueueListener(self.__log_queue, *logging.getLogger().handlers,
+                                                             respect_handler_level=True)
+
+        # Written by the process as it exits, removed once collected
+        self.__trace_path = os.path.join(tempfile.gettempdir(), 'download-trace-%s' % uuid.uuid4().hex)
+
+    @staticmethod
+    def start_server():
+        """
+        Start the server processes are forked from, which would otherwise
+        start with the first of them. It imports the main module as it is
+        started, in the environment of the time, and each process again.
+        """
+        multiprocessing.forkserver.ensure_running()
+
+    def start(self):
+        self.__log_listener.start()
+        super(DownloadProcess, self).start()
+
+    def run(self):
+        # SIGINT is for the parent to handle, it will cancel us if needed
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        os.environ.clear()
+        os.environ.update(self.__environment)
+        for cls, name, value in self.__settings:
+            setattr(cls, name, value)
+
+        logging.getLogger().handlers = [logging.handlers.QueueHandler(self.__log_queue)]
+        for name, level in self.__log_levels.items():
+            logging.getLogger(name).setLevel(level)
+
+        # Only what happens in here, the parent already has the rest
+        tracer.clear()
+
+        try:
+            # Paramiko objects must be created on this side of the fork
+            download = Download(self.__data_station_id, self.__connection_timeout_millis, self.progress,
+                                self.__address, self.__share, self.__resolver)
+            download.run()
+        finally:
+            with open(self.__trace_path, 'wb') as f:
+                pickle.dump(tracer.events(), f)
+
+    def finish(self):
+        """
+        Once the process has stopped, handle the last of its log records and
+        merge the spans it recorded into the tracer
+        """
+        self.__log_listener.stop()
+
+        try:
+            with open(self.__trace_path, 'rb') as f:
+                events, threads = pickle.load(f)
+            tracer.merge(events, threads)
+        except (IOError, EOFError, pickle.UnpicklingError) as e:
+            logging.warning("No trace from download process %s: %s", self.pid, e)
+        finally:
+            try:
+                os.remove(self.__trace_path)
+            except OSError:
+                pass
+
+    def __getstate__(self):
+        # The listener and our log handlers stay on this side
+        state = self.__dict__.copy()
+        del state['_DownloadProcess__log_listener']
+        return state
+
+    def cancel(self):
+        """
+        Stop the download process and remove the partially written files
+        """
+        if self.is_alive():
+            logging.info("Terminating download process %s", self.pid)
+            self.terminate()
+            self.join(self.TERMINATE_GRACE_SECS)
+
+        if self.is_alive():
+            logging.warning("Download process %s ignored SIGTERM, killing", self.pid)
+            os.kill(self.pid, signal.SIGKILL)
+            self.join()
+
+        for partial_file in self.progress.files_in_flight:
+            if os.path.exists(partial_file):
+                logging.info("Removing partial download: %s", partial_file)
+                os.remove(partial_file)
@@ -0,0 +1,136 @@
+import collections
+import logging
+import threading
+import time
+
+class LinkController(threading.Thread):
+
+    """
+    Adapts transfer behaviour to the link as the UAV circles the data station.
+
+    Samples rolling throughput (from the download's Progress counters),
+    stalls, Wi-Fi retries and signal level once per sample period. While the
+    link is fading, concurrency is halved and no new large file may start;
+    while it's healthy, concurrency is increased one transfer at a time.
+    Near the edge of range, small files are preferred so that what does get
+    through is complete.
+
+    Transfer workers call acquire() before starting a file and release()
+    when it's done; a transfer that could use more transports (a striped
+    file) takes what's free with acquire_free(). Given a share of the global
+    transfer budget, concurrency never exceeds what the share allows.
+    """
+
+    SAMPLE_PERIOD_SECS = 1
+    THROUGHPUT_WINDOW_SECS = 5
+    STALL_SECS = 5
+
+    MAX_CONCURRENCY = 4
+    LARGE_FILE_BYTES = 5*1024*1024
+
+    FADE_RSSI_DBM = -80              # Below this the link is fading
+    EDGE_RSSI_DBM = -72              # Below this we're near the edge of range
+    FADE_RETRIES_PER_SAMPLE = 50     # Retry bursts precede most fades
+
+    def __init__(self, _progress, _signal, _share=None):
+
+        super(LinkController, self).__init__()
+
+        self.name = 'Link Controller'
+        self.daemon = True
+
+        self.progress = _progress
+        self.signal = _signal
+        self.share = _share
+
+        self.concurrency = 1
+        self.fading = False
+        self.near_edge = False
+        self.throughput = 0.0        # Bytes per second over the rolling window
+
+        self._samples = collections.deque()
+        self._last_retries = None
+        self._active = 0
+        self._condition = threading.Condition()
+        self._alive = True
+
+    def run(self):
+        while self._alive:
+            self.sample()
+            time.sleep(self.SAMPLE_PERIOD_SECS)
+
+    def stop(self):
+        self._alive = False
+        with self._condition:
+            self._condition.notify_all()
+
+    @property
+    def prefer_small_files(self):
+        return self.fading or self.near_edge
+
+    def acquire(self, size):
+        """Block until a transfer of the given size may start"""
+        with self._condition:
+            while self._alive and (self._active >= self.limit or
+                                   (self.fading and size >= self.LARGE_FILE_BYTES)):
+                self._condition.wait(self.SAMPLE_PERIOD_SECS)
+            self._active += 1
+
+    def acquire_free(self, count):
+        """Take up to `count` more transfers without waiting, return how many were taken"""
+        with self._condition:
+            taken = max(0, min(count, self.limit - self._active))
+            self._active += taken
+            return taken
+
+    @property
+    def limit(self):
+        """Transfers allowed at once, by the link and by the budget"""
+        if self.share == None:
+            return self.concurrency
+        return min(self.concurrency, self.share.concurrency)
+
+    def release(self, count=1):
+        with self._condition:
+            self._active -= count
+            self._condition.notify_all()
+
+    def sample(self):
+        """Update link state and adjust concurrency"""
+        now = time.monotonic()
+        previous_throughput = self.throughput
+
+        self._samples.append((now, self.progress.bytes_transferred))
+        while now - self._samples[0][0] > self.THROUGHPUT_WINDOW_SECS:
+            self._samples.popleft()
+
+        (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+        self.throughput = (b1-b0)/(t1-t0) if t1 > t0 else 0.0
+
+        rssi, retries = self.signal.read()
+        retry_burst = False
+        if retries != None:
+            if self._last_retries != None:
+                retry_burst = retries - self._last_retries > self.FADE_RETRIES_PER_SAMPLE
+            self._last_retries = retries
+
+        stalled = self._active > 0 and self.progress.seconds_since_update() > self.STALL_SECS
+
+        with self._condition:
+            self.near_edge = rssi != None and rssi < self.EDGE_RSSI_DBM
+            fading = stalled or retry_burst or (rssi != None and rssi < self.FADE_RSSI_DBM)
+
+            if fading:
+                self.concurrency = max(1, self.concurrency//2)
+            elif not self.near_edge and self._active >= self.concurrency and \
+                self.throughput >= previous_throughput:
+                # Only grow while we're using what we have and it's paying off
+                self.concurrency = min(self.MAX_CONCURRENCY, self.concurrency+1)
+
+            if fading != self.fading:
+                logging.info("Link %s [rssi: %s dBm, throughput: %i B/s, concurrency: %i]",
+                             'fading' if fading else 'recovered', rssi, self.throughput,
+                             self.concurrency)
+            self.fading = fading
+
+            self._condition.notify_all()
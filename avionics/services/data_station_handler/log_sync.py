@@ -0,0 +1,78 @@
+import hashlib
+import json
+import logging
+import os
+
+class LogSyncState(object):
+    """
+    Remembers how much of each data station log file has been fetched.
+
+    Data station logs only ever grow by appending, so after the first visit
+    only the tail past the recorded offset needs to come over the link. A
+    fingerprint of the start of each file detects rotation, which (like
+    truncation) means the next fetch has to be a full one.
+
+    State is kept as JSON next to the local copies of the logs.
+    """
+
+    STATE_FILE = '.sync-state.json'
+    HEAD_BYTES = 512
+
+    def __init__(self, local_directory):
+        self.local_directory = local_directory
+        self.path = os.path.join(local_directory, self.STATE_FILE)
+
+        self._files = {}
+        try:
+            with open(self.path) as f:
+                self._files = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def resume_offset(self, file_name, remote_size):
+        """
+        Return the offset to fetch a file from, 0 meaning a full fetch.
+
+        The caller must still confirm the head fingerprint with
+        head_matches() before appending from a non-zero offset.
+        """
+        entry = self._files.get(file_name)
+        if entry == None:
+            return 0
+
+        # Local copy must be exactly what we recorded, and the remote can't have shrunk
+        local_path = os.path.join(self.local_directory, file_name)
+        if not os.path.exists(local_path) or os.path.getsize(local_path) != entry['offset']:
+            return 0
+        if remote_size < entry['offset']:
+            logging.info("Log %s truncated, fetching in full", file_name)
+            return 0
+
+        return entry['offset']
+
+    def head_length(self, file_name):
+        return self._files[file_name]['head_length']
+
+    def head_matches(self, file_name, head):
+        if hashlib.sha1(head).hexdigest() == self._files[file_name]['head']:
+            return True
+
+        logging.info("Log %s rotated, fetching in full", file_name)
+        return False
+
+    def update(self, file_name, offset):
+        """Record the fetched length of a file from its local copy"""
+        with open(os.path.join(self.local_directory, file_name), 'rb') as f:
+            head = f.read(self.HEAD_BYTES)
+
+        self._files[file_name] = {
+            'offset': offset,
+            'head': hashlib.sha1(head).hexdigest(),
+            'head_length': len(head),
+        }
+
+    def save(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._files, f)
+        os.replace(temporary_path, self.path)
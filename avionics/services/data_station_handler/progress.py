@@ -0,0 +1,124 @@
+"""
+Transfer progress counters shared between the data station handler and its
+download worker, whether that worker is a thread or a separate process.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+
+class Progress(object):
+    """
+    Download progress kept in shared memory so that it stays readable after
+    the worker that updates it has been killed.
+
+    Files are transferred several at a time, each recorded in a slot of its
+    own while it's being written, so all the partial files are known if
+    the worker is killed.
+
+    Only the worker writes the values, so they have no interprocess lock a
+    killed worker could leave held: its threads serialize their updates on
+    a lock of their own, and the handler reads without one.
+    """
+
+    MAX_PATH_LENGTH = 1024
+
+    # Files in flight at once (transfer channels) that can be tracked
+    FILE_SLOTS = 16
+
+    def __init__(self):
+        self._files_completed = multiprocessing.Value('l', 0, lock=False)
+        self._bytes_transferred = multiprocessing.Value('q', 0, lock=False)
+        self._last_update = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self._files = [multiprocessing.Array('c', self.MAX_PATH_LENGTH, lock=False) for _ in range(self.FILE_SLOTS)]
+
+        # Monotonic times, 0 until the worker connects
+        self._started = time.monotonic()
+        self._connected_at = multiprocessing.Value('d', 0.0, lock=False)
+
+        # Local to the process doing the transfers
+        self._lock = threading.Lock()
+
+    def connected(self):
+        """Record that the worker has connected to the data station"""
+        self._connected_at.value = time.monotonic()
+        self._touch()
+
+    def start_file(self, local_path):
+        """
+        Record a local file being written, return its slot for
+        complete_file(), None if there are none free
+        """
+        encoded = local_path.encode('utf-8')[:self.MAX_PATH_LENGTH-1]
+        slot = None
+        with self._lock:
+            for i, path in enumerate(self._files):
+                if not path.value:
+                    path.value = encoded
+                    slot = i
+                    break
+        if slot == None:
+            logging.warning("Too many files in flight to track %s", local_path)
+        self._touch()
+        return slot
+
+    def add_bytes(self, count):
+        with self._lock:
+            self._bytes_transferred.value += count
+        self._touch()
+
+    def complete_file(self, slot):
+        with self._lock:
+            self._files_completed.value += 1
+        self.abandon_file(slot)
+
+    def abandon_file(self, slot):
+        """Stop tracking a file that won't be completed, e.g. on a transfer error"""
+        if slot != None:
+            with self._lock:
+                self._files[slot].value = b''
+        self._touch()
+
+    @property
+    def files_completed(self):
+        return self._files_completed.value
+
+    @property
+    def bytes_transferred(self):
+        return self._bytes_transferred.value
+
+    @property
+    def files_in_flight(self):
+        """Local paths of the files being written"""
+        values = [path.value for path in self._files]
+        return [value.decode('utf-8', 'replace') for value in values if value]
+
+    @property
+    def connect_secs(self):
+        """Seconds from creation to connection, None if never connected"""
+        if not self._connected_at.value:
+            return None
+        return self._connected_at.value - self._started
+
+    @property
+    def transfer_secs(self):
+        """Seconds from connection to the last update, None if never connected"""
+        if not self._connected_at.value:
+            return None
+        return self._last_update.value - self._connected_at.value
+
+    def seconds_since_update(self):
+        return time.monotonic() - self._last_update.value
+
+    def _touch(self):
+        self._last_update.value = time.monotonic()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
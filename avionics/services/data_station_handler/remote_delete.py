@@ -0,0 +1,128 @@
+"""
+Parallel removal of files from a data station.
+
+SFTPClient.remove() waits a full round trip for each file, which over a
+marginal Wi-Fi link adds up to minutes for a few thousand camera trap
+images. Here removals are spread over CHANNELS SFTP channels of their own,
+so that many requests are in flight at once, and each file's result is
+collected as it comes back.
+"""
+
+import logging
+import queue
+import socket
+import threading
+import time
+
+class RemoteDeleter(object):
+
+    """
+    Removes files from the data station as they are queued, on SFTP
+    channels of its own, so clean-up overlaps the rest of the download.
+    finish() waits for everything queued and returns the per-file results.
+
+    `open_sftp` opens a new paramiko SFTPClient on the station's transport.
+    The channels count towards the connection's sessions (sshd allows 10
+    by default), so they're only opened once the first file is queued.
+    """
+
+    CHANNELS = 8
+
+    def __init__(self, open_sftp, data_station_id, channels=CHANNELS):
+        self.__open_sftp = open_sftp
+        self.__data_station_id = data_station_id
+        self.__channels = channels
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__results = {}             # Remote path -> None if removed, else the error
+        self.__started = time.monotonic()
+        self.__workers = []
+
+    def add(self, remote_file):
+        with self.__lock:
+            if not self.__workers:
+                self.__workers = [threading.Thread(target=self._work,
+                                                   name='Delete %s %i' % (self.__data_station_id, i))
+                                  for i in range(self.__channels)]
+                for worker in self.__workers:
+                    worker.daemon = True
+                    worker.start()
+        self.__queue.put(remote_file)
+
+    def finish(self, timeout=None):
+        """Wait for queued removals to complete, return {path: None or error}"""
+        with self.__lock:
+            workers = list(self.__workers)
+        for _ in workers:
+            self.__queue.put(None)
+
+        deadline = time.monotonic() + timeout if timeout != None else None
+        for worker in workers:
+            worker.join(max(deadline - time.monotonic(), 0) if deadline != None else None)
+        if any(worker.is_alive() for worker in workers):
+            logging.warning("Removal of files from data station %s still under way", self.__data_station_id)
+            with self.__lock:
+                return dict(self.__results)
+
+        # Anything left once every channel was lost was never tried
+        while True:
+            try:
+                remote_file = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if remote_file != None:
+                self._result(remote_file, 'not attempted')
+
+        with self.__lock:
+            results = dict(self.__results)
+
+        failed = [path for path, error in results.items() if error != None]
+        for path in failed:
+            logging.warning("Unable to remove %s from data station %s: %s", path, self.__data_station_id,
+                            results[path])
+        logging.info("Removed %i of %i files from data station %s in %.1f s",
+                     len(results) - len(failed), len(results), self.__data_station_id,
+                     time.monotonic() - self.__started)
+        return results
+
+    def _result(self, remote_file, error):
+        with self.__lock:
+            self.__results[remote_file] = error
+
+    def _work(self):
+        from paramiko import SSHException
+
+        try:
+            sftp = self.__open_sftp()
+        except Exception as e:
+            logging.error("Unable to open SFTP channel for removals: %s", e)
+            return
+
+        try:
+            while True:
+                remote_file = self.__queue.get()
+                if remote_file == None:
+                    break
+                try:
+                    sftp.remove(remote_file)
+                    self._result(remote_file, None)
+                except (socket.timeout, ConnectionError, EOFError, SSHException) as e:
+                    # The channel's problem, leave the rest to the others
+                    self._result(remote_file, str(e) or e.__class__.__name__)
+                    break
+                except IOError as e:
+                    # The file's problem, e.g. already gone
+                    self._result(remote_file, str(e) or e.__class__.__name__)
+        finally:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+
+def remove_files(open_sftp, remote_files, data_station_id, channels=RemoteDeleter.CHANNELS):
+    """Remove remote files in parallel, return {path: None if removed, else the error}"""
+    deleter = RemoteDeleter(open_sftp, data_station_id, min(channels, max(len(remote_files), 1)))
+    for remote_file in remote_files:
+        deleter.add(remote_file)
+    return deleter.finish()
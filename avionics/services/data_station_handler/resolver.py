@@ -0,0 +1,167 @@
+"""
+Data station addresses, remembered between flights.
+
+Data stations are found on the ad-hoc network as '<data station ID>.local',
+and an mDNS lookup over a link that has only just come up can take seconds
+or fail outright. A station keeps its address from one visit to the next,
+so connections go straight to the address it last had, and mDNS is only
+the fallback when nothing answers there.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+def lookup(hostname, port, timeout):
+    """
+    IPv4 address of `hostname` (mDNS for '.local' names, through the system
+    resolver), None if it can't be found within `timeout` seconds
+    """
+    result = []
+
+    def resolve():
+        try:
+            addresses = socket.getaddrinfo(hostname, port, socket.AF_INET, socket.SOCK_STREAM)
+            result.append(addresses[0][4][0])
+        except (socket.error, IndexError) as e:
+            logging.debug("Unable to resolve %s: %s", hostname, e)
+
+    # getaddrinfo() has no timeout of its own, so it's left behind if slow
+    resolver = threading.Thread(target=resolve, name='Resolve %s' % hostname)
+    resolver.daemon = True
+    resolver.start()
+    resolver.join(timeout)
+    return result[0] if result else None
+
+
+class StationResolver(object):
+
+    """Data station ID -> IP address cache, kept as JSON between flights
+
+    The data station handler calls refresh() when it starts waking a
+    station, which looks the station up again in the background while it
+    boots, so a changed address is known by the time the download connects.
+    SFTPClient calls resolve() on every connection attempt.
+
+    A copy pickled into a download process keeps what it looks up to
+    itself: only the handler's resolver writes the cache file.
+
+    """
+
+    DEFAULT_PATH = '/srv/flight-data/station-addresses.json'
+    SUFFIX = '.local'
+    PORT = 22
+
+    # Longest a single mDNS lookup may hold up a connection attempt
+    LOOKUP_TIMEOUT_SECS = 5
+
+    # Background lookups keep being retried while the station boots
+    REFRESH_TIMEOUT_SECS = 240
+    REFRESH_RETRY_SECS = 2
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+        self._lock = threading.Lock()
+        self._refreshing = {}       # Data station ID -> background lookup thread
+        self._persist = True
+
+        self._stations = {}
+        try:
+            with open(self.path) as f:
+                self._stations = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def cached(self, data_station_id):
+        """Last known address of a station, None if never resolved"""
+        with self._lock:
+            entry = self._stations.get(data_station_id)
+            return entry['address'] if entry != None else None
+
+    def resolve(self, data_station_id, use_cache=True):
+        """
+        Address of a station as (address, source), where source is 'cache'
+        or 'mdns'. Address is None if the station can't be found.
+        """
+        if use_cache:
+            address = self.cached(data_station_id)
+            if address != None:
+                return address, 'cache'
+
+        # Rather than a second lookup, wait for the one already under way
+        with self._lock:
+            refresh = self._refreshing.get(data_station_id)
+        if refresh != None and refresh.is_alive():
+            refresh.join(self.LOOKUP_TIMEOUT_SECS)
+            address = self.cached(data_station_id)
+            if address != None:
+                return address, 'mdns'
+
+        return self.lookup(data_station_id), 'mdns'
+
+    def lookup(self, data_station_id):
+        """Look a station up over mDNS, updating the cache, return its address or None"""
+        address = lookup(data_station_id + self.SUFFIX, self.PORT, self.LOOKUP_TIMEOUT_SECS)
+        if address != None:
+            self._update(data_station_id, address)
+        return address
+
+    def refresh(self, data_station_id):
+        """Keep looking a station up in the background until it's found or REFRESH_TIMEOUT_SECS pass"""
+        with self._lock:
+            refresh = self._refreshing.get(data_station_id)
+            if refresh != None and refresh.is_alive():
+                return refresh
+
+            refresh = threading.Thread(target=self._refresh, args=(data_station_id,),
+                                       name='Refresh %s' % data_station_id)
+            refresh.daemon = True
+            self._refreshing[data_station_id] = refresh
+        refresh.start()
+        return refresh
+
+    def _refresh(self, data_station_id):
+        started = time.monotonic()
+        while time.monotonic() - started < self.REFRESH_TIMEOUT_SECS:
+            if self.lookup(data_station_id) != None:
+                return
+            time.sleep(self.REFRESH_RETRY_SECS)
+        logging.warning("Data station %s not found over mDNS", data_station_id)
+
+    def _update(self, data_station_id, address):
+        with self._lock:
+            entry = self._stations.get(data_station_id)
+            if entry != None and entry['address'] != address:
+                logging.info("Data station %s moved from %s to %s", data_station_id, entry['address'], address)
+            self._stations[data_station_id] = {'address': address, 'resolved_at': time.time()}
+            self._save()
+
+    def _save(self):
+        if not self._persist:
+            return
+
+        directory = os.path.dirname(self.path)
+        try:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as f:
+                json.dump(self._stations, f)
+            os.replace(temporary_path, self.path)
+        except (IOError, OSError) as e:
+            logging.error("Unable to save station addresses: %s", e)
+
+    def __getstate__(self):
+        # Download processes get the addresses, not the background lookups or the file
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_refreshing'] = {}
+        state['_persist'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
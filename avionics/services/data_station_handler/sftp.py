@@ -1,11 +1,22 @@
 from stat import S_ISDIR
+import errno
 import socket
 import traceback
 import logging
 
-import paramiko
 import os
 import binascii
+import collections
+import heapq
+import threading
+import time
+
+from ..segment_store import SegmentStore
+from ..tracing import tracer
+from . import crypto
+from .log_sync import LogSyncState
+from .remote_delete import remove_files, RemoteDeleter
+from .resolver import lookup, StationResolver
 
 # TODO: handle poor connection timeouts
 # TODO: add robust logging for flight records
@@ -25,9 +36,32 @@ class SFTPClient(object):
 
     # Paramiko client configuration
     PORT = 22
+    CONNECT_TIMEOUT_SECS = 10
+
+    # SFTP channels one connection may have open at once (sshd's MaxSessions)
+    MAX_SESSIONS = 10
     USE_GSS_API = False
     DO_GSS_API_KEY_EXCHANGE = False
 
+    # Cipher/MAC/key exchange preferences, a name from crypto.PROFILES
+    # (overridden by the CRYPTO_PROFILE environment variable) or a profile dict
+    CRYPTO_PROFILE = 'default'
+
+    # How field data is kept: 'files' (one file each) or 'segments' (packed
+    # into a SegmentStore), overridden by the FIELD_DATA_STORAGE environment variable
+    FIELD_DATA_STORAGE = 'files'
+
+    # Files this large are fetched in byte ranges over several transports at
+    # once, since one transport is bound by single-threaded cipher/MAC work
+    STRIPE_THRESHOLD_BYTES = 64*1024*1024
+    STRIPE_TRANSPORTS = 4
+    STRIPE_READ_BYTES = 32768
+
+    # A cached address with nothing at it is given up on straight away; one
+    # failing otherwise (e.g. refusing connections while sshd starts) only
+    # after this many attempts in a row
+    CACHE_FAILURES = 3
+
     __host_key_type = None
     __host_key = None
 
@@ -35,18 +69,35 @@ class SFTPClient(object):
     __transport = None                                  # Paramiko transport
 
     __hostname = None
+    __address = None                                    # (host, port) to connect to
+    __pinned = False                                    # Address given, not resolved
+    __resolver = None                                   # Station address cache, optional
+    __cache_failed = False                              # Cached address given up on, look the station up
+    __cache_failures = 0                                # Failed connections to the cached address in a row
     __username = None
     __password = None
 
+    __progress = None                                   # Shared transfer counters, optional
+    __catalog = None                                    # Index of downloaded files, optional
+    __crypto_profile = None                             # Algorithm preferences, see crypto.py
+    __store = None                                      # Segment store for field data, optional
+    __share = None                                      # Part of the transfer budget, optional
+    __deletable = None                                  # Remote files whose names are unique on the station
+    __verified = None                                   # Remote files downloaded and verified
+    __deleter = None                                    # Removes verified files during the download
+
     is_connected = False
 
-    def __init__(self, _username, _password, _hostname):
+    def __init__(self, _username, _password, _hostname, _progress=None, _catalog=None,
+        _address=None, _crypto_profile=None, _share=None, _resolver=None):
 
         # Update destination directories to include hostname for data differentiation
         self.__hostname, self.__network_suffix = _hostname.split('.')
+        self.__data_station_id = self.__hostname
         self.__download_id = binascii.b2a_hex(os.urandom(2)).decode()
         self.LOCAL_FIELD_DATA_DESTINATION = '%s/%s-%s/' % (self.LOCAL_FIELD_DATA_DESTINATION, self.__hostname, self.__download_id)
-        self.LOCAL_LOG_DESTINATION = '%s/%s-%s/' % (self.LOCAL_LOG_DESTINATION, self.__hostname, self.__download_id)
+        # Logs are synced incrementally, so they're kept in one place per station
+        self.LOCAL_LOG_DESTINATION = '%s/%s/' % (self.LOCAL_LOG_DESTINATION, self.__hostname)
 
         # TODO: change from password to public key cryptography
         # Login credentials
@@ -54,29 +105,52 @@ class SFTPClient(object):
         self.__password = _password
         self.__hostname = _hostname
 
+        # Connect by hostname unless told where the data station is, resolved
+        # on each connection attempt
+        self.__address = _address or (self.__hostname, self.PORT)
+        self.__pinned = _address != None
+        self.__resolver = _resolver
+
+        self.__progress = _progress
+        self.__catalog = _catalog
+        self.__share = _share
+        self.__deletable = set()
+        self.__verified = []
+        self.__crypto_profile = crypto.resolve(_crypto_profile or os.getenv('CRYPTO_PROFILE') or self.CRYPTO_PROFILE)
+
+        # Paramiko is slow to import, so it's left until a download needs it
+        import paramiko
+
         # This correlates to /home/pi/.ssh/known_hosts
-        host_keys = paramiko.util.load_host_keys(os.path.expanduser('/home/pi/.ssh/known_hosts'))
+        try:
+            host_keys = paramiko.util.load_host_keys(os.path.expanduser('/home/pi/.ssh/known_hosts'))
+        except IOError:
+            logging.warning("No known hosts file, data station host key will not be checked")
+            host_keys = paramiko.HostKeys()
         logging.getLogger("paramiko").setLevel(logging.DEBUG)
 
         if self.__hostname in host_keys:
-            self.__hostkeytype = host_keys[self.__hostname].keys()[0]
+            self.__hostkeytype = list(host_keys[self.__hostname].keys())[0]
             self.__hostkey = host_keys[self.__hostname][self.__hostkeytype]
 
-    def connect(self, timeout=60000):
+    def connect(self, timeout=60000, transport=None):
+        """
+        Start the SFTP session, over `transport` if one has already been
+        opened with openTransport()
+        """
+        import paramiko
+
         # now, connect and use paramiko Transport to negotiate SSH2 across the connection
         logging.info("Connecting to data station... [hostname: %s]" % (self.__hostname))
 
         # Timeout is handled by Navigation.
         try:
-            self.__transport = paramiko.Transport((self.__hostname, self.PORT),
-                                                  default_window_size=2147483647) # Speeds up download speed
+            if transport == None:
+                transport = self.openTransport()
+            self.__transport = transport
 
-            # Compress files on data station before sending over Wi-Fi to drone
-            self.__transport.use_compression()
-            self.__transport.connect(self.__host_key, self.__username, self.__password,
-                                     gss_host=socket.getfqdn(self.__hostname),
-                                     gss_auth = self.USE_GSS_API,
-                                     gss_kex = self.DO_GSS_API_KEY_EXCHANGE)
+            # Striped downloads open more transports to the same address
+            self.__address = transport.getpeername()[:2]
 
             self.__sftp = paramiko.SFTPClient.from_transport(self.__transport)
 
@@ -110,6 +184,9 @@ class SFTPClient(object):
             if not os.path.exists(self.LOCAL_FIELD_DATA_DESTINATION):
                 os.makedirs(self.LOCAL_FIELD_DATA_DESTINATION)
 
+            if (os.getenv('FIELD_DATA_STORAGE') or self.FIELD_DATA_STORAGE) == 'segments' and self.__store == None:
+                self.__store = SegmentStore(self.LOCAL_FIELD_DATA_DESTINATION)
+
             # Ensure local log data directory exists
             if not os.path.exists(self.LOCAL_LOG_DESTINATION):
                 os.makedirs(self.LOCAL_LOG_DESTINATION)
@@ -120,6 +197,89 @@ class SFTPClient(object):
             logging.warn('Connection to data station %s failed' % (self.__hostname))
             logging.debug(e)
 
+    def openTransport(self):
+        """
+        Resolve the data station's address and open an authenticated SSH
+        transport to it, raising if that fails. Several may be opened at
+        once from different threads, e.g. to race connection attempts.
+        """
+        with tracer.span('resolve', 'sftp', station=self.__data_station_id) as span:
+            address, source = self._resolve()
+            span.args.update(address=address[0], source=source)
+        try:
+            with tracer.span('open transport', 'sftp', station=self.__data_station_id, address=address[0]):
+                transport = self._openTransport(address)
+        except Exception as e:
+            # The station may have a new address, so look it up next time if nothing's there,
+            # but one refusing connections is most likely still booting
+            if source == 'cache':
+                self.__cache_failures += 1
+                if _unreachable(e) or self.__cache_failures >= self.CACHE_FAILURES:
+                    self.__cache_failed = True
+            raise
+
+        self.__cache_failed = False
+        self.__cache_failures = 0
+        return transport
+
+    def _resolve(self):
+        """
+        Address to connect to, and where it came from: the station's cached
+        address, unless the last connection to it failed, else an mDNS lookup
+        """
+        if self.__pinned:
+            return self.__address, 'static'
+
+        started = time.monotonic()
+        if self.__resolver != None:
+            address, source = self.__resolver.resolve(self.__data_station_id, use_cache=not self.__cache_failed)
+            if address == None and self.__cache_failed:
+                # Nothing from mDNS either, so the old address is as good as any
+                address, source = self.__resolver.cached(self.__data_station_id), 'cache'
+        else:
+            address, source = lookup(self.__hostname, self.PORT, StationResolver.LOOKUP_TIMEOUT_SECS), 'mdns'
+
+        resolve_secs = time.monotonic() - started
+        if address == None:
+            logging.warning("Unable to resolve %s after %.3f s", self.__hostname, resolve_secs)
+            return (self.__hostname, self.PORT), None
+
+        logging.info("Resolved %s to %s in %.3f s (%s)", self.__hostname, address, resolve_secs, source)
+        return (address, self.PORT), source
+
+
+    def _openTransport(self, address=None):
+        """
+        Open and authenticate an SSH transport to the data station
+        """
+        import paramiko
+
+        # Connected here rather than by paramiko, which would hide why it failed
+        # (see _unreachable()) and wait as long as the OS lets it
+        sock = socket.create_connection(address or self.__address, self.CONNECT_TIMEOUT_SECS)
+        try:
+            transport = paramiko.Transport(sock, default_window_size=2147483647) # Speeds up download speed
+        except Exception:
+            sock.close()
+            raise
+
+        # Compress files on data station before sending over Wi-Fi to drone
+        transport.use_compression()
+        crypto.apply(transport, self.__crypto_profile)
+        try:
+            transport.connect(self.__host_key, self.__username, self.__password,
+                              # Only look up the FQDN (reverse DNS, slow over mDNS) if GSS-API needs it
+                              gss_host=socket.getfqdn(self.__hostname) if self.USE_GSS_API or \
+                                           self.DO_GSS_API_KEY_EXCHANGE else None,
+                              gss_auth = self.USE_GSS_API,
+                              gss_kex = self.DO_GSS_API_KEY_EXCHANGE)
+        except Exception:
+            # Don't leave the transport's thread behind
+            transport.close()
+            raise
+
+        logging.debug("Transport to %s using %s/%s" % (self.__hostname, transport.local_cipher, transport.local_mac))
+        return transport
 
     # -----------------------
     # General utility methods with robust connection timeout handling
@@ -145,18 +305,236 @@ class SFTPClient(object):
 
         return directory_contents
 
-    def downloadFile(self, remote_path, local_destination, file_name):
+    def downloadFile(self, remote_path, local_destination, file_name, attributes=None, controller=None):
         """
         Download remote file to given local destination
+
+        Given the remote file's SFTPAttributes, its modification time is
+        preserved on the local copy, and a large file is striped over the
+        transfers `controller` (a LinkController) has free.
         """
+        self._downloadFile(self.__sftp, remote_path, local_destination, file_name, attributes, controller)
+
+    def _downloadFile(self, sftp, remote_path, local_destination, file_name, attributes=None, controller=None):
         logging.info("Downloading file: %s" % (file_name))
+        remote_file = os.path.join(remote_path, file_name)
+        local_file = os.path.join(local_destination, file_name)
+
+        callback = None
+        slot = None
+        if self.__progress != None:
+            slot = self.__progress.start_file(local_file)
+        if self.__progress != None or self.__share != None:
+            callback = self._progress_callback()
+
+        # Large files are few, and striping needs random access, so they stay as files
+        striped = attributes != None and attributes.st_size >= self.STRIPE_THRESHOLD_BYTES
+        store = self.__store if not striped else None
+
         try:
-            self.__sftp.get(os.path.join(remote_path,file_name), os.path.join(local_destination,file_name))
+            with tracer.span('transfer', 'sftp', station=self.__data_station_id, file=remote_file,
+                             bytes=attributes.st_size if attributes != None else None, striped=striped):
+                if striped:
+                    self._getStriped(sftp, remote_file, local_file, attributes.st_size, controller)
+                elif store != None:
+                    self._getToStore(sftp, remote_file, file_name, attributes, callback)
+                else:
+                    sftp.get(remote_file, local_file, callback=callback)
+            if self.__progress != None:
+                self.__progress.complete_file(slot)
+                slot = None
+
+            if attributes != None and store == None:
+                os.utime(local_file, (attributes.st_atime, attributes.st_mtime))
+
+            if self.__catalog != None:
+                # Only the catalog's entry says for sure what arrived from where
+                indexed = None
+                if remote_file in self.__deletable and attributes != None:
+                    indexed = lambda row, size=attributes.st_size: self._verified(remote_file, size, row)
+                self.__catalog.add(self.__data_station_id, remote_file, local_file, store, indexed)
         except IOError as e:
             logging.error(e)
         except socket.timeout:
             logging.error("Listing remote directories timeout")
 
+        # Failed, but the download carries on without it
+        if slot != None:
+            self.__progress.abandon_file(slot)
+
+    def _verified(self, remote_file, size, row):
+        """
+        Catalog callback once a downloaded file is indexed. It's safe to
+        remove from the data station if the entry is for this exact remote
+        file and has all its bytes.
+        """
+        if row['remote_path'] != remote_file or row['size'] != size:
+            logging.warning("Keeping %s on data station: catalog has %s [%i of %i bytes]" %
+                            (remote_file, row['remote_path'], row['size'], size))
+            return
+
+        self.__verified.append(remote_file)
+        if self.__deleter != None:
+            self.__deleter.add(remote_file)
+
+    def _getToStore(self, sftp, remote_file, file_name, attributes, callback):
+        """
+        Fetch one file into the segment store
+        """
+        with sftp.open(remote_file, 'rb') as remote:
+            size = attributes.st_size if attributes != None else remote.stat().st_size
+            remote.prefetch(size)
+
+            with self.__store.writer(file_name, attributes.st_mtime if attributes != None else None) as writer:
+                transferred = 0
+                while True:
+                    data = remote.read(self.STRIPE_READ_BYTES)
+                    if not data:
+                        break
+                    writer.write(data)
+                    transferred += len(data)
+                    if callback != None:
+                        callback(transferred, size)
+
+                # Raising here leaves the partial file out of the store
+                if transferred != size:
+                    raise IOError("Short read of %s [%i of %i bytes]" % (remote_file, transferred, size))
+
+    def _getStriped(self, sftp, remote_file, local_file, size, controller=None):
+        """
+        Fetch one large file as byte ranges over several transports
+
+        Each range is written at its offset in a preallocated local file.
+        Ranges left unfinished by a failed transport are completed over the
+        given SFTP channel, and IOError is raised if the file still is not
+        complete.
+
+        The file's own transfer is one transport. The others come out of
+        the transfer budget: transfers the LinkController has free, else
+        the budget share's concurrency.
+        """
+        stripes = max(1, min(self.STRIPE_TRANSPORTS, size // self.STRIPE_READ_BYTES))
+        borrowed = 0
+        if controller != None:
+            borrowed = controller.acquire_free(stripes - 1)
+            stripes = 1 + borrowed
+        elif self.__share != None:
+            stripes = max(1, min(stripes, self.__share.concurrency))
+        try:
+            self._getStripes(sftp, remote_file, local_file, size, stripes)
+        finally:
+            if borrowed:
+                controller.release(borrowed)
+
+    def _getStripes(self, sftp, remote_file, local_file, size, stripes):
+        """Fetch a file as up to `stripes` byte ranges, see _getStriped()"""
+        import paramiko
+
+        stripe_size = -(-size // stripes)
+        # [start, end, bytes done] per range
+        ranges = [[start, min(start + stripe_size, size), 0] for start in range(0, size, stripe_size)]
+        timeout = sftp.get_channel().gettimeout()
+        progress_lock = threading.Lock()
+
+        if len(ranges) > 1:
+            logging.info("Striping %s over %i transports [%i bytes]" % (os.path.basename(remote_file), len(ranges), size))
+        else:
+            logging.info("No transfers free to stripe %s over [%i bytes]" % (os.path.basename(remote_file), size))
+
+        fd = os.open(local_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    pass # Sparse is fine where the file system can't preallocate
+
+            def fetch(stripe_sftp, byte_range):
+                start, end, done = byte_range
+                with stripe_sftp.open(remote_file, 'rb') as remote:
+                    remote.seek(start + done)
+                    remote.prefetch(end)   # Pipeline reads up to the end of this range only
+                    while start + byte_range[2] < end:
+                        position = start + byte_range[2]
+                        data = remote.read(min(self.STRIPE_READ_BYTES, end - position))
+                        if not data:
+                            break
+                        os.pwrite(fd, data, position)
+                        byte_range[2] += len(data)
+                        if self.__progress != None:
+                            with progress_lock:
+                                self.__progress.add_bytes(len(data))
+                        if self.__share != None:
+                            self.__share.throttle(len(data))
+
+            def stripe(byte_range):
+                transport = None
+                try:
+                    transport = self._openTransport()
+                    stripe_sftp = paramiko.SFTPClient.from_transport(transport)
+                    stripe_sftp.get_channel().settimeout(timeout)
+                    fetch(stripe_sftp, byte_range)
+                except Exception as e:
+                    logging.warning("Stripe %i-%i of %s failed: %s" % (byte_range[0], byte_range[1], remote_file, e))
+                finally:
+                    if transport != None:
+                        transport.close()
+
+            # A single range is fetched over the main connection below
+            threads = [threading.Thread(target=stripe, args=(r,), name='Stripe %i' % i)
+                       for i, r in enumerate(ranges) if len(ranges) > 1]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            for byte_range in ranges:
+                if byte_range[0] + byte_range[2] < byte_range[1]:
+                    if threads:
+                        logging.info("Completing stripe %i-%i over the main connection" % (byte_range[0], byte_range[1]))
+                    fetch(sftp, byte_range)
+        finally:
+            os.close(fd)
+
+        missing = sum(end - start - done for start, end, done in ranges)
+        if missing or os.path.getsize(local_file) != size:
+            raise IOError("Striped download of %s incomplete [%i of %i bytes missing]" % (remote_file, missing, size))
+
+    def _progress_callback(self):
+        """
+        Paramiko reports cumulative bytes per file, progress and the
+        bandwidth budget count deltas
+        """
+        last = 0
+
+        def callback(transferred, total):
+            nonlocal last
+            if self.__progress != None:
+                self.__progress.add_bytes(transferred - last)
+            if self.__share != None:
+                self.__share.throttle(transferred - last)
+            last = transferred
+
+        return callback
+
+    def _openChannel(self):
+        """Another SFTP session on the connection's transport, for work in parallel"""
+        import paramiko
+
+        sftp = paramiko.SFTPClient.from_transport(self.__transport)
+        sftp.get_channel().settimeout(self.__sftp.get_channel().gettimeout())
+        return sftp
+
+    def deleteFiles(self, remote_files):
+        """
+        Delete remote files over several channels at once rather than a round
+        trip each in turn, return {remote file: None if deleted, else the error}
+        """
+        logging.info("Deleting %i files from camera trap" % (len(remote_files)))
+        return remove_files(self._openChannel, remote_files, self.__data_station_id,
+                            min(RemoteDeleter.CHANNELS, self.MAX_SESSIONS - 1))
+
     def deleteFile(self, remote_path, file_name):
         """
         Delete file from given path on remote data station
@@ -172,7 +550,13 @@ class SFTPClient(object):
     # NOTICE: Make sure to close the SFTP connection after download is complete
     def close(self):
         logging.debug("Closing connection to data station... [hostname: %s]" % (self.__hostname))
+        if self.__deleter != None:
+            self.__deleter.finish()
+            self.__deleter = None
         self.__sftp.close()
+        if self.__store != None:
+            self.__store.close()
+            self.__store = None
         logging.info("Connection to data station closed [hostname: %s]" % (self.__hostname))
 
 
@@ -189,7 +573,7 @@ class SFTPClient(object):
             if S_ISDIR(f.st_mode):
                 folders.append(f.filename)
             else:
-                files.append(f.filename)
+                files.append(f)
 
         if files:
             yield path, files
@@ -200,23 +584,118 @@ class SFTPClient(object):
                 yield x
 
     # TODO: ensure this handles files with same name in different directories
-    def downloadAllFieldData(self):
+    def downloadAllFieldData(self, controller=None, delete=False):
         """
         Download all data station field data
         Recurses from /media/ dir to download all data
+
+        Given a LinkController, files are downloaded over several SFTP
+        channels at the concurrency (and in the order) it asks for.
+
+        With `delete`, each file is removed from the data station as soon as
+        the catalog has indexed it, on channels of their own while the
+        download carries on. deleteAllFieldData() waits for the removals to
+        finish. Files are kept locally by name alone, so any whose name is
+        shared with another on the station are never deleted.
         """
-        for path, files in self._walk(self.REMOTE_FIELD_DATA_SOURCE):
-            for file in files:
-                self.downloadFile(path, self.LOCAL_FIELD_DATA_DESTINATION, file)
+        pending = []
+        with tracer.span('walk', 'sftp', station=self.__data_station_id) as span:
+            for path, files in self._walk(self.REMOTE_FIELD_DATA_SOURCE):
+                for file in files:
+                    pending.append((path, file))
+            span.args['files'] = len(pending)
+
+        # Logs are under the field data directory too, and synced from where they left off
+        names = {}
+        for path, file in pending:
+            if os.path.join(path, '').startswith(self.REMOTE_LOG_SOURCE):
+                continue
+            names.setdefault(file.filename, []).append(os.path.join(path, file.filename))
+        for name, remote_files in names.items():
+            if len(remote_files) == 1:
+                self.__deletable.update(remote_files)
+            else:
+                logging.warning("%i files named %s on data station, keeping them there: %s" %
+                                (len(remote_files), name, ', '.join(remote_files)))
+
+        if delete and self.__deleter == None:
+            # On the channels left by the main one and the transfers
+            transfers = controller.MAX_CONCURRENCY if controller != None else 0
+            channels = max(1, min(RemoteDeleter.CHANNELS, self.MAX_SESSIONS - 1 - transfers))
+            self.__deleter = RemoteDeleter(self._openChannel, self.__data_station_id, channels)
+
+        if controller == None:
+            for path, file in pending:
+                self.downloadFile(path, self.LOCAL_FIELD_DATA_DESTINATION, file.filename, file)
+            return
+
+        # Files in walk order, and smallest first for while the link is fading,
+        # each taken from whichever queue it's first reached in
+        in_order = collections.deque(range(len(pending)))
+        by_size = [(file.st_size, i) for i, (path, file) in enumerate(pending)]
+        heapq.heapify(by_size)
+        taken = set()
+        pending_lock = threading.Lock()
+
+        def next_file():
+            with pending_lock:
+                while True:
+                    if controller.prefer_small_files:
+                        if not by_size:
+                            return None
+                        i = heapq.heappop(by_size)[1]
+                    else:
+                        if not in_order:
+                            return None
+                        i = in_order.popleft()
+                    if i not in taken:
+                        taken.add(i)
+                        return pending[i]
+
+        def worker():
+            try:
+                sftp = self._openChannel()
+            except Exception as e:
+                logging.error("Unable to open SFTP channel: %s", e)
+                return
+
+            while True:
+                item = next_file()
+                if item == None:
+                    break
+                path, file = item
+
+                controller.acquire(file.st_size)
+                try:
+                    self._downloadFile(sftp, path, self.LOCAL_FIELD_DATA_DESTINATION, file.filename, file,
+                                       controller)
+                finally:
+                    controller.release()
+
+            sftp.close()
+
+        workers = [threading.Thread(target=worker, name='Transfer %i' % i)
+                   for i in range(controller.MAX_CONCURRENCY)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
 
     def deleteAllFieldData(self):
         """
-        Delete all log data that has successfully been downloaded
-        """
-        # TODO: only delete files that 100% downloaded.
-        # If connection times out, some file names may exist, but the files are empty.
+        Delete all field data that has successfully been downloaded, return
+        {remote file: None if deleted, else the error}
 
-        pass
+        Only files the catalog has indexed in full, under their own remote
+        path, are deleted; if the connection times out, some file names may
+        exist, but the files are empty. The catalog must be closed first so
+        everything downloaded has been indexed.
+        """
+        if self.__deleter != None:
+            results = self.__deleter.finish()
+            self.__deleter = None
+            return results
+        return self.deleteFiles(list(self.__verified))
 
     # -----------------------
     # Log data methods
@@ -224,24 +703,90 @@ class SFTPClient(object):
 
     def downloadAllLogData(self):
         """
-        Download all data station log data
+        Sync all data station log data
+
+        Only the bytes appended to each log since the last visit are
+        fetched, a rotated or truncated log is fetched in full.
         """
-        pass
-        # file_list = self.getRemoteFileList(self.REMOTE_LOG_SOURCE)
-        # if not file_list:
-        #     logging.info("No log files to download")
-        # else:
-        #     logging.info("Downloading %i log files..." % (len(file_list)))
-        #     # Download all files
-        #     for file_name in file_list:
-        #         self.downloadFile(self.REMOTE_LOG_SOURCE, self.LOCAL_LOG_DESTINATION, file_name)
+        try:
+            remote_files = [f for f in self.__sftp.listdir_attr(self.REMOTE_LOG_SOURCE)
+                            if not S_ISDIR(f.st_mode)]
+        except IOError as e:
+            logging.error(e)
+            return
+        except socket.timeout:
+            logging.error("Listing remote directories timeout")
+            return
+
+        if not remote_files:
+            logging.info("No log files to download")
+            return
+
+        state = LogSyncState(self.LOCAL_LOG_DESTINATION)
+        fetched = 0
+        try:
+            for attributes in remote_files:
+                fetched += self._syncLogFile(state, attributes)
+        finally:
+            state.save()
+
+        logging.info("Synced %i log files, %i bytes fetched" % (len(remote_files), fetched))
+
+    def _syncLogFile(self, state, attributes):
+        """
+        Bring the local copy of one log up to date, return bytes fetched
+        """
+        file_name = attributes.filename
+        remote_file = os.path.join(self.REMOTE_LOG_SOURCE, file_name)
+        local_file = os.path.join(self.LOCAL_LOG_DESTINATION, file_name)
+        fetched = 0
+
+        try:
+            with self.__sftp.open(remote_file, 'rb') as remote:
+                offset = state.resume_offset(file_name, attributes.st_size)
+                if offset > 0 and not state.head_matches(file_name, remote.read(state.head_length(file_name))):
+                    offset = 0
+
+                if offset == attributes.st_size:
+                    return 0
+
+                logging.info("Syncing log file: %s [%i bytes from offset %i]" %
+                             (file_name, attributes.st_size-offset, offset))
+
+                remote.seek(offset)
+                remote.prefetch(attributes.st_size)
+
+                with open(local_file, 'ab' if offset > 0 else 'wb') as local:
+                    remaining = attributes.st_size - offset
+                    while remaining > 0:
+                        data = remote.read(min(remaining, 32768))
+                        if not data:
+                            break
+                        local.write(data)
+                        remaining -= len(data)
+                        fetched += len(data)
+
+        except IOError as e:
+            logging.error(e)
+        except socket.timeout:
+            logging.error("Log sync timeout: %s" % (file_name))
+
+        # Even an interrupted fetch leaves a valid prefix to resume from next time
+        if os.path.exists(local_file):
+            state.update(file_name, os.path.getsize(local_file))
+        return fetched
 
     def deleteAllLogData(self):
         """
         Remove successfully downloaded log files
+
+        Logs are synced incrementally from where the last visit left off,
+        so they stay on the data station and nothing is removed.
         """
         pass
-        # logging.debug("Beginning data station log removal")
-        # for file_name in os.listdir(self.LOCAL_LOG_DESTINATION): # List newly downloaded files
-        #     self.deleteFile(self.REMOTE_LOG_SOURCE, file_name)
-        # logging.info("Field data removal complete")
+
+
+def _unreachable(e):
+    """Whether a connection error means there's no host at the address"""
+    return isinstance(e, socket.timeout) or \
+        (isinstance(e, (IOError, OSError)) and e.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH))
@@ -0,0 +1,39 @@
+import logging
+
+class WirelessSignal(object):
+
+    """Wi-Fi link statistics from the kernel's wireless extensions
+
+    Reads `/proc/net/wireless`, which looks like:
+
+        Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+         face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+         wlan0: 0000   54.  -56.  -256        0      0      0     12      0        0
+
+    Any file in the same format can be read instead, which is how the link
+    controller is exercised without a radio.
+
+    """
+
+    def __init__(self, interface='wlan0', path='/proc/net/wireless'):
+        self.interface = interface
+        self.path = path
+
+    def read(self):
+        """Return (signal level in dBm, cumulative retry count), or (None, None)"""
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    name, _, fields = line.partition(':')
+                    if name.strip() != self.interface:
+                        continue
+
+                    fields = fields.split()
+                    level = float(fields[2].rstrip('.'))
+                    retries = int(fields[7])
+                    return level, retries
+
+        except (IOError, ValueError, IndexError) as e:
+            logging.debug("Unable to read wireless statistics: %s", e)
+
+        return None, None
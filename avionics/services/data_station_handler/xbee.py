@@ -3,6 +3,8 @@ import time
 import logging
 import os
 import hashlib
+import queue
+import threading
 
 class XBee(object):
 
@@ -13,8 +15,19 @@ class XBee(object):
     instruct the data station's microcontroller to boot the data station computer
     and initiate the download over Wi-Fi.
 
+    Data stations answer each command with the same frame ('~', station ID,
+    command code), all arriving on the one serial port. A single reader
+    thread parses the frames and hands each ACK to a queue for its station,
+    so sessions waiting on different stations never consume each other's
+    ACKs.
+
     """
 
+    IDENTITY_LENGTH = 3
+
+    # Delay before a (mimicked) ACK in development, with no XBee connected
+    DEVELOPMENT_ACK_SECS = 5
+
     def __init__(self, serial_port="/dev/ttyUSB0"):
 
         self.xbee_port = None
@@ -23,6 +36,11 @@ class XBee(object):
         self.data_station_id = None
         self.serial_port = serial_port
 
+        self._acks = {}             # Data station ID -> queue of commands it has acknowledged
+        self._acks_lock = threading.Lock()
+        self._reader = None
+        self._development_sent = {}     # (data station ID, command) -> when first sent, in development
+
         self.start_delimiter = '~' # 0x7E in ASCII
 
         # TODO: make single dictionary
@@ -52,10 +70,20 @@ class XBee(object):
                 logging.error("Failed to connect to xBee device. Retrying connection...")
                 time.sleep(3)
 
+        if self.xbee_port != None:
+            self._start_reader()
+
+    def _start_reader(self):
+        if self._reader == None:
+            self._reader = threading.Thread(target=self._read, name='XBee RX')
+            self._reader.daemon = True
+            self._reader.start()
+
     def send_command(self, data_station_id, command):
 
         # Immediately return False if in development (XBee not actually connected)
-        if os.getenv('DEVELOPMENT') == 'True':
+        if os.getenv('DEVELOPMENT') == 'True' and self.xbee_port == None:
+            self._development_sent.setdefault((data_station_id, command), time.monotonic())
             return False
 
         # # Update hash with new data_station_id
@@ -76,57 +104,71 @@ class XBee(object):
         logging.debug("XBee TX: %s" % self.encode[command])
         self.xbee_port.write(self.encode[command].encode('utf-8'))
 
-    def acknowledge(self, data_station_id, command):
+    def acknowledge(self, data_station_id, command, timeout=None):
         """
-        Called after command is sent
+        Called after command is sent. True if the station has acknowledged
+        the command since last asked, waiting up to `timeout` seconds for it.
         """
 
-        # Mimic successful ACK
-        if (os.getenv('DEVELOPMENT') == 'True'):
-            time.sleep(5)
-            return True
-
-        iden_match = False
-        identity_index = 0
-
-        start_delimiter_success = False
-
-        identity_code = data_station_id
-
-        command_code = self.encode[command]
-
-        while (self.xbee_port.in_waiting > 0): # There's something in the XBee buffer
-            incoming_byte = self.xbee_port.read().decode('utf-8') # Read a byte at a time
-            logging.debug("XBee RX: %s" % incoming_byte)
-
-            # Third pass: Read command
-            if (iden_match == True):
-                logging.debug("XBee ACK success: %s", str(incoming_byte == command_code))
-                return (incoming_byte == command_code)
+        # Mimic successful ACK, a while after the command was first sent
+        if os.getenv('DEVELOPMENT') == 'True' and self.xbee_port == None:
+            sent = self._development_sent.get((data_station_id, command))
+            if sent != None and time.monotonic() - sent >= self.DEVELOPMENT_ACK_SECS:
+                del self._development_sent[(data_station_id, command)]
+                return True
+            return False
 
-            # Second pass: Check for identity match
-            elif (start_delimiter_success == True):
-                logging.debug("XBee checking ID")
-                if (incoming_byte == identity_code[identity_index]):
-                    identity_index += 1
+        acks = self._queue(data_station_id)
+        deadline = time.monotonic() + timeout if timeout != None else None
+        while True:
+            try:
+                if deadline == None:
+                    acknowledged = acks.get_nowait()
                 else:
-                    start_delimiter_success = False
-
-                iden_match = (identity_index == 3)
-
-            # First pass: Check for start delimiter match
-            elif (incoming_byte == self.start_delimiter):
-                logging.debug("XBee checking start delimiter")
-                start_delimiter_success = True
-
-            # Reset
-            else:
-                iden_match = False
-                start_delimiter_success = False
-                identity_index = 0
-
-        return False # Unsuccessful ACK
+                    acknowledged = acks.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return False # Unsuccessful ACK
+
+            # Anything else is a late ACK of an earlier command
+            logging.debug("XBee ACK success: %s", str(acknowledged == command))
+            if acknowledged == command:
+                return True
+
+    def _queue(self, data_station_id):
+        with self._acks_lock:
+            if data_station_id not in self._acks:
+                self._acks[data_station_id] = queue.Queue()
+            return self._acks[data_station_id]
+
+    def _read(self):
+        """Parse frames off the serial port for as long as it's open, queueing each ACK"""
+        frame = None
+        while self.xbee_port != None:
+            try:
+                incoming_byte = self.xbee_port.read().decode('utf-8', 'replace') # Read a byte at a time
+            except (serial.SerialException, OSError) as e:
+                logging.error("XBee read failure: %s", e)
+                time.sleep(1)
+                continue
+
+            if not incoming_byte:
+                continue # Read timeout
+            logging.debug("XBee RX: %s" % incoming_byte)
 
+            # A start delimiter always begins a new frame
+            if incoming_byte == self.start_delimiter:
+                frame = ''
+            elif frame != None:
+                frame += incoming_byte
+
+                # Identity, then command
+                if len(frame) == self.IDENTITY_LENGTH + 1:
+                    identity_code, command_code = frame[:-1], frame[-1]
+                    frame = None
+                    if command_code in self.decode:
+                        self._queue(identity_code).put(self.decode[command_code])
+                    else:
+                        logging.debug("XBee unknown command from %s: %s", identity_code, command_code)
 
 if __name__ == '__main__':
     xbee = XBee(serial_port="/dev/ttyUSB0")
@@ -0,0 +1,163 @@
+"""
+One XBee link shared by every data station session.
+
+Sessions used to each send a command and then poll for its ACK every
+0.5 s until it arrived or they gave up, so a session shutting its station
+down sat in that loop for up to 20 s before the next station could be
+started on. Here sessions submit commands and carry on; a single thread
+sends and re-sends them on the serial link, interleaving stations, and
+completes each when it's acknowledged, times out or is cancelled.
+"""
+
+import logging
+import threading
+import time
+
+from ..tracing import tracer
+
+class XBeeCommand(object):
+
+    """A command submitted to the XBeeScheduler
+
+    `acknowledged` is None until the command is done, then True if the
+    station acknowledged it, False if it timed out or was cancelled. A
+    command that doesn't expect an ACK is done, with `acknowledged` None,
+    once it has been sent.
+
+    """
+
+    def __init__(self, data_station_id, command, timeout_secs=None, expect_ack=True):
+        self.data_station_id = data_station_id
+        self.command = command
+        self.expect_ack = expect_ack
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout_secs if timeout_secs != None else None
+        self.next_send = self.submitted
+        self.attempts = 0
+        self.acknowledged = None
+
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+        # From submission until done, which is usually on the scheduler's thread
+        self._span = tracer.begin(command, 'xbee', station=data_station_id)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the command to be done, return whether it is"""
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        """Stop sending the command, unless it's already done"""
+        self._finish(False)
+
+    def _finish(self, acknowledged):
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self.acknowledged = acknowledged
+            self._done.set()
+
+        self._span.args.update(attempts=self.attempts, acknowledged=acknowledged)
+        self._span.end()
+        return True
+
+
+class XBeeScheduler(object):
+
+    """Sends every session's XBee commands over the one serial link
+
+    Commands are sent in turn, every RETRY_SECS for each until it's done
+    and at most one every SEND_INTERVAL_SECS on the link. When several are
+    due, the time-critical POWER_ON goes first, and otherwise whichever has
+    waited longest, so stations take turns.
+
+    """
+
+    RETRY_SECS = 0.5
+    SEND_INTERVAL_SECS = 0.05
+
+    # How often ACKs are looked for between sends
+    POLL_SECS = 0.05
+
+    # Lowest first
+    PRIORITIES = {'POWER_ON': 0, 'EXTEND_TIME': 1, 'POWER_OFF': 2}
+
+    def __init__(self, xbee):
+        self.xbee = xbee
+        self._commands = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._alive = True
+
+    def submit(self, data_station_id, command, timeout_secs=None, expect_ack=True):
+        """
+        Queue a command to be sent until acknowledged (or `timeout_secs`
+        pass), return its XBeeCommand
+        """
+        submitted = XBeeCommand(data_station_id, command, timeout_secs, expect_ack)
+        with self._condition:
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._run, name='XBee')
+                self._thread.daemon = True
+                self._thread.start()
+            self._commands.append(submitted)
+            self._condition.notify()
+        return submitted
+
+    def stop(self):
+        with self._condition:
+            self._alive = False
+            self._condition.notify()
+
+    def _run(self):
+        last_send = 0
+        while True:
+            with self._condition:
+                if not self._alive:
+                    break
+                self._commands = [c for c in self._commands if not c.done]
+
+                now = time.monotonic()
+                due = [c for c in self._commands if c.next_send <= now]
+                command = None
+                if due and now - last_send >= self.SEND_INTERVAL_SECS:
+                    command = min(due, key=lambda c: (self.PRIORITIES.get(c.command, 1), c.next_send))
+                    command.attempts += 1
+                    command.next_send = now + self.RETRY_SECS
+                waiting = [c for c in self._commands if c.expect_ack]
+
+            if command != None:
+                logging.debug("%s data station %s (attempt %i)", command.command, command.data_station_id,
+                              command.attempts)
+                self.xbee.send_command(command.data_station_id, command.command)
+                last_send = time.monotonic()
+                if not command.expect_ack:
+                    command._finish(None)
+
+            for c in waiting:
+                if c.attempts == 0:
+                    continue
+                if self.xbee.acknowledge(c.data_station_id, c.command):
+                    c._finish(True)
+                elif c.deadline != None and time.monotonic() > c.deadline:
+                    if c._finish(False):
+                        logging.error("%s command ACK failure from data station %s after %i attempts",
+                                      c.command, c.data_station_id, c.attempts)
+
+            # Until the next send is due, looking for ACKs meanwhile, or with
+            # nothing queued until submit() or stop()
+            with self._condition:
+                pending = [c.next_send for c in self._commands if not c.done]
+                if not self._alive:
+                    continue
+                if not pending:
+                    self._condition.wait()
+                    continue
+                wait = min(self.POLL_SECS,
+                           max(min(pending), last_send + self.SEND_INTERVAL_SECS) - time.monotonic())
+                if wait > 0:
+                    self._condition.wait(wait)
@@ -0,0 +1 @@
+from .heartbeat import Heartbeat
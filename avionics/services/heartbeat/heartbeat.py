@@ -0,0 +1,116 @@
+import logging
+import os
+import serial
+import threading
+import time
+
+class Heartbeat(object):
+
+    """Periodic status heartbeat to the autopilot
+
+    Sends a single status byte at least once per period: idle (`\\x00`) or
+    actively downloading from a data station (`\\x01`), as set by the data
+    station handler through `is_downloading`.
+
+    Beats are scheduled against the monotonic clock rather than by sleeping
+    a fixed interval after each send, so time spent waiting for the GIL while
+    transfer workers are busy does not accumulate into drift. A beat that
+    comes out late is still sent, and the schedule then skips forward past
+    any deadlines that have already gone by instead of bursting to catch up.
+
+    """
+
+    IDLE = b'\x00'
+    DOWNLOADING = b'\x01'
+
+    def __init__(self, _period_secs=1.0, serial_port="/dev/serial0"):
+
+        self.period_secs = _period_secs
+        self.serial_port = serial_port
+        self.heartbeat_port = None
+
+        self._alive = True
+        self._stop_event = threading.Event()
+
+        # Send statistics, guarded by lock since they're read from other threads
+        self._stats_lock = threading.Lock()
+        self._sent = 0
+        self._missed = 0
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+        self._jitter_last = 0.0
+
+    def connect(self):
+        while True:
+            try:
+                if (os.getenv('DEVELOPMENT') == 'False' and os.getenv('TESTING') == 'False') or (os.getenv('DEVELOPMENT') == None and os.getenv('TESTING') == None):
+                    self.heartbeat_port = serial.Serial(self.serial_port, 57600, timeout=1,
+                                                        write_timeout=self.period_secs)
+                    logging.info("Connected to autopilot heartbeat port")
+                elif os.getenv('TESTING') == 'True': # Create a loopback to test locally
+                    self.heartbeat_port = serial.serial_for_url('loop://', timeout=1)
+                else: # Don't connect to autopilot while in development
+                    logging.info("In development mode, not connecting heartbeat port")
+                break
+            except serial.SerialException:
+                logging.error("Failed to connect to heartbeat port. Retrying connection...")
+                time.sleep(3)
+
+    def run(self, is_downloading):
+        """Send heartbeats on a fixed schedule until stopped"""
+
+        next_deadline = time.monotonic()
+
+        while self._alive:
+            delay = next_deadline - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+
+            now = time.monotonic()
+            self._send(self.DOWNLOADING if is_downloading.is_set() else self.IDLE)
+            self._record(now - next_deadline)
+
+            next_deadline += self.period_secs
+
+            # Resynchronize rather than sending a burst of catch-up beats
+            if now >= next_deadline:
+                missed = int((now - next_deadline) // self.period_secs) + 1
+                with self._stats_lock:
+                    self._missed += missed
+                logging.warning("Heartbeat missed %i deadline(s)", missed)
+                next_deadline += missed * self.period_secs
+
+        logging.info("Heartbeat terminated")
+
+    def stats(self):
+        """Return heartbeat send statistics (jitter in seconds)"""
+        with self._stats_lock:
+            return {
+                'sent': self._sent,
+                'missed': self._missed,
+                'jitter_last': self._jitter_last,
+                'jitter_max': self._jitter_max,
+                'jitter_mean': self._jitter_total / self._sent if self._sent else 0.0,
+            }
+
+    def stop(self):
+        logging.info("Stopping heartbeat...")
+        logging.info("Heartbeat stats: %s", self.stats())
+        self._alive = False
+        self._stop_event.set()
+
+    def _send(self, status):
+        if self.heartbeat_port == None:
+            return
+
+        try:
+            self.heartbeat_port.write(status)
+        except serial.SerialException as e:
+            logging.error("Heartbeat write failure: %s", e)
+
+    def _record(self, jitter):
+        with self._stats_lock:
+            self._sent += 1
+            self._jitter_last = jitter
+            self._jitter_total += jitter
+            self._jitter_max = max(self._jitter_max, jitter)
@@ -0,0 +1 @@
+from .history import StationHistory
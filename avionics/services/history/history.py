@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class StationHistory(object):
+
+    """Per-station performance across visits, kept between flights
+
+    After each visit the data station handler records how long the station
+    took to acknowledge POWER_ON, to accept an SSH connection, the transfer
+    throughput and how much data it held. Each is kept as an exponentially
+    weighted average so one bad visit doesn't throw the next one off.
+
+    Navigation uses it to wake slow-booting stations earlier, and the data
+    station handler to size each station's POWER_ON retry window and
+    download timeout. Stations without history get the mission defaults.
+
+    State is kept as JSON, rewritten after every visit.
+
+    """
+
+    DEFAULT_PATH = '/srv/flight-data/station-history.json'
+
+    # Weight of the latest visit in the running averages
+    SMOOTHING = 0.5
+
+    # Margin on historical timings, so an average visit isn't cut short
+    SAFETY_FACTOR = 1.5
+
+    # Wake lead distance bounds (m); XBee range limits how early we can wake
+    MIN_WAKE_DISTANCE = 2000
+    MAX_WAKE_DISTANCE = 8000
+
+    FIELDS = ('wake_secs', 'connect_secs', 'throughput', 'backlog_bytes', 'backlog_rate')
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+        self._lock = threading.Lock()
+
+        self._stations = {}
+        try:
+            with open(self.path) as f:
+                self._stations = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, data_station_id):
+        """Averages for a station (missing where never measured), None if never visited"""
+        with self._lock:
+            entry = self._stations.get(data_station_id)
+            return dict(entry) if entry != None else None
+
+    def record(self, data_station_id, wake_secs=None, connect_secs=None, throughput=None,
+        backlog_bytes=None, completed=True):
+        """
+        Fold one visit into the station's history and save
+
+        `backlog_bytes` is what was transferred, a lower bound on the
+        station's backlog unless the download `completed`.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._stations.setdefault(data_station_id, {'visits': 0})
+
+            if backlog_bytes != None and completed and 'visited_at' in entry and now > entry['visited_at']:
+                self._update(entry, 'backlog_rate', backlog_bytes / (now - entry['visited_at']))
+
+            for field, value in (('wake_secs', wake_secs), ('connect_secs', connect_secs),
+                                 ('throughput', throughput), ('backlog_bytes', backlog_bytes)):
+                if value != None:
+                    self._update(entry, field, value)
+
+            entry['visits'] += 1
+            entry['visited_at'] = now
+            entry['completed'] = completed
+
+            self._save()
+
+        logging.info("Station %s history: %s", data_station_id,
+                     ', '.join('%s %.1f' % (f, entry[f]) for f in self.FIELDS if f in entry))
+
+    def wake_distance(self, data_station_id, download_distance, groundspeed, default):
+        """
+        Distance (m) from the station to send POWER_ON, so that it has booted
+        by the time the vehicle is within `download_distance`
+        """
+        entry = self.get(data_station_id)
+        if entry == None or 'wake_secs' not in entry or not groundspeed:
+            return default
+
+        lead = download_distance + groundspeed * entry['wake_secs'] * self.SAFETY_FACTOR
+        return min(max(lead, self.MIN_WAKE_DISTANCE), self.MAX_WAKE_DISTANCE)
+
+    def wake_timeout(self, data_station_id, default):
+        """Seconds to keep retrying POWER_ON, longer for stations known to be slow to boot"""
+        entry = self.get(data_station_id)
+        if entry == None or 'wake_secs' not in entry:
+            return default
+        return max(default, entry['wake_secs'] * self.SAFETY_FACTOR)
+
+    def expected_backlog(self, data_station_id):
+        """Bytes the station is expected to hold now, None if unknown"""
+        entry = self.get(data_station_id)
+        if entry == None:
+            return None
+        if 'backlog_rate' in entry:
+            return entry['backlog_rate'] * (time.time() - entry['visited_at'])
+        return entry.get('backlog_bytes')
+
+    def download_timeout(self, data_station_id, minimum, maximum):
+        """
+        Seconds to allow for connecting and transferring the expected
+        backlog, within [minimum, maximum]
+        """
+        entry = self.get(data_station_id)
+        backlog = self.expected_backlog(data_station_id)
+        if entry == None or backlog == None or not entry.get('throughput'):
+            return maximum
+        # Part of the last backlog was left behind, so it's bigger than we know
+        if not entry.get('completed', True):
+            return maximum
+
+        expected = entry.get('connect_secs', 0) + backlog / entry['throughput']
+        return min(max(expected * self.SAFETY_FACTOR, minimum), maximum)
+
+    def _update(self, entry, field, value):
+        if field in entry:
+            value = self.SMOOTHING * value + (1 - self.SMOOTHING) * entry[field]
+        entry[field] = value
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        try:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as f:
+                json.dump(self._stations, f)
+            os.replace(temporary_path, self.path)
+        except (IOError, OSError) as e:
+            logging.error("Unable to save station history: %s", e)
@@ -0,0 +1,259 @@
+import logging
+import math
+import threading
+import time
+
+# pymavlink is slow to import, it's imported by connect() like dronekit was
+
+class MavlinkVehicle(object):
+
+    """Slim stand-in for a dronekit Vehicle, covering what Navigation uses
+
+    dronekit's connect(wait_ready=True) fetches every parameter and leaves
+    the autopilot's default telemetry streams running, which takes a while
+    and crowds the 115200 baud link. This asks the autopilot for only the
+    messages Navigation reads, at the rates in MESSAGE_RATES_HZ, and
+    fetches the mission only when asked to.
+
+    The surface mirrors dronekit's: location.global_relative_frame.lat/lon,
+    groundspeed, armed, commands (clear, download, wait_ready, next, len and
+    indexing, with index 0 being the first item after home) and close().
+
+    """
+
+    HEARTBEAT_TIMEOUT_SECS = 30
+    POSITION_TIMEOUT_SECS = 30
+
+    # Message ID -> rate (Hz): GLOBAL_POSITION_INT for distance to the data
+    # station, MISSION_CURRENT for mission progress. HEARTBEAT (armed state)
+    # always comes at 1 Hz.
+    MESSAGE_RATES_HZ = {
+        33: 2,
+        42: 1,
+    }
+
+    def __init__(self, connection):
+        from pymavlink import mavutil
+        self._mavlink = mavutil.mavlink
+
+        self._connection = connection
+        self._alive = True
+
+        self.location = _Location()
+        self.groundspeed = None
+        self.armed = False
+        self.commands = _Commands(self)
+
+        self._heartbeat = threading.Event()
+        self._position = threading.Event()
+
+        self._thread = threading.Thread(target=self._receive, name='MAVLink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_ready(self):
+        """Wait for the autopilot, ask for our streams, then wait for a position fix message"""
+        if not self._heartbeat.wait(self.HEARTBEAT_TIMEOUT_SECS):
+            raise IOError("No heartbeat from autopilot")
+
+        self.request_streams()
+
+        if not self._position.wait(self.POSITION_TIMEOUT_SECS):
+            raise IOError("No position from autopilot")
+
+    def request_streams(self):
+        mavlink = self._mavlink
+        master = self._connection
+
+        # Stop the default streams (ArduPilot), then ask for each message we
+        # need at its own rate (PX4 and recent ArduPilot)
+        master.mav.request_data_stream_send(master.target_system, master.target_component,
+                                            mavlink.MAV_DATA_STREAM_ALL, 0, 0)
+        for message_id, rate_hz in self.MESSAGE_RATES_HZ.items():
+            master.mav.command_long_send(master.target_system, master.target_component,
+                                         mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, 0,
+                                         message_id, 1e6/rate_hz, 0, 0, 0, 0, 0)
+
+        # Older ArduPilot only understands whole streams: GLOBAL_POSITION_INT
+        # comes in the position stream, MISSION_CURRENT in extended status
+        for stream, message_id in ((mavlink.MAV_DATA_STREAM_POSITION, 33),
+                                   (mavlink.MAV_DATA_STREAM_EXTENDED_STATUS, 42)):
+            master.mav.request_data_stream_send(master.target_system, master.target_component,
+                                                stream, self.MESSAGE_RATES_HZ[message_id], 1)
+
+    def close(self):
+        self._alive = False
+        self._thread.join(2)
+        self._connection.close()
+
+    def _send(self, name, *args):
+        master = self._connection
+        getattr(master.mav, name + '_send')(master.target_system, master.target_component, *args)
+
+    def _receive(self):
+        while self._alive:
+            try:
+                message = self._connection.recv_match(blocking=True, timeout=1)
+            except Exception as e:
+                if self._alive:
+                    logging.error("MAVLink receive failure: %s", e)
+                    time.sleep(1)
+                continue
+
+            if message != None:
+                self._handle(message)
+
+    def _handle(self, message):
+        kind = message.get_type()
+
+        if kind == 'HEARTBEAT':
+            # Ignore ground stations and other companions on the link
+            if message.type == self._mavlink.MAV_TYPE_GCS or \
+                message.autopilot == self._mavlink.MAV_AUTOPILOT_INVALID:
+                return
+            if not self._heartbeat.is_set():
+                self._connection.target_system = message.get_srcSystem()
+                self._connection.target_component = message.get_srcComponent()
+                self._heartbeat.set()
+            self.armed = bool(message.base_mode & self._mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+
+        elif kind == 'GLOBAL_POSITION_INT':
+            frame = self.location.global_relative_frame
+            frame.lat = message.lat / 1e7
+            frame.lon = message.lon / 1e7
+            frame.alt = message.relative_alt / 1000.0
+            self.groundspeed = math.hypot(message.vx, message.vy) / 100.0
+            self._position.set()
+
+        elif kind == 'MISSION_CURRENT':
+            self.commands._current = message.seq
+
+        elif kind in ('MISSION_COUNT', 'MISSION_ITEM', 'MISSION_ITEM_INT'):
+            self.commands._handle(message)
+
+
+class _Frame(object):
+    def __init__(self):
+        self.lat = None
+        self.lon = None
+        self.alt = None
+
+
+class _Location(object):
+    def __init__(self):
+        self.global_relative_frame = _Frame()
+
+
+class _Commands(object):
+
+    """
+    The vehicle's mission, fetched on download(). Like dronekit, index 0
+    is the first item after home (sequence number 1), and `next` is the
+    sequence number of the current mission item.
+    """
+
+    REQUEST_TIMEOUT_SECS = 1.5
+    DOWNLOAD_TIMEOUT_SECS = 30
+
+    def __init__(self, vehicle):
+        self._vehicle = vehicle
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._items = []            # MISSION_ITEM messages by sequence number, home first
+        self._received = 0
+        self._last_progress = 0
+        self._current = 0
+
+    def clear(self):
+        with self._lock:
+            self._items = []
+            self._received = 0
+            self._ready.clear()
+
+    def download(self):
+        """Start fetching the mission, wait_ready() waits for it"""
+        self.clear()
+        with self._lock:
+            self._last_progress = time.monotonic()
+        self._vehicle._send('mission_request_list')
+
+    def wait_ready(self, timeout=DOWNLOAD_TIMEOUT_SECS):
+        deadline = time.monotonic() + timeout
+        while not self._ready.wait(0.1):
+            if time.monotonic() > deadline:
+                raise IOError("Mission download timeout")
+
+            # Ask again for whatever got lost over the link
+            with self._lock:
+                stalled = time.monotonic() - self._last_progress > self.REQUEST_TIMEOUT_SECS
+                if stalled:
+                    self._last_progress = time.monotonic()
+                waiting_for = self._received if self._items else None
+            if stalled:
+                if waiting_for == None:
+                    self._vehicle._send('mission_request_list')
+                else:
+                    self._vehicle._send('mission_request', waiting_for)
+        return True
+
+    def _handle(self, message):
+        request = None
+        with self._lock:
+            if message.get_type() == 'MISSION_COUNT':
+                if self._items or self._ready.is_set():
+                    return
+                self._items = [None] * message.count
+                self._received = 0
+                request = 0
+            elif message.seq == self._received and self._received < len(self._items):
+                if message.get_type() == 'MISSION_ITEM_INT':
+                    message.x /= 1e7
+                    message.y /= 1e7
+                self._items[message.seq] = message
+                self._received += 1
+                request = self._received
+            else:
+                return
+            self._last_progress = time.monotonic()
+            complete = self._received == len(self._items)
+
+        if complete:
+            self._vehicle._send('mission_ack', self._vehicle._mavlink.MAV_MISSION_ACCEPTED)
+            logging.debug("Mission downloaded [%i items]", len(self._items))
+            self._ready.set()
+        else:
+            self._vehicle._send('mission_request', request)
+
+    @property
+    def next(self):
+        return self._current
+
+    @next.setter
+    def next(self, seq):
+        self._vehicle._send('mission_set_current', seq)
+        self._current = seq
+
+    def __len__(self):
+        with self._lock:
+            return max(len(self._items) - 1, 0)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if index < 0 or index + 1 >= len(self._items):
+                raise IndexError(index)
+            return self._items[index + 1]
+
+
+def connect(connection_string, baud=115200, wait_ready=True):
+    """Connect to the autopilot, in place of dronekit.connect()"""
+    from pymavlink import mavutil
+
+    connection = mavutil.mavlink_connection(connection_string, baud=baud, source_system=255)
+    vehicle = MavlinkVehicle(connection)
+    if wait_ready:
+        try:
+            vehicle.wait_ready()
+        except Exception:
+            vehicle.close()
+            raise
+    return vehicle
@@ -4,9 +4,12 @@ import serial
 import time
 import threading
 
-from geopy import distance
-from pymavlink import mavutil, mavwp
-from dronekit import connect
+from ..boot import timeline
+from ..history import StationHistory
+from ..tracing import tracer
+
+# pymavlink (or dronekit) and geopy are slow to import, so they're imported
+# where they're first needed rather than holding up start-up of the other services
 
 class Navigation(object):
 
@@ -14,13 +17,31 @@ class Navigation(object):
     LOITER_WAYPOINT_COMMAND = 17
     ROI_WAYPOINT_COMMAND = 201
 
-    def __init__(self, _rx_queue):
+    # Distances (m) from a data station to begin XBee wakeup and SFTP download.
+    # Wakeup starts earlier for stations known to boot slowly.
+    WAKE_DISTANCE = 5000
+    DOWNLOAD_DISTANCE = 1000
+
+    # Data stations that follow one another in the mission this close (m) to
+    # the first are all serviced together from the first one's loiter point,
+    # and the mission then skips ahead past the rest of them, so their own
+    # loiter waypoints aren't flown. 0 (or the CLUSTER_DISTANCE environment
+    # variable set to 0) services every station from its own waypoint.
+    CLUSTER_DISTANCE = 500
+
+    def __init__(self, _rx_queue, _connect_vehicle=None, _history=None):
         self.rx_queue = _rx_queue
+        self.history = _history if _history != None else StationHistory()
+
+        # Supplies a connected vehicle in place of the autopilot, e.g. in simulation
+        self.__connect_vehicle = _connect_vehicle
 
         self.__vehicle = None
         self.__alive = True
 
     def wait_flight_distance(self, dist, waypoint, data_station_id):
+        from geopy import distance
+
         while True:
 
             # Avoid calculations on "None"
@@ -45,6 +66,26 @@ class Navigation(object):
             else:
                 time.sleep(1)
 
+    def station_cluster(self, waypoints, index):
+        """
+        Indices of the data station at `index` and those directly after it
+        in the mission within CLUSTER_DISTANCE of it
+        """
+        from geopy import distance
+
+        cluster_distance = float(os.getenv('CLUSTER_DISTANCE') or self.CLUSTER_DISTANCE)
+
+        cluster = [index]
+        i = index + 2
+        while cluster_distance > 0 and i+1 < len(waypoints) and \
+          waypoints[i].command == self.LOITER_WAYPOINT_COMMAND and \
+          waypoints[i+1].command == self.ROI_WAYPOINT_COMMAND and \
+          distance.distance((waypoints[index].x, waypoints[index].y),
+                            (waypoints[i].x, waypoints[i].y)).m <= cluster_distance:
+            cluster.append(i)
+            i += 2
+        return cluster
+
     def run(self, wakeup_event, download_event, new_ds, is_downloading, is_awake, led_status):
 
         #######################################################################
@@ -60,6 +101,10 @@ class Navigation(object):
         logging.info("Connecting to vehicle on %s", connection_string)
         led_status.put("PENDING")
 
+        if self.__connect_vehicle != None:
+            self.__vehicle = self.__connect_vehicle()
+            timeline.mark('vehicle connected')
+
         while self.__alive == True and self.__vehicle == None:
             try:
                 # Verify that the serial port is cleared
@@ -68,17 +113,22 @@ class Navigation(object):
                     s.close()
                     time.sleep(3) # CLOSE PLS
                     logging.info("Cleared serial port")
+                    timeline.mark('serial port cleared')
 
+                # The lean MAVLink link unless told to fall back on dronekit
+                if os.getenv('VEHICLE_LINK') == 'dronekit':
+                    from dronekit import connect
+                else:
+                    from .mavlink_vehicle import connect
                 self.__vehicle = connect(connection_string, baud=115200, wait_ready=True)
                 logging.info("Connection to vehicle successful")
+                timeline.mark('vehicle connected')
                 break
             except:
                 logging.error("Failed to connect to vehicle. Retrying...")
                 led_status.put("FAILURE")
                 time.sleep(3)
 
-        time.sleep(3) # Verify LEDs
-
         #######################################################################
         # Monitor location relative to next data station to instruct the data
         # station handler to step through the wakeup and download process
@@ -88,6 +138,7 @@ class Navigation(object):
         # Continously monitor state of autopilot and kick of download when necessary
         current_waypoint = 0
         waypoints = []
+        flying = False
         while self.__alive:
             # Get most up-to-date mission
             try:
@@ -100,6 +151,7 @@ class Navigation(object):
                 waypoints.download()
                 waypoints.wait_ready()
                 led_status.put("READY") # Not truly ready until waypoint download works
+                timeline.ready()
 
             except:
                 logging.error("Waypoint download failure")
@@ -122,29 +174,47 @@ class Navigation(object):
                     next_data_station_index = i
                     break
 
+            # Each flight's trace is written out once it has landed and disarmed
+            if self.__vehicle.armed:
+                flying = True
+            elif flying:
+                flying = False
+                tracer.export()
+
             if not self.__vehicle.armed:
                 logging.info("Waiting for arming...")
                 time.sleep(3)
 
             elif next_data_station_index != None:
 
+                cluster = self.station_cluster(waypoints, next_data_station_index)
+
                 # By default, PX4 uses floats. We use strings (of rounded integers) for data station IDs
                 data_station_id = str(int(waypoints[next_data_station_index+1].param3))
+                data_station_ids = [str(int(waypoints[i+1].param3)) for i in cluster]
 
-                logging.info("En route to data station: %s", data_station_id)
+                logging.info("En route to data station: %s", ', '.join(data_station_ids))
 
-                # Pass the data station ID to the data station handler
-                self.rx_queue.put(data_station_id)
+                # Pass the data station IDs to the data station handler
+                for i in data_station_ids:
+                    self.rx_queue.put(i)
 
-                # Let the data station handler know there's a new station to service
+                # Let the data station handler know there are new stations to service
                 new_ds.set()
 
                 # Give the data station hander some time to pick up the new data station ID
                 time.sleep(5)
 
-                # Wait until the sUAS is within 5000 m (5 km) of the data station for XBee wakeup
+                # Wait until the sUAS is within 5000 m (5 km), or the distance the station's
+                # boot time calls for, of the data station for XBee wakeup
                 if not (os.getenv("HARDWARE_TEST") == 'True'):
-                    self.wait_flight_distance(5000, waypoints[next_data_station_index], data_station_id)
+                    wake_distance = max(self.history.wake_distance(i, self.DOWNLOAD_DISTANCE,
+                                                                   getattr(self.__vehicle, 'groundspeed', None),
+                                                                   self.WAKE_DISTANCE)
+                                        for i in data_station_ids)
+                    with tracer.span('approach to wake distance', 'navigation', stations=data_station_ids,
+                                     distance=round(wake_distance)):
+                        self.wait_flight_distance(wake_distance, waypoints[next_data_station_index], data_station_id)
 
                 logging.info("Beginning XBee wakeup from data station %s...", data_station_id)
 
@@ -153,15 +223,17 @@ class Navigation(object):
 
                 # Wait until the sUAS is within 1000 m (1 km) of the data station for SFTP download
                 if not (os.getenv("HARDWARE_TEST") == 'True'):
-                    self.wait_flight_distance(1000, waypoints[next_data_station_index], data_station_id)
+                    with tracer.span('approach to download distance', 'navigation', stations=data_station_ids):
+                        self.wait_flight_distance(self.DOWNLOAD_DISTANCE, waypoints[next_data_station_index], data_station_id)
                 logging.info("Beginning data download from data station %s...", data_station_id)
 
                 # Tell the data stataion handler to begin download
                 download_event.set()
 
-                while is_downloading.is_set():
-                    logging.debug("Downloading...")
-                    time.sleep(3)
+                with tracer.span('downloading', 'navigation', stations=data_station_ids):
+                    while is_downloading.is_set():
+                        logging.debug("Downloading...")
+                        time.sleep(3)
 
                 wakeup_event.clear()
                 download_event.clear()
@@ -169,10 +241,14 @@ class Navigation(object):
                 # Wait till we actually hit the waypoint before moving to next one
                 # This is critical for flights with low margins for error with flight paths
                 # This also makes SITL a little more realistic
-                self.wait_flight_distance(100, waypoints[next_data_station_index], data_station_id)
-
-                # Skip the ROI point
-                next_waypoint = next_data_station_index+2
+                with tracer.span('approach to waypoint', 'navigation', stations=data_station_ids):
+                    self.wait_flight_distance(100, waypoints[next_data_station_index], data_station_id)
+
+                # Skip the ROI point, and the rest of the cluster serviced from here
+                next_waypoint = cluster[-1]+2
+                if len(cluster) > 1:
+                    logging.info("Skipping loiter waypoints %s, already serviced from waypoint %i",
+                                 ', '.join(str(i+1) for i in cluster[1:]), next_data_station_index+1)
                 logging.info("Done downloading. Moving on to waypoint %i...", (next_waypoint+1))
                 self.__vehicle.commands.next = next_waypoint
 
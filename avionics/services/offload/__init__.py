@@ -0,0 +1,2 @@
+from .offload import Offload
+from .stand_in import StandInServer
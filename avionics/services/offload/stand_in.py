@@ -0,0 +1,63 @@
+import logging
+import os
+import socketserver
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+
+class StandInServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    """Ground server stand-in for testing offload
+
+    Accepts HTTP PUT uploads and writes them under a local directory,
+    mirroring the request path.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, _root, _port=8000):
+        self.root = os.path.abspath(_root)
+        self._thread = None
+        HTTPServer.__init__(self, ('', _port), _PutHandler)
+
+    def start(self):
+        """Serve in the background"""
+        self._thread = threading.Thread(target=self.serve_forever, name='Stand-in Server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread != None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+
+
+class _PutHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' # Keep-alive, one connection per offload worker
+
+    def do_PUT(self):
+        path = os.path.abspath(os.path.join(self.server.root, unquote(self.path).lstrip('/')))
+        if not path.startswith(self.server.root + os.sep):
+            self.send_error(403)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            remaining = int(self.headers['Content-Length'])
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024*1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("Stand-in server: " + format, *args)
@@ -0,0 +1,123 @@
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+class SamplingProfiler(object):
+
+    """Low-overhead statistical profiler for the service threads
+
+    While running, a background thread samples the current stack of each
+    thread (or only those named) at a fixed rate and counts identical
+    stacks. On stop the counts are written as collapsed stacks (one
+    'thread;frame;frame count' line per stack), ready for flamegraph.pl or
+    speedscope.
+
+    Sampling only reads sys._current_frames(), so the profiled threads are
+    never interrupted beyond the sampler's own share of the GIL. It only
+    sees this process: a download isolated in a DownloadProcess (as on the
+    payload) does its transfers in a child process, which shows up here as
+    its session thread waiting on it.
+
+    """
+
+    # None for every thread: sessions, transfers, the catalog writer and
+    # the XBee come and go with each data station
+    DEFAULT_THREADS = None
+
+    def __init__(self, _thread_names=DEFAULT_THREADS, _interval_secs=0.01, _directory='.'):
+        self.thread_names = set(_thread_names) if _thread_names != None else None
+        self.interval_secs = _interval_secs
+        self.directory = _directory
+
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.path = None
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._thread != None
+
+    def toggle(self):
+        """Start sampling, or stop and write the profile if already running"""
+        if self.is_running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread != None:
+                return
+            self.samples = collections.Counter()
+            self.sample_count = 0
+            self._stop_event.clear()
+
+            self._thread = threading.Thread(target=self._sample, name='Profiler')
+            self._thread.daemon = True
+            self._thread.start()
+
+        logging.info("Profiler started [%s, every %.0f ms]",
+                     ', '.join(sorted(self.thread_names)) if self.thread_names != None else 'all threads',
+                     self.interval_secs*1000)
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks, return their path"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread == None:
+            return None
+
+        self._stop_event.set()
+        thread.join()
+
+        self.path = os.path.join(self.directory, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
+        self.write(self.path)
+
+        logging.info("Profiler stopped, %i samples written to %s", self.sample_count, self.path)
+        return self.path
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write("%s %i\n" % (stack, count))
+
+    def _sample(self):
+        own = threading.get_ident()
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, 'Thread %i' % ident)
+                if ident != own and (self.thread_names == None or name in self.thread_names):
+                    self.samples[_collapse(name, frame)] += 1
+            self.sample_count += 1
+
+            # Hold the rate without drifting; skip samples we have fallen behind on
+            deadline = max(deadline + self.interval_secs, time.monotonic())
+            self._stop_event.wait(deadline - time.monotonic())
+
+def _collapse(thread_name, frame):
+    frames = []
+    while frame != None:
+        code = frame.f_code
+        frames.append('%s (%s:%i)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ';'.join(reversed(frames))
+
+def dump_stacks():
+    """Log the current stack of every thread"""
+    names = {t.ident: t.name for t in threading.enumerate()}
+
+    for ident, frame in sys._current_frames().items():
+        logging.info("Thread %s (%i):\n%s", names.get(ident, '?'), ident,
+                     ''.join(traceback.format_stack(frame)).rstrip())
@@ -0,0 +1 @@
+from .segment_store import SegmentStore
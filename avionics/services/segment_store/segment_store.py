@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+
+class SegmentStore(object):
+
+    """Field data packed into a few large segment files
+
+    Writing thousands of small camera trap files as separate inodes is slow
+    on the SD card, wears it, and makes offload slow. Instead, file contents
+    are appended to segment files (`segment-00000.seg`, ...) in a download's
+    directory, and an index records each file's segment, offset, size,
+    modification time and SHA-256, one JSON line per file:
+
+        {"name": "IMG_0001.JPG", "segment": 0, "offset": 0, "size": 81234,
+         "mtime": 1530000000.0, "sha256": "..."}
+
+    Concurrent writers each append to a segment of their own. A file's
+    index line is only written once its contents are, so after a crash any
+    partly written file is just unindexed bytes. Files are read back
+    without copying through mmap, and export() unpacks the store into a
+    plain directory tree, e.g. on the ground after offload.
+
+    """
+
+    INDEX = 'index.jsonl'
+    SEGMENT = 'segment-%05i.seg'
+
+    # A segment is closed to new files once it reaches this size
+    SEGMENT_BYTES = 256*1024*1024
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._entries = {}          # Name -> index entry
+        self._segments = 0          # Segment files created so far
+        self._idle = []             # Segments open for appending, not in use by a writer
+        self._maps = {}             # Segment -> (mmap, file), for reading
+        self._retired = []          # Maps replaced while views of them were still in use
+
+        self._load()
+        self._index = open(os.path.join(directory, self.INDEX), 'a')
+
+    @classmethod
+    def is_store(cls, directory):
+        return os.path.exists(os.path.join(directory, cls.INDEX))
+
+    # -----------------------
+    # Writing
+    # -----------------------
+
+    def writer(self, name, mtime=None):
+        """
+        File-like object appending one file to the store, to be used as a
+        context manager. The file is indexed on a clean exit and discarded
+        if the block raises.
+        """
+        return _Writer(self, name, mtime)
+
+    def add(self, name, data, mtime=None):
+        with self.writer(name, mtime) as w:
+            w.write(data)
+
+    def close(self):
+        """Flush everything written to disk"""
+        with self._lock:
+            for segment, f in self._idle:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            self._idle = []
+
+            self._index.flush()
+            os.fsync(self._index.fileno())
+            self._index.close()
+
+            for segment_map, f in list(self._maps.values()) + self._retired:
+                self._unmap(segment_map, f)
+            self._maps = {}
+            self._retired = []
+
+    def _acquire(self):
+        """A segment no other writer is appending to, as (number, file)"""
+        with self._lock:
+            while self._idle:
+                segment, f = self._idle.pop()
+                if f.tell() < self.SEGMENT_BYTES:
+                    return segment, f
+                f.close()
+
+            segment = self._segments
+            self._segments += 1
+        return segment, open(self._segment_path(segment), 'ab')
+
+    def _release(self, segment, f):
+        with self._lock:
+            self._idle.append((segment, f))
+
+    def _commit(self, entry):
+        # Contents must reach the segment before the index says they're there
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._index.write(line)
+            self._index.flush()
+            self._entries[entry['name']] = entry
+
+    # -----------------------
+    # Reading
+    # -----------------------
+
+    def names(self):
+        with self._lock:
+            return sorted(self._entries)
+
+    def entry(self, name):
+        with self._lock:
+            return dict(self._entries[name])
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def read(self, name):
+        """A file's contents as a memoryview straight onto the segment's mmap"""
+        entry = self.entry(name)
+        if entry['size'] == 0:
+            return memoryview(b'')
+
+        end = entry['offset'] + entry['size']
+        with self._lock:
+            segment_map, f = self._maps.get(entry['segment'], (None, None))
+            if segment_map == None or len(segment_map) < end:
+                # Segments grow as files are added, so map again to see the new ones
+                if segment_map != None and not self._unmap(segment_map, f):
+                    self._retired.append((segment_map, f))
+                f = open(self._segment_path(entry['segment']), 'rb')
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[entry['segment']] = (segment_map, f)
+
+        return memoryview(segment_map)[entry['offset']:end]
+
+    def verify(self, name):
+        """True if a file's contents still match their recorded hash"""
+        return hashlib.sha256(self.read(name)).hexdigest() == self.entry(name)['sha256']
+
+    def export(self, destination):
+        """
+        Unpack every file into a plain directory, return the number exported
+
+        Files kept in the store's directory as they are (large, striped
+        downloads) are copied along with them.
+        """
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+
+        names = self.names()
+        for name in names:
+            entry = self.entry(name)
+            path = os.path.join(destination, name)
+            if os.path.dirname(name) and not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(self.read(name))
+            if entry.get('mtime') != None:
+                os.utime(path, (entry['mtime'], entry['mtime']))
+
+        plain = self.plain_names()
+        for name in plain:
+            shutil.copy2(os.path.join(self.directory, name), os.path.join(destination, name))
+
+        logging.info("Exported %i files from %s to %s", len(names) + len(plain), self.directory, destination)
+        return len(names) + len(plain)
+
+    def plain_names(self):
+        """Files in the store's directory that aren't in the store itself"""
+        return sorted(name for name in os.listdir(self.directory)
+                      if name != self.INDEX and not self._is_segment(name) and name not in self
+                      and os.path.isfile(os.path.join(self.directory, name)))
+
+    # -----------------------
+    # Internals
+    # -----------------------
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, self.SEGMENT % segment)
+
+    def _is_segment(self, name):
+        prefix, suffix = self.SEGMENT.split('%05i')
+        number = name[len(prefix):-len(suffix)]
+        return name.startswith(prefix) and name.endswith(suffix) and number.isdigit()
+
+    def _unmap(self, segment_map, f):
+        try:
+            segment_map.close()
+        except BufferError:
+            return False # Still being read, it's unmapped when the last view goes
+        f.close()
+        return True
+
+    def _load(self):
+        """Read the index, dropping entries whose contents never made it to disk"""
+        while os.path.exists(self._segment_path(self._segments)):
+            self._segments += 1
+
+        sizes = {}
+        try:
+            with open(os.path.join(self.directory, self.INDEX)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Torn last line
+
+                    segment = entry['segment']
+                    if segment not in sizes:
+                        path = self._segment_path(segment)
+                        sizes[segment] = os.path.getsize(path) if os.path.exists(path) else 0
+                    if entry['offset'] + entry['size'] <= sizes[segment]:
+                        self._entries[entry['name']] = entry
+        except IOError:
+            pass
+
+
+class _Writer(object):
+
+    def __init__(self, store, name, mtime):
+        self._store = store
+        self._name = name
+        self._mtime = mtime
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+        self._segment, self._file = store._acquire()
+        self._offset = self._file.tell()
+
+    def write(self, data):
+        self._file.write(data)
+        self._sha256.update(data)
+        self._size += len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            if kind == None:
+                self._file.flush()
+                self._store._commit({
+                    'name': self._name,
+                    'segment': self._segment,
+                    'offset': self._offset,
+                    'size': self._size,
+                    'mtime': self._mtime,
+                    'sha256': self._sha256.hexdigest(),
+                })
+            else:
+                # Reclaim the space for the segment's next file
+                self._file.flush()
+                self._file.truncate(self._offset)
+                self._file.seek(self._offset)
+        finally:
+            self._store._release(self._segment, self._file)
+        return False
@@ -0,0 +1 @@
+from .tracing import Tracer, tracer
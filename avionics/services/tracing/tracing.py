@@ -0,0 +1,167 @@
+import collections
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+class Tracer(object):
+
+    """Mission phase spans across threads, exported as Chrome trace JSON
+
+    Services wrap each phase of a data station visit in a span:
+
+        with tracer.span('POWER_ON', 'xbee', station=data_station_id) as span:
+            ...
+            span.args['attempts'] = attempts
+
+    Spans are kept with monotonic timestamps and the thread (and process)
+    they ran on in a bounded in-memory buffer, oldest dropped first. At the
+    end of each flight the buffer is written out in the Chrome trace event
+    format, which chrome://tracing and ui.perfetto.dev show as a timeline
+    with a track per thread.
+
+    Something that starts on one thread and is finished by another (an
+    XBee command) is an async span from begin() to its end(), which the
+    viewers show on a track of its own rather than as an overlapping slice.
+
+    A download in a separate process traces into its own buffer, which it
+    hands back with merge() when it finishes. Spans from a download process
+    that had to be killed are lost.
+
+    """
+
+    DEFAULT_DIRECTORY = '/srv/flight-data/traces'
+    MAX_EVENTS = 100000
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self._events = collections.deque(maxlen=max_events)
+        self._threads = {}          # (pid, tid) -> thread name
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def span(self, name, category='mission', **args):
+        """Context manager recording the time spent in the block"""
+        return _Span(self, name, category, args)
+
+    def begin(self, name, category='mission', **args):
+        """Start an async span, return it to end() from any thread"""
+        return _AsyncSpan(self, name, category, args)
+
+    def instant(self, name, category='mission', **args):
+        """Record a point in time, e.g. an event being set"""
+        pid, tid = self._thread()
+        self._events.append({'name': name, 'cat': category, 'ph': 'i', 's': 't',
+                             'ts': _microseconds(time.monotonic()), 'pid': pid, 'tid': tid, 'args': args})
+
+    def events(self):
+        """Everything recorded so far, and the names of the threads it was recorded on"""
+        with self._lock:
+            return list(self._events), dict(self._threads)
+
+    def merge(self, events, threads):
+        """Add what another process recorded, e.g. a download process"""
+        with self._lock:
+            self._threads.update(threads)
+        self._events.extend(events)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._threads = {}
+
+    def export(self, path=None):
+        """
+        Write the buffer as Chrome trace JSON, to a new file in
+        DEFAULT_DIRECTORY unless given a path, and clear it. Return the path,
+        None if there was nothing to write.
+        """
+        events, threads = self.events()
+        if not events:
+            return None
+
+        if path == None:
+            path = os.path.join(self.DEFAULT_DIRECTORY, time.strftime('trace-%Y%m%d-%H%M%S.json'))
+
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for (pid, tid), name in threads.items()]
+        metadata += [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                      'args': {'name': 'avionics' if pid == os.getpid() else 'download %i' % pid}}
+                     for pid in set(pid for pid, tid in threads)]
+
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+        except (IOError, OSError) as e:
+            logging.error("Unable to write trace: %s", e)
+            return None
+
+        self.clear()
+        logging.info("Wrote trace of %i events to %s", len(events), path)
+        return path
+
+    def _thread(self):
+        thread = threading.current_thread()
+        key = (os.getpid(), getattr(threading, 'get_native_id', threading.get_ident)())
+        if key not in self._threads:
+            with self._lock:
+                self._threads[key] = thread.name
+        return key
+
+    def _record(self, name, category, start, end, args):
+        pid, tid = self._thread()
+        self._events.append({'name': name, 'cat': category, 'ph': 'X',
+                             'ts': _microseconds(start), 'dur': _microseconds(end - start),
+                             'pid': pid, 'tid': tid, 'args': args})
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind != None:
+            self.args['error'] = '%s: %s' % (kind.__name__, value)
+        self.tracer._record(self.name, self.category, self.start, time.monotonic(), self.args)
+        return False
+
+
+class _AsyncSpan(object):
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+        self.pid, self.tid = tracer._thread()
+        self.id = '%i.%i' % (self.pid, next(tracer._ids))
+        self._event('b', dict(args))
+
+    def end(self):
+        self._event('e', self.args)
+
+    def _event(self, phase, args):
+        self.tracer._events.append({'name': self.name, 'cat': self.category, 'ph': phase, 'id': self.id,
+                                    'ts': _microseconds(time.monotonic()), 'pid': self.pid, 'tid': self.tid,
+                                    'args': args})
+
+
+def _microseconds(seconds):
+    return int(seconds * 1e6)
+
+# Shared by all services
+tracer = Tracer()
@@ -0,0 +1,7 @@
+from .clock import ScaledTime
+from .crypto_benchmark import CryptoBenchmark
+from .mission import SimulatedMission
+from .station import SimulatedStation
+from .storage_benchmark import StorageBenchmark
+from .vehicle import FakeVehicle
+from .xbee import SimulatedXBee
@@ -0,0 +1,28 @@
+import time
+
+class ScaledTime(object):
+    """
+    Stand-in for the `time` module that runs faster than real time.
+
+    Swapped in for a service module's `time` so its sleeps and distance
+    polling pass `acceleration` times faster, while network transfers still
+    happen in real time.
+    """
+
+    def __init__(self, acceleration=1.0):
+        self.acceleration = float(acceleration)
+        self._real_start = time.monotonic()
+        self._start = time.time()
+
+    def monotonic(self):
+        return (time.monotonic() - self._real_start) * self.acceleration
+
+    def time(self):
+        return self._start + self.monotonic()
+
+    def sleep(self, secs):
+        time.sleep(secs / self.acceleration)
+
+    def __getattr__(self, name):
+        # Everything else (strftime, etc.) behaves as usual
+        return getattr(time, name)
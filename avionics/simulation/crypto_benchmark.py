@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import time
+
+import paramiko
+
+from services.data_station_handler import crypto
+from services.data_station_handler.sftp import SFTPClient
+
+from .clock import ScaledTime
+from .station import SimulatedStation
+
+class CryptoBenchmark(object):
+
+    """Measure SSH algorithm combinations on this CPU against a local server
+
+    Every supported cipher/MAC pair is used for a bulk SFTP read of `size`
+    random bytes, and every key exchange for connection set-up alone, each
+    through SFTPClient's own transport set-up (compression included). Both
+    ends run on this machine, so on the payload the figures reflect its CPU
+    rather than the Wi-Fi link.
+
+    """
+
+    FILE_NAME = 'benchmark.bin'
+
+    # Measured, but never recommended
+    WEAK = ('3des-cbc', 'hmac-md5', 'hmac-md5-96', 'diffie-hellman-group1-sha1')
+
+    def __init__(self, size=8*1024*1024, address=('127.0.0.2', 2225), setups=3):
+        self.size = size
+        self.address = address
+        self.setups = setups
+
+    def run(self, ciphers=None, digests=None, kex=None):
+        """
+        Benchmark the given algorithms (default: all that paramiko supports),
+        return the report (see recommend())
+        """
+        options = paramiko.Transport._preferred_ciphers, paramiko.Transport._preferred_macs, \
+            paramiko.Transport._preferred_kex
+        ciphers = ciphers or options[0]
+        digests = digests or options[1]
+        kex = kex or options[2]
+
+        root = tempfile.mkdtemp(prefix='crypto-')
+        os.makedirs(os.path.join(root, 'media'))
+        with open(os.path.join(root, 'media', self.FILE_NAME), 'wb') as f:
+            f.write(os.urandom(self.size))
+
+        station = SimulatedStation('benchmark', root, self.address, paramiko.RSAKey.generate(2048),
+                                   ScaledTime(), boot_secs=0)
+        station.power_on()
+        while 'booted' not in station.events:
+            time.sleep(0.01)
+
+        try:
+            transfers = []
+            for cipher in ciphers:
+                for digest in digests:
+                    profile = {'ciphers': (cipher,), 'digests': (digest,), 'kex': (kex[0],), 'strict': True}
+                    setup, throughput = self._measure(profile, transfer=True)
+                    transfers.append({'cipher': cipher, 'mac': digest, 'setup': setup, 'throughput': throughput})
+
+            setups = []
+            for exchange in kex:
+                profile = {'ciphers': (ciphers[0],), 'digests': (digests[0],), 'kex': (exchange,), 'strict': True}
+                times = [self._measure(profile)[0] for _ in range(self.setups)]
+                times = sorted(t for t in times if t != None)
+                setups.append({'kex': exchange, 'setup': times[len(times)//2] if times else None})
+        finally:
+            station.power_off()
+            shutil.rmtree(root)
+
+        return self.recommend(transfers, setups)
+
+    def recommend(self, transfers, setups):
+        """
+        Pick the fastest cipher/MAC and key exchange, and the named profile
+        whose first choices measured fastest
+        """
+        transfers = sorted(transfers, key=lambda t: -(t['throughput'] or 0))
+        setups = sorted(setups, key=lambda s: s['setup'] if s['setup'] != None else float('inf'))
+
+        throughput = {(t['cipher'], t['mac']): t['throughput'] or 0 for t in transfers}
+        setup = {s['kex']: s['setup'] for s in setups if s['setup'] != None}
+
+        transfer = next((t for t in transfers if t['throughput'] and
+                         t['cipher'] not in self.WEAK and t['mac'] not in self.WEAK), None)
+        exchange = next((s for s in setups if s['setup'] != None and s['kex'] not in self.WEAK), None)
+
+        def score(name):
+            profile = crypto.PROFILES[name]
+            cipher = _first(profile.get('ciphers'), paramiko.Transport._preferred_ciphers)
+            digest = _first(profile.get('digests'), paramiko.Transport._preferred_macs)
+            exchange = _first(profile.get('kex'), paramiko.Transport._preferred_kex)
+            return (throughput.get((cipher, digest), 0), -setup.get(exchange, float('inf')))
+
+        return {
+            'transfers': transfers,
+            'setups': setups,
+            'best': {
+                'ciphers': (transfer['cipher'],) if transfer else (),
+                'digests': (transfer['mac'],) if transfer else (),
+                'kex': (exchange['kex'],) if exchange else (),
+            },
+            'profile': max(sorted(crypto.PROFILES), key=score),
+        }
+
+    def _measure(self, profile, transfer=False):
+        """(set-up seconds, bytes per second) over one connection, None where it failed"""
+        client = SFTPClient(SimulatedStation.USERNAME, SimulatedStation.PASSWORD, 'benchmark.local',
+                            _address=self.address, _crypto_profile=profile)
+        transport = None
+        try:
+            start = time.monotonic()
+            transport = client._openTransport()
+            setup = time.monotonic() - start
+            if not transfer:
+                return setup, None
+
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            start = time.monotonic()
+            with sftp.open('/media/' + self.FILE_NAME, 'rb') as remote:
+                remote.prefetch(self.size)
+                received = 0
+                while True:
+                    data = remote.read(SFTPClient.STRIPE_READ_BYTES)
+                    if not data:
+                        break
+                    received += len(data)
+            return setup, received / (time.monotonic() - start)
+        except Exception:
+            # Not every algorithm is usable with every crypto backend
+            return None, None
+        finally:
+            if transport != None:
+                transport.close()
+
+def _first(preferred, supported):
+    for algorithm in preferred or ():
+        if algorithm in supported:
+            return algorithm
+    return supported[0]
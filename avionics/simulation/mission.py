@@ -0,0 +1,243 @@
+import importlib
+import os
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import paramiko
+
+from services import Catalog
+from services import DataStationHandler
+from services import Navigation
+from services import StationHistory
+from services import tracer
+from services.data_station_handler.download_process import DownloadProcess
+from services.data_station_handler.resolver import StationResolver
+from services.data_station_handler.sftp import SFTPClient
+
+from .clock import ScaledTime
+from .station import SimulatedStation
+from .vehicle import FakeCommand, FakeVehicle, METERS_PER_DEGREE
+from .xbee import SimulatedXBee
+
+class SimulatedMission(object):
+
+    """End-to-end mission without the autopilot or data station hardware
+
+    Drives the real Navigation and DataStationHandler threads against a
+    scripted vehicle flying a mission past N simulated data stations, each
+    woken over simulated XBee and serving its files from a local SFTP server
+    on its own loopback address.
+
+    Flight, XBee retries and station boot run in accelerated time. SSH
+    connection and transfer run in real time, so the per-station connect
+    and transfer times and the mission bytes per minute are comparable
+    from run to run as a throughput regression benchmark.
+
+    Stations serve on `port`, or with port 0 on a free one each, picked
+    before the mission so the handler can be told where to find them.
+
+    Given `trace_path`, the mission's spans are written there as Chrome
+    trace JSON (see Tracer).
+
+    """
+
+    LOITER_WAYPOINT_COMMAND = 17
+    ROI_WAYPOINT_COMMAND = 201
+
+    HOME = (37.0, -122.0)
+    FIRST_STATION_ID = 321
+
+    def __init__(self, stations=3, acceleration=20.0, files_per_station=20, file_size=256*1024,
+        spacing_m=3000, boot_secs=30.0, port=2222, isolate_download=False, trace_path=None):
+
+        self.station_count = stations
+        self.acceleration = acceleration
+        self.files_per_station = files_per_station
+        self.file_size = file_size
+        self.spacing_m = spacing_m
+        self.boot_secs = boot_secs
+        self.port = port
+        self.isolate_download = isolate_download
+        self.trace_path = trace_path
+
+        self.clock = ScaledTime(acceleration)
+        self.root = None
+        self.stations = {}
+
+    def run(self, timeout_secs=600):
+        """Fly the mission, return the report (see report())"""
+
+        self.root = tempfile.mkdtemp(prefix='mission-')
+        if self.isolate_download:
+            # Before the environment is changed for the mission, we couldn't import in it
+            DownloadProcess.start_server()
+        environment = dict(os.environ)
+        patches = self._patch()
+        try:
+            return self._fly(timeout_secs)
+        finally:
+            for target, name, value in patches:
+                setattr(target, name, value)
+            os.environ.clear()
+            os.environ.update(environment)
+            shutil.rmtree(self.root)
+
+    def _fly(self, timeout_secs):
+        host_key = paramiko.RSAKey.generate(2048)
+        mission = []
+        for i in range(self.station_count):
+            data_station_id = str(self.FIRST_STATION_ID + i)
+            station_root = os.path.join(self.root, 'stations', data_station_id)
+            self._populate(station_root)
+
+            address = ('127.0.0.%i' % (i+2), self.port)
+            if self.port == 0:
+                address = _free_address(address[0])
+            self.stations[data_station_id] = SimulatedStation(data_station_id, station_root, address, host_key,
+                                                              self.clock, self.boot_secs)
+
+            lat = self.HOME[0] + (i+1)*self.spacing_m/METERS_PER_DEGREE
+            mission.append(FakeCommand(self.LOITER_WAYPOINT_COMMAND, lat, self.HOME[1]))
+            mission.append(FakeCommand(self.ROI_WAYPOINT_COMMAND, lat, self.HOME[1], float(data_station_id)))
+
+        vehicle = FakeVehicle(mission, self.HOME, self.clock)
+
+        rx_queue = queue.Queue()
+        wakeup_event = threading.Event()
+        download_event = threading.Event()
+        new_ds = threading.Event()
+        is_downloading = threading.Event()
+        is_awake = threading.Event()
+        led_status = queue.Queue()
+
+        history = StationHistory(os.path.join(self.root, 'payload', 'station-history.json'))
+        resolver = StationResolver(os.path.join(self.root, 'payload', 'station-addresses.json'))
+        dl = DataStationHandler(120000, 120000, 600000, rx_queue, self.isolate_download, history, resolver,
+                                SimulatedXBee(self.stations))
+        for data_station_id, station in self.stations.items():
+            dl.station_addresses[data_station_id] = station.address
+
+        nav = Navigation(rx_queue, lambda: vehicle, history)
+
+        tracer.clear()
+        start = time.monotonic()
+
+        thread_data_station_handler = threading.Thread(target=dl.run, args=(wakeup_event, download_event, new_ds, is_downloading, is_awake))
+        thread_data_station_handler.daemon = True
+        thread_data_station_handler.name = 'DS Handler'
+        thread_data_station_handler.start()
+
+        thread_navigation = threading.Thread(target=nav.run, args=(wakeup_event, download_event, new_ds, is_downloading, is_awake, led_status,))
+        thread_navigation.daemon = True
+        thread_navigation.name = 'Navigation'
+        thread_navigation.start()
+
+        # The mission is over once the last station has been shut down
+        while time.monotonic() - start < timeout_secs and \
+            not all('power_off_ack' in s.events for s in self.stations.values()):
+            time.sleep(0.1)
+        end = time.monotonic()
+
+        dl.stop()
+        nav.stop()
+
+        if self.trace_path != None:
+            tracer.export(self.trace_path)
+
+        return self.report(end - start)
+
+    def report(self, elapsed):
+        """
+        Per-station visit timings (seconds) and mission totals
+
+        wake is in simulated time, the rest is real time.
+        """
+        stations = []
+        for data_station_id in sorted(self.stations):
+            station = self.stations[data_station_id]
+            events = station.events
+
+            def between(first, last, scale=1.0):
+                if first in events and last in events:
+                    return (events[last] - events[first]) * scale
+                return None
+
+            files = 0
+            field = SFTPClient.LOCAL_FIELD_DATA_DESTINATION
+            downloads = os.listdir(field) if os.path.isdir(field) else []
+            for download in downloads:
+                if download.startswith(data_station_id + '-'):
+                    files += len(os.listdir(os.path.join(field, download)))
+
+            stations.append({
+                'data_station_id': data_station_id,
+                'wake': between('power_on', 'power_on_ack', self.acceleration),
+                'connect': between('accept', 'authenticated'),
+                'transfer': between('authenticated', 'last_transfer'),
+                'shutdown': between('last_transfer', 'power_off_ack'),
+                'bytes': station.bytes_served,
+                'files': files,
+            })
+
+        total_bytes = sum(s['bytes'] for s in stations)
+        return {
+            'stations': stations,
+            'elapsed': elapsed,
+            'bytes': total_bytes,
+            'bytes_per_minute': total_bytes / (elapsed/60) if elapsed else 0.0,
+            'complete': all(s['files'] >= self.files_per_station for s in stations),
+        }
+
+    def _populate(self, station_root):
+        field = os.path.join(station_root, 'media', 'DCIM')
+        logs = os.path.join(station_root, 'media', 'logs')
+        os.makedirs(field)
+        os.makedirs(logs)
+
+        for i in range(self.files_per_station):
+            with open(os.path.join(field, 'IMG_%04i.JPG' % i), 'wb') as f:
+                f.write(os.urandom(self.file_size))
+
+        with open(os.path.join(logs, 'station.log'), 'w') as f:
+            f.write('station booted\n' * 1000)
+
+    def _patch(self):
+        """
+        Point the services at the mission's directories and clock, return
+        the attributes to restore afterwards as (object, name, original value)
+        """
+        payload = os.path.join(self.root, 'payload')
+        patches = [
+            (SFTPClient, 'LOCAL_FIELD_DATA_DESTINATION', os.path.join(payload, 'field') + '/'),
+            (SFTPClient, 'LOCAL_LOG_DESTINATION', os.path.join(payload, 'logs') + '/'),
+            (Catalog, 'DEFAULT_PATH', os.path.join(payload, 'catalog.db')),
+        ]
+        for name in ('services.navigation.navigation',
+                     'services.data_station_handler.data_station_handler',
+                     'services.data_station_handler.xbee_scheduler'):
+            patches.append((importlib.import_module(name), 'time', self.clock))
+
+        originals = []
+        for target, name, value in patches:
+            originals.append((target, name, getattr(target, name)))
+            setattr(target, name, value)
+
+        # Real-world behaviour, not the shortcuts taken in development and testing
+        for variable in ('DEVELOPMENT', 'TESTING', 'HARDWARE_TEST'):
+            os.environ[variable] = 'False'
+
+        return originals
+
+
+def _free_address(host):
+    """(host, port) with a port nothing is listening on right now"""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        probe.bind((host, 0))
+        return probe.getsockname()
+    finally:
+        probe.close()
@@ -0,0 +1,224 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+class SimulatedStation(object):
+
+    """A data station: power state, boot delay and an SFTP server
+
+    The station's files live under `root`, which the SFTP server presents as
+    `/`. Once powered on over (simulated) XBee, the server comes up after
+    `boot_secs` of simulated time and serves until powered off.
+
+    Timestamps (real, monotonic) of each step of a visit are recorded in
+    `events` so the mission harness can report where the time went.
+
+    """
+
+    USERNAME = 'pi'
+    PASSWORD = 'raspberry'
+
+    # Channels each connection may have open at once, as sshd's default MaxSessions
+    MAX_SESSIONS = 10
+
+    def __init__(self, data_station_id, root, address, host_key, clock, boot_secs=30.0):
+        self.data_station_id = data_station_id
+        self.root = root
+        self.address = address
+        self.host_key = host_key
+        self.boot_secs = boot_secs
+
+        self.events = {}
+        self.bytes_served = 0
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._powered_on_at = None
+        self._listener = None
+        self._transports = []
+
+    def record(self, event, first=True):
+        """Record the time of an event, keeping the first occurrence unless told otherwise"""
+        with self._lock:
+            if not first or event not in self.events:
+                self.events[event] = time.monotonic()
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes_served += count
+        self.record('last_transfer', first=False)
+
+    @property
+    def is_booted(self):
+        return self._powered_on_at != None and \
+            self._clock.monotonic() - self._powered_on_at >= self.boot_secs
+
+    def power_on(self):
+        if self._powered_on_at != None:
+            return
+
+        self.record('power_on')
+        self._powered_on_at = self._clock.monotonic()
+        threading.Thread(target=self._boot, name='Station %s' % self.data_station_id, daemon=True).start()
+
+    def power_off(self):
+        if self._powered_on_at == None:
+            return
+
+        self.record('power_off')
+        self._powered_on_at = None
+        if self._listener != None:
+            # Closing alone doesn't wake accept(), which keeps the port bound
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+            self._listener = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def _boot(self):
+        self._clock.sleep(self.boot_secs)
+        if self._powered_on_at == None:
+            return
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(8)
+        self.address = listener.getsockname()   # Port 0 picks a free one
+        self._listener = listener
+        self.record('booted')
+        logging.debug("Simulated station %s serving on %s:%i", self.data_station_id, *self.address)
+
+        while self._listener == listener:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                break
+
+            self.record('accept')
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _StationSFTPServer, self)
+            transport.start_server(event=threading.Event(), server=_StationServer(self))
+            self._transports.append(transport)
+
+
+class _StationServer(paramiko.ServerInterface):
+
+    def __init__(self, station):
+        self.station = station
+        self.sessions = 0
+
+    def check_auth_password(self, username, password):
+        if username == SimulatedStation.USERNAME and password == SimulatedStation.PASSWORD:
+            self.station.record('authenticated')
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind != 'session':
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        with self.station._lock:
+            if self.sessions >= self.station.MAX_SESSIONS:
+                return paramiko.OPEN_FAILED_RESOURCE_SHORTAGE
+            self.sessions += 1
+        return paramiko.OPEN_SUCCEEDED
+
+
+class _StationHandle(paramiko.SFTPHandle):
+
+    def __init__(self, station, flags=0):
+        super(_StationHandle, self).__init__(flags)
+        self.station = station
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def read(self, offset, length):
+        data = super(_StationHandle, self).read(offset, length)
+        if isinstance(data, bytes):
+            self.station.add_bytes(len(data))
+        return data
+
+
+class _StationSFTPServer(paramiko.SFTPServerInterface):
+
+    """SFTP view of the station's root directory"""
+
+    def __init__(self, server, station, *args, **kwargs):
+        super(_StationSFTPServer, self).__init__(server, *args, **kwargs)
+        self.server = server
+        self.station = station
+
+    def session_ended(self):
+        with self.station._lock:
+            self.server.sessions -= 1
+
+    def _local(self, path):
+        return os.path.join(self.station.root, os.path.normpath('/' + path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return os.path.normpath('/' + path)
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            entries = []
+            for name in os.listdir(local):
+                attributes = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attributes.filename = name
+                entries.append(attributes)
+            return entries
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags, 0o644)
+            mode = 'rb' if (flags & (os.O_WRONLY | os.O_RDWR)) == 0 else 'r+b'
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        handle = _StationHandle(self.station, flags)
+        handle.filename = local
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
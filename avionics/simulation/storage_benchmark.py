@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import time
+
+from services import Offload
+from services import StandInServer
+from services import SegmentStore
+
+class StorageBenchmark(object):
+
+    """Small-file write and offload throughput, plain files vs segment store
+
+    Writes `files` files of `file_size` random bytes the way a download
+    does, once as separate files and once into a SegmentStore, syncing to
+    disk at the end of each. Each layout is then offloaded over HTTP to a
+    stand-in ground server on this machine. Run it on the payload's SD card
+    (`directory`) for meaningful numbers.
+
+    """
+
+    def __init__(self, files=2000, file_size=64*1024, directory=None, connections=4, port=8001):
+        self.files = files
+        self.file_size = file_size
+        self.directory = directory
+        self.connections = connections
+        self.port = port
+
+    def run(self):
+        """Return {layout: {'write': bytes/s, 'offload': bytes/s}}"""
+        root = tempfile.mkdtemp(prefix='storage-', dir=self.directory)
+        payload = [os.urandom(self.file_size) for _ in range(min(self.files, 64))]
+
+        try:
+            results = {}
+            for layout in ('files', 'segments'):
+                source = os.path.join(root, layout, 'source')
+                bundle = os.path.join(source, '321-%s' % layout)
+                os.makedirs(bundle)
+
+                start = time.monotonic()
+                self._write(layout, bundle, payload)
+                os.sync()
+                write = time.monotonic() - start
+
+                server = StandInServer(os.path.join(root, layout, 'ground'), self.port)
+                server.start()
+                try:
+                    start = time.monotonic()
+                    Offload('http://127.0.0.1:%i/field' % self.port, self.connections, source,
+                            os.path.join(root, layout, 'catalog.db')).run()
+                    offload = time.monotonic() - start
+                finally:
+                    server.stop()
+
+                total = self.files * self.file_size
+                results[layout] = {'write': total / write, 'offload': total / offload}
+        finally:
+            shutil.rmtree(root)
+
+        return results
+
+    def _write(self, layout, bundle, payload):
+        if layout == 'files':
+            for i in range(self.files):
+                with open(os.path.join(bundle, 'IMG_%05i.JPG' % i), 'wb') as f:
+                    f.write(payload[i % len(payload)])
+            return
+
+        store = SegmentStore(bundle)
+        for i in range(self.files):
+            store.add('IMG_%05i.JPG' % i, payload[i % len(payload)], time.time())
+        store.close()
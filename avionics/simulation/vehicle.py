@@ -0,0 +1,118 @@
+import math
+import threading
+import time
+
+METERS_PER_DEGREE = 111320.0
+
+class FakeCommand(object):
+    """Mission item with the fields of a dronekit Command that Navigation reads"""
+
+    def __init__(self, command, x, y, param3=0):
+        self.command = command
+        self.x = x
+        self.y = y
+        self.param3 = param3
+
+
+class FakeCommands(object):
+    """
+    The dronekit CommandSequence interface: a list of mission items that has
+    to be downloaded before use, and the index of the next waypoint.
+    """
+
+    def __init__(self, mission):
+        self._mission = mission
+        self._items = []
+        self.next = 1
+
+    def clear(self):
+        self._items = []
+
+    def download(self):
+        self._items = list(self._mission)
+
+    def wait_ready(self):
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+
+class _Frame(object):
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+
+class _Location(object):
+    def __init__(self, lat, lon):
+        self.global_relative_frame = _Frame(lat, lon)
+
+
+class FakeVehicle(object):
+
+    """Scripted vehicle flying its mission in accelerated time
+
+    Flies straight at `groundspeed` toward the mission item before
+    `commands.next`, steps past waypoints and DO_SET_ROI items, and holds at
+    loiter waypoints until Navigation moves `commands.next` on, as it does
+    when a data station has been serviced.
+
+    """
+
+    STANDARD_WAYPOINT_COMMAND = 16
+    LOITER_WAYPOINT_COMMAND = 17
+    ACCEPTANCE_RADIUS_M = 50
+    STEP_SECS = 0.02 # Real time between position updates
+
+    def __init__(self, mission, home, clock, groundspeed=18.0):
+        self.commands = FakeCommands(mission)
+        self.location = _Location(*home)
+        self.armed = True
+        self.groundspeed = groundspeed
+
+        self._clock = clock
+        self._alive = True
+        self._thread = threading.Thread(target=self._fly, name='Fake Vehicle')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._alive = False
+
+    def _fly(self):
+        last = self._clock.monotonic()
+        while self._alive:
+            time.sleep(self.STEP_SECS)
+            now = self._clock.monotonic()
+            self._step(now - last)
+            last = now
+
+    def _step(self, dt):
+        mission = self.commands._mission
+        index = self.commands.next - 1
+        if index < 0 or index >= len(mission):
+            return
+
+        target = mission[index]
+        if target.command not in (self.STANDARD_WAYPOINT_COMMAND, self.LOITER_WAYPOINT_COMMAND):
+            self.commands.next += 1
+            return
+
+        frame = self.location.global_relative_frame
+        north = (target.x - frame.lat) * METERS_PER_DEGREE
+        east = (target.y - frame.lon) * METERS_PER_DEGREE * math.cos(math.radians(frame.lat))
+        remaining = math.hypot(north, east)
+
+        travel = self.groundspeed * dt
+        if remaining <= travel:
+            frame.lat, frame.lon = target.x, target.y
+        else:
+            frame.lat += north/remaining * travel / METERS_PER_DEGREE
+            frame.lon += east/remaining * travel / (METERS_PER_DEGREE * math.cos(math.radians(frame.lat)))
+
+        if target.command == self.STANDARD_WAYPOINT_COMMAND and remaining < self.ACCEPTANCE_RADIUS_M:
+            self.commands.next += 1
@@ -0,0 +1,81 @@
+import threading
+
+from services.data_station_handler.xbee import XBee
+
+class SimulatedRadio(object):
+    """
+    Stand-in for the XBee's serial port, on the air with simulated data
+    stations. Command frames written to it reach the station they name, and
+    every station's ACK frames come back interleaved on the one byte stream
+    read from it, as they would from the real radio.
+    """
+
+    def __init__(self, stations, timeout=0.1):
+        self.stations = stations # Data station ID -> SimulatedStation
+        self.timeout = timeout
+        self.start_delimiter = '~'
+
+        self._sent = ''
+        self._received = bytearray()
+        self._condition = threading.Condition()
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            return len(self._received)
+
+    def write(self, data):
+        self._sent += data.decode('utf-8')
+
+        # Whole frames: delimiter, 3 character station ID, command code
+        while True:
+            start = self._sent.find(self.start_delimiter)
+            if start < 0 or len(self._sent) - start < 5:
+                break
+            frame, self._sent = self._sent[start+1:start+5], self._sent[start+5:]
+            self._deliver(frame[:3], frame[3])
+
+    def read(self, size=1):
+        with self._condition:
+            if not self._received:
+                self._condition.wait(self.timeout)
+            data = bytes(self._received[:size])
+            del self._received[:size]
+            return data
+
+    def _deliver(self, data_station_id, command_code):
+        station = self.stations.get(data_station_id)
+        if station == None:
+            return
+
+        # POWER_ON is acknowledged once the station has booted, POWER_OFF straight away
+        if command_code == '1':
+            station.power_on()
+            if not station.is_booted:
+                return
+            station.record('power_on_ack')
+        elif command_code == '2':
+            station.power_off()
+            station.record('power_off_ack')
+        else:
+            return
+
+        with self._condition:
+            self._received += (self.start_delimiter + data_station_id + command_code).encode('utf-8')
+            self._condition.notify_all()
+
+
+class SimulatedXBee(XBee):
+    """
+    XBee talking to simulated data stations over a SimulatedRadio, so ACKs
+    go through the same serial reader as on hardware.
+    """
+
+    def __init__(self, stations):
+        super(SimulatedXBee, self).__init__(serial_port=None)
+        self.stations = stations # Data station ID -> SimulatedStation
+        self.xbee_port = SimulatedRadio(stations)
+        self._start_reader()
+
+    def connect(self):
+        pass
@@ -0,0 +1,91 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from services.catalog import Catalog
+from services.catalog import exif
+
+def jpeg_with_exif(date_time):
+    """Smallest JPEG header carrying an EXIF DateTimeOriginal"""
+    value = date_time.encode('ascii') + b'\x00'
+
+    # Little endian TIFF: IFD0 with an EXIF IFD pointer, EXIF IFD with DateTimeOriginal
+    tiff = b'II*\x00' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', exif.EXIF_IFD_POINTER, 4, 1, 26) + struct.pack('<I', 0)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', exif.DATE_TIME_ORIGINAL, 2, len(value), 44) + struct.pack('<I', 0)
+    tiff += value
+
+    app1 = b'Exif\x00\x00' + tiff
+    return b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1)+2) + app1 + b'\xff\xda'
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalog = Catalog(os.path.join(self.directory, 'catalog.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_exif_capture_time(self):
+        """Capture time is read from EXIF DateTimeOriginal"""
+
+        path = self.write('IMG_0001.JPG', jpeg_with_exif('2018:07:04 12:30:00'))
+        self.assertEqual(exif.capture_time(path), 1530707400.0)
+
+        path = self.write('notes.txt', b'not a jpeg')
+        self.assertIsNone(exif.capture_time(path))
+
+    def test_index_and_query(self):
+        """Indexed files can be queried by station, kind and capture time"""
+
+        now = time.time()
+        image = self.write('IMG_0001.JPG', jpeg_with_exif(time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(now-86400))))
+        old_image = self.write('IMG_0002.JPG', jpeg_with_exif('2018:07:04 12:30:00'))
+        video = self.write('VID_0001.MP4', b'\x00'*1024)
+        other_station_image = self.write('IMG_0003.JPG', jpeg_with_exif('2018:07:04 12:30:00'))
+
+        self.catalog.add('321', '/media/DCIM/100/IMG_0001.JPG', image)
+        self.catalog.add('321', '/media/DCIM/100/IMG_0002.JPG', old_image)
+        self.catalog.add('321', '/media/DCIM/100/VID_0001.MP4', video)
+        self.catalog.add('322', '/media/DCIM/100/IMG_0001.JPG', other_station_image)
+        self.catalog.close()
+
+        last_week = Catalog(self.catalog.path).query(station='321', kind='image', since=now-7*86400)
+        self.assertEqual(len(last_week), 1)
+        self.assertEqual(last_week[0]['remote_path'], '/media/DCIM/100/IMG_0001.JPG')
+        self.assertEqual(last_week[0]['size'], os.path.getsize(image))
+
+        self.assertEqual(len(self.catalog.query(kind='video')), 1)
+        self.assertEqual(len(self.catalog.query(station='321')), 3)
+
+    def test_concurrent_add(self):
+        """Files added by several transfer threads at once share one writer"""
+
+        paths = [self.write('IMG_%04i.JPG' % i, b'\x00'*64) for i in range(40)]
+
+        def transfer(paths):
+            for path in paths:
+                self.catalog.add('321', '/media/DCIM/100/' + os.path.basename(path), path)
+
+        threads = [threading.Thread(target=transfer, args=(paths[i::8],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writers = [t for t in threading.enumerate() if t.name == 'Catalog']
+        self.catalog.close()
+
+        self.assertEqual(len(writers), 1)
+        self.assertEqual(len(self.catalog.query(station='321')), 40)
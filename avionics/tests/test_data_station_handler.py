@@ -1,11 +1,33 @@
+import multiprocessing
+import os
+import pickle
+import socket
 import queue
+import shutil
 import threading
 import time
 import unittest
+import unittest.mock
 import sys
+import tempfile
 import logging
 
 from services.data_station_handler import DataStationHandler
+from services.data_station_handler import crypto
+from services.data_station_handler.budget import TransferBudget
+from services.catalog import Catalog
+from services.history import StationHistory
+from services.data_station_handler.download import Download
+from services.data_station_handler.download_process import DownloadProcess
+from services.data_station_handler.link_controller import LinkController
+from services.data_station_handler.log_sync import LogSyncState
+from services.data_station_handler.progress import Progress
+from services.data_station_handler.resolver import StationResolver
+from services.data_station_handler.sftp import SFTPClient
+from services.data_station_handler.wireless import WirelessSignal
+from services.data_station_handler.xbee_scheduler import XBeeScheduler
+
+from simulation import ScaledTime, SimulatedStation, SimulatedXBee
 
 logger = logging.getLogger()
 logger.level = logging.DEBUG
@@ -19,8 +41,20 @@ class TestDataStationHandler(unittest.TestCase):
         self.is_downloading = threading.Event()
         self.is_awake = threading.Event()
 
+        # Whatever the handler downloads and records stays out of /srv/flight-data
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for target, name, value in ((Catalog, 'DEFAULT_PATH', os.path.join(self.root, 'catalog.db')),
+                                    (SFTPClient, 'LOCAL_FIELD_DATA_DESTINATION', os.path.join(self.root, 'field/')),
+                                    (SFTPClient, 'LOCAL_LOG_DESTINATION', os.path.join(self.root, 'logs/'))):
+            self.addCleanup(setattr, target, name, getattr(target, name))
+            setattr(target, name, value)
+        history = StationHistory(os.path.join(self.root, 'station-history.json'))
+        resolver = StationResolver(os.path.join(self.root, 'station-addresses.json'))
+
         # One second connection timeout, read/write timeout, and 2 second overall timeout
-        self._data_station_handler = DataStationHandler(120000, 120000, 600000, self.rx_queue)
+        self._data_station_handler = DataStationHandler(120000, 120000, 600000, self.rx_queue,
+                                                        _history=history, _resolver=resolver)
         self._data_station_handler.connect()
 
     def tearDown(self):
@@ -31,6 +65,7 @@ class TestDataStationHandler(unittest.TestCase):
 
         stream_handler = logging.StreamHandler(sys.stdout)
         logger.addHandler(stream_handler)
+        self.addCleanup(logger.removeHandler, stream_handler)
 
         self.rx_queue.put("321")
 
@@ -40,6 +75,814 @@ class TestDataStationHandler(unittest.TestCase):
 
         self._data_station_handler._wake_download_and_sleep(self.wakeup_event, self.download_event, self.is_downloading, self.is_awake)
 
-        print(self.rx_queue.get())
-
         self.assertEquals(self.rx_queue.qsize(), 0)
+
+def _transfer_one_file(progress):
+    slot = progress.start_file('/tmp/partial')
+    progress.add_bytes(1024)
+    progress.complete_file(slot)
+
+class StuckDownloadProcess(DownloadProcess):
+    """Starts writing a file on each of several channels, then hangs"""
+
+    def __init__(self, progress, local_files):
+        super(StuckDownloadProcess, self).__init__('nonexistent.local', 60000, progress)
+        self.local_files = local_files
+
+    def run(self):
+        for local_file in self.local_files:
+            self.progress.start_file(local_file)
+            with open(local_file, 'wb') as f:
+                f.write(b'partial')
+        time.sleep(60)
+
+class TestDownloadProcess(unittest.TestCase):
+
+    def test_progress_across_processes(self):
+        """Progress counters written by a child process are visible to the parent"""
+
+        progress = Progress()
+        worker = multiprocessing.Process(target=_transfer_one_file, args=(progress,))
+        worker.start()
+        worker.join(5)
+
+        self.assertEqual(progress.files_completed, 1)
+        self.assertEqual(progress.bytes_transferred, 1024)
+        self.assertEqual(progress.files_in_flight, [])
+
+    def test_cancel(self):
+        """A download process that outlives its timeout is killed"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        catalog_path = Catalog.DEFAULT_PATH
+        Catalog.DEFAULT_PATH = os.path.join(directory, 'catalog.db')
+        self.addCleanup(setattr, Catalog, 'DEFAULT_PATH', catalog_path)
+
+        download_worker = DownloadProcess('nonexistent.local', 60000, Progress())
+        download_worker.start()
+        download_worker.join(0.5)
+        for _ in range(100):
+            if os.path.exists(Catalog.DEFAULT_PATH):
+                break
+            time.sleep(0.05)
+        download_worker.cancel()
+        download_worker.finish()
+
+        self.assertFalse(download_worker.is_alive())
+
+        # The process was given our settings, not the defaults
+        self.assertTrue(os.path.exists(Catalog.DEFAULT_PATH))
+
+    def test_cancel_removes_partial_files(self):
+        """Every file being written when the download is killed is removed"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        local_files = [os.path.join(directory, 'IMG_%04i.JPG' % i) for i in range(3)]
+        with open(os.path.join(directory, 'IMG_done.JPG'), 'wb') as f:
+            f.write(b'complete')
+
+        progress = Progress()
+        download_worker = StuckDownloadProcess(progress, local_files)
+        download_worker.start()
+        while len(progress.files_in_flight) < len(local_files) and download_worker.is_alive():
+            time.sleep(0.05)
+        download_worker.cancel()
+        download_worker.finish()
+
+        self.assertEqual(os.listdir(directory), ['IMG_done.JPG'])
+
+class TestLinkController(unittest.TestCase):
+
+    WIRELESS = """Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+ face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+ wlan0: 0000   54.  %s.  -256        0      0      0     %s      0        0
+"""
+
+    def setUp(self):
+        self.wireless = tempfile.NamedTemporaryFile('w', suffix='wireless')
+        self.progress = Progress()
+        self.controller = LinkController(self.progress, WirelessSignal(path=self.wireless.name))
+
+    def tearDown(self):
+        self.wireless.close()
+
+    def set_signal(self, level, retries=0):
+        self.wireless.seek(0)
+        self.wireless.truncate()
+        self.wireless.write(self.WIRELESS % (level, retries))
+        self.wireless.flush()
+
+    def test_read_signal(self):
+        """Signal level and retries are parsed from /proc/net/wireless format"""
+
+        self.set_signal(-56, 12)
+        self.assertEqual(WirelessSignal(path=self.wireless.name).read(), (-56.0, 12))
+        self.assertEqual(WirelessSignal('wlan1', self.wireless.name).read(), (None, None))
+
+    def test_concurrency_grows_on_healthy_link(self):
+        """Concurrency increases while the link is strong and in use"""
+
+        self.set_signal(-50)
+        for _ in range(LinkController.MAX_CONCURRENCY):
+            self.controller.acquire(1024)
+            self.progress.add_bytes(1024)
+            self.controller.sample()
+
+        self.assertEqual(self.controller.concurrency, LinkController.MAX_CONCURRENCY)
+        self.assertFalse(self.controller.prefer_small_files)
+
+    def test_fade_pauses_large_files(self):
+        """A fading link halves concurrency and holds back large files"""
+
+        self.controller.concurrency = 4
+        self.set_signal(-85)
+        self.controller.sample()
+
+        self.assertTrue(self.controller.fading)
+        self.assertTrue(self.controller.prefer_small_files)
+        self.assertEqual(self.controller.concurrency, 2)
+
+        large_started = threading.Event()
+
+        def start_large_file():
+            self.controller.acquire(LinkController.LARGE_FILE_BYTES)
+            large_started.set()
+
+        threading.Thread(target=start_large_file, daemon=True).start()
+        self.assertFalse(large_started.wait(0.2))
+
+        self.set_signal(-50)
+        self.controller.sample()
+        self.assertTrue(large_started.wait(2))
+
+    def test_retry_burst_is_a_fade(self):
+        """A burst of Wi-Fi retries is treated as a fade even at good signal"""
+
+        self.set_signal(-50, 0)
+        self.controller.sample()
+        self.set_signal(-50, 500)
+        self.controller.sample()
+
+        self.assertTrue(self.controller.fading)
+
+class TestTransferBudget(unittest.TestCase):
+
+    def test_rebalance(self):
+        """Slots and bandwidth are split between sessions as they come and go"""
+
+        budget = TransferBudget(5, 3000)
+        first = budget.join()
+        self.assertEqual((first.concurrency, first.bytes_per_sec), (5, 3000))
+
+        second = budget.join()
+        third = budget.join()
+        self.assertEqual([s.concurrency for s in (first, second, third)], [2, 2, 1])
+        self.assertEqual(second.bytes_per_sec, 1000)
+
+        budget.leave(first)
+        budget.leave(second)
+        self.assertEqual((third.concurrency, third.bytes_per_sec), (5, 3000))
+
+    def test_share_limits_link_controller(self):
+        """A session's link controller never exceeds its share of the slots"""
+
+        share = TransferBudget(6).join()
+        controller = LinkController(Progress(), WirelessSignal(path='/nonexistent'), share)
+        controller.concurrency = 4
+        self.assertEqual(controller.limit, 4)
+
+        share.concurrency = 1
+        self.assertEqual(controller.limit, 1)
+
+    def test_throttle(self):
+        """Transfers beyond a share's bandwidth are slowed down to it"""
+
+        share = TransferBudget(1, 100000).join()
+        start = time.monotonic()
+        for _ in range(10):
+            share.throttle(10000)
+        self.assertGreater(time.monotonic() - start, 0.9)
+
+    def test_timed_out_thread_keeps_share(self):
+        """A download thread past its timeout holds its slots until it actually ends"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        handler = DataStationHandler(120000, 120000, 600000, queue.Queue(),
+                                     _history=StationHistory(os.path.join(directory, 'history.json')),
+                                     _resolver=StationResolver(os.path.join(directory, 'addresses.json')))
+
+        handler._downloads.acquire()
+        share = handler.budget.join()
+        stuck = threading.Event()
+        download_worker = threading.Thread(target=stuck.wait)
+        download_worker.start()
+        handler._release_when_stopped('321', download_worker, share)
+
+        other = handler.budget.join()
+        self.assertEqual(other.concurrency, DataStationHandler.TRANSFER_SLOTS // 2)
+
+        stuck.set()
+        download_worker.join()
+        time.sleep(0.1)
+        self.assertEqual(other.concurrency, DataStationHandler.TRANSFER_SLOTS)
+        for _ in range(DataStationHandler.MAX_SESSIONS):
+            self.assertTrue(handler._downloads.acquire(blocking=False))
+
+    def test_no_download_slot(self):
+        """A session that can't get a download slot in time skips the download and still shuts down"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        history = StationHistory(os.path.join(directory, 'history.json'))
+        rx_queue = queue.Queue()
+        handler = DataStationHandler(120000, 120000, 300, rx_queue, _history=history,
+                                     _resolver=StationResolver(os.path.join(directory, 'addresses.json')),
+                                     _xbee=RecordingXBee([('321', 'POWER_ON'), ('321', 'POWER_OFF')]))
+        self.addCleanup(handler.xbee_scheduler.stop)
+        handler.station_addresses['321'] = ('127.0.0.1', 1)
+
+        for _ in range(DataStationHandler.MAX_SESSIONS):
+            handler._downloads.acquire()
+
+        event = threading.Event()
+        event.set()
+        rx_queue.put('321')
+        start = time.monotonic()
+        with unittest.mock.patch.dict(os.environ, {'TESTING': 'False', 'DEVELOPMENT': 'False'}):
+            handler._wake_download_and_sleep(event, event, event, threading.Event())
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertFalse(history.get('321')['completed'])
+        self.assertTrue(handler.wait_for_shutdowns(2))
+
+class BootedStation(object):
+    is_booted = True
+
+    def __init__(self):
+        self.events = []
+
+    def power_on(self):
+        pass
+
+    def power_off(self):
+        pass
+
+    def record(self, event):
+        self.events.append(event)
+
+class TestXBee(unittest.TestCase):
+
+    def setUp(self):
+        self.stations = {'321': BootedStation(), '322': BootedStation()}
+        self.xbee = SimulatedXBee(self.stations)
+
+    def test_interleaved_acks(self):
+        """Each session gets its own station's ACK off the shared serial stream"""
+
+        self.xbee.send_command('321', 'POWER_ON')
+        self.xbee.send_command('322', 'POWER_ON')
+        time.sleep(0.2)
+
+        # Both ACKs are already waiting on the port, the second station's behind the first's
+        self.assertTrue(self.xbee.acknowledge('322', 'POWER_ON'))
+        self.assertTrue(self.xbee.acknowledge('321', 'POWER_ON'))
+
+    def test_late_ack_of_earlier_command(self):
+        """An ACK of a previous command doesn't count for the one awaited"""
+
+        self.xbee.send_command('321', 'POWER_ON')
+        self.xbee.send_command('321', 'POWER_OFF')
+
+        self.assertTrue(self.xbee.acknowledge('321', 'POWER_OFF', timeout=1))
+        self.assertFalse(self.xbee.acknowledge('321', 'POWER_ON'))
+        self.assertFalse(self.xbee.acknowledge('322', 'POWER_OFF', timeout=0.2))
+
+class RecordingXBee(object):
+    """Records commands sent, and acknowledges those in `acknowledging` once sent"""
+
+    def __init__(self, acknowledging=()):
+        self.sent = []
+        self.acknowledging = set(acknowledging)
+
+    def send_command(self, data_station_id, command):
+        self.sent.append((data_station_id, command))
+
+    def acknowledge(self, data_station_id, command):
+        return (data_station_id, command) in self.acknowledging and (data_station_id, command) in self.sent
+
+class TestXBeeScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.xbee = RecordingXBee([('321', 'POWER_ON')])
+        self.scheduler = XBeeScheduler(self.xbee)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_power_on_first(self):
+        """A station's POWER_ON goes ahead of other stations' shutdowns"""
+
+        self.scheduler.submit('322', 'POWER_OFF', 5)
+        self.scheduler.submit('323', 'POWER_OFF', 5)
+        power_on = self.scheduler.submit('321', 'POWER_ON')
+
+        self.assertTrue(power_on.wait(1))
+        self.assertTrue(power_on.acknowledged)
+        # Sent before the second shutdown at the latest
+        self.assertIn(('321', 'POWER_ON'), self.xbee.sent[:2])
+        self.assertNotIn(('323', 'POWER_OFF'), self.xbee.sent[:1])
+
+    def test_interleaved(self):
+        """Stations take turns on the link while neither acknowledges"""
+
+        first = self.scheduler.submit('322', 'POWER_ON')
+        second = self.scheduler.submit('323', 'POWER_ON')
+        time.sleep(1.2)
+        first.cancel()
+        second.cancel()
+
+        self.assertEqual(self.xbee.sent[:6], [('322', 'POWER_ON'), ('323', 'POWER_ON')] * 3)
+        self.assertFalse(first.acknowledged)
+
+    def test_shutdown_in_background(self):
+        """POWER_OFF is retried until it times out, without anyone waiting on it"""
+
+        shutdown = self.scheduler.submit('322', 'POWER_OFF', 0.6)
+        self.assertFalse(shutdown.done)
+
+        self.assertTrue(shutdown.wait(2))
+        self.assertFalse(shutdown.acknowledged)
+        self.assertGreaterEqual(shutdown.attempts, 2)
+
+    def test_without_ack(self):
+        """A command not expecting an ACK is done once sent"""
+
+        command = self.scheduler.submit('322', 'POWER_OFF', expect_ack=False)
+        self.assertTrue(command.wait(1))
+        self.assertIsNone(command.acknowledged)
+        self.assertEqual(self.xbee.sent, [('322', 'POWER_OFF')])
+
+    def test_submit_when_idle(self):
+        """A command submitted once the queue has emptied is sent straight away"""
+
+        self.assertTrue(self.scheduler.submit('322', 'POWER_OFF', expect_ack=False).wait(1))
+        time.sleep(0.3)
+
+        power_on = self.scheduler.submit('321', 'POWER_ON')
+        self.assertTrue(power_on.wait(0.2))
+        self.assertTrue(power_on.acknowledged)
+
+class TestLogSyncState(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'station.log')
+        with open(self.log, 'wb') as f:
+            f.write(b'boot\n' * 200)
+
+        state = LogSyncState(self.directory)
+        state.update('station.log', os.path.getsize(self.log))
+        state.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_from_offset(self):
+        """A grown log resumes from the recorded offset if its head is unchanged"""
+
+        state = LogSyncState(self.directory)
+        offset = state.resume_offset('station.log', 2000)
+
+        self.assertEqual(offset, 1000)
+        self.assertTrue(state.head_matches('station.log', (b'boot\n' * 200)[:state.head_length('station.log')]))
+
+    def test_rotation(self):
+        """A log with a different head has been rotated"""
+
+        state = LogSyncState(self.directory)
+        self.assertFalse(state.head_matches('station.log', b'x' * state.head_length('station.log')))
+
+    def test_truncation(self):
+        """A log shorter than the recorded offset, or a modified local copy, is fetched in full"""
+
+        state = LogSyncState(self.directory)
+        self.assertEqual(state.resume_offset('station.log', 10), 0)
+
+        with open(self.log, 'ab') as f:
+            f.write(b'local edit\n')
+        self.assertEqual(state.resume_offset('station.log', 2000), 0)
+
+        self.assertEqual(state.resume_offset('new.log', 2000), 0)
+
+class TestCryptoProfile(unittest.TestCase):
+
+    def setUp(self):
+        import paramiko
+
+        self.sockets = socket.socketpair()
+        self.transport = paramiko.Transport(self.sockets[0])
+
+    def tearDown(self):
+        for s in self.sockets:
+            s.close()
+
+    def test_preferred_first(self):
+        crypto.apply(self.transport, crypto.resolve('arm'))
+        options = self.transport.get_security_options()
+
+        self.assertEqual(options.ciphers[0], 'aes128-ctr')
+        self.assertEqual(options.digests[0], 'hmac-sha1')
+        self.assertEqual(options.kex[0], 'curve25519-sha256@libssh.org')
+
+        # The rest stay available as a fallback
+        self.assertIn('aes256-ctr', options.ciphers)
+
+    def test_strict_and_unsupported(self):
+        crypto.apply(self.transport, {'ciphers': ('made-up-cipher', 'aes256-ctr'), 'strict': True})
+        options = self.transport.get_security_options()
+
+        self.assertEqual(options.ciphers, ('aes256-ctr',))
+        self.assertIn('hmac-sha2-256', options.digests)
+
+class StationTestCase(unittest.TestCase):
+    """
+    Test case with a temporary directory and simulated data stations
+    serving files from it, each on a port of its own
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.stations = []
+
+    def tearDown(self):
+        for station in self.stations:
+            station.power_off()
+        shutil.rmtree(self.root)
+
+    def start_station(self, files, data_station_id='321', host='127.0.0.1'):
+        """Boot a station serving {path under /media: contents}"""
+        import paramiko
+
+        station_root = os.path.join(self.root, 'station-%s' % data_station_id)
+        os.makedirs(os.path.join(station_root, 'media'))
+        for path, data in files.items():
+            path = os.path.join(station_root, 'media', path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        station = SimulatedStation(data_station_id, station_root, (host, 0),
+                                   paramiko.RSAKey.generate(1024), ScaledTime(1), boot_secs=0)
+        station.power_on()
+        while not 'booted' in station.events:
+            time.sleep(0.01)
+        self.stations.append(station)
+        return station
+
+class TestStripedDownload(StationTestCase):
+
+    def setUp(self):
+        super(TestStripedDownload, self).setUp()
+        self.data = os.urandom(3*1024*1024 + 17)
+        self.station = self.start_station({'VID_0001.MP4': self.data})
+
+        self.local = os.path.join(self.root, 'local')
+        os.makedirs(self.local)
+
+    def attributes(self):
+        """The large file's SFTPAttributes, as the station reports them"""
+        import paramiko
+
+        path = os.path.join(self.root, 'station-321', 'media', 'VID_0001.MP4')
+        return paramiko.SFTPAttributes.from_stat(os.stat(path), 'VID_0001.MP4')
+
+    def test_large_file_is_striped(self):
+        progress = Progress()
+        client = SFTPClient('pi', 'raspberry', '321.local', progress, _address=self.station.address)
+        client.LOCAL_FIELD_DATA_DESTINATION = client.LOCAL_LOG_DESTINATION = self.local
+        client.STRIPE_THRESHOLD_BYTES = 1024*1024
+        client.connect()
+        self.assertTrue(client.is_connected)
+
+        client.downloadFile('/media/', self.local, 'VID_0001.MP4', self.attributes())
+        client.close()
+
+        with open(os.path.join(self.local, 'VID_0001.MP4'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(progress.bytes_transferred, len(self.data))
+        self.assertEqual(progress.files_completed, 1)
+
+        # Main connection plus one per stripe
+        self.assertEqual(len(self.station._transports), 1 + SFTPClient.STRIPE_TRANSPORTS)
+
+    def download(self, progress, controller=None, share=None):
+        """Fetch the large file striped, return the number of stripe transports"""
+        client = SFTPClient('pi', 'raspberry', '321.local', progress, _address=self.station.address, _share=share)
+        client.LOCAL_FIELD_DATA_DESTINATION = client.LOCAL_LOG_DESTINATION = self.local
+        client.STRIPE_THRESHOLD_BYTES = 1024*1024
+        client.connect()
+        self.assertTrue(client.is_connected)
+
+        client.downloadFile('/media/', self.local, 'VID_0001.MP4', self.attributes(), controller)
+        client.close()
+
+        with open(os.path.join(self.local, 'VID_0001.MP4'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        return len(self.station._transports) - 1
+
+    def test_stripes_within_share(self):
+        """Stripes beyond the file's own transfer are charged against the budget share"""
+
+        share = TransferBudget(2).join()
+        self.assertEqual(self.download(Progress(), share=share), 2)
+
+    def test_stripes_take_free_transfers(self):
+        """With a LinkController, stripes only use transfers it has free, and give them back"""
+
+        progress = Progress()
+        controller = LinkController(progress, None)
+        controller.concurrency = 3
+        controller.acquire(len(self.data))      # The file's own
+        controller.acquire(0)                   # Another file's
+
+        self.assertEqual(self.download(progress, controller), 2)
+        self.assertEqual(controller._active, 2)
+
+    def test_no_free_transfers(self):
+        """A file with no transfers free to stripe over comes over its own connection"""
+
+        progress = Progress()
+        controller = LinkController(progress, None)
+        controller.acquire(len(self.data))
+
+        self.assertEqual(self.download(progress, controller), 0)
+        self.assertEqual(progress.files_completed, 1)
+
+class TestStationResolver(StationTestCase):
+
+    class Resolver(StationResolver):
+        """Stands in for mDNS, where the stations are all on this machine"""
+        lookups = 0
+
+        def lookup(self, data_station_id):
+            self.lookups += 1
+            self._update(data_station_id, '127.0.0.1')
+            return '127.0.0.1'
+
+    def setUp(self):
+        super(TestStationResolver, self).setUp()
+        self.path = os.path.join(self.root, 'station-addresses.json')
+
+    def test_cache(self):
+        """Addresses are looked up once and remembered between flights"""
+
+        resolver = self.Resolver(self.path)
+        self.assertEqual(resolver.resolve('321'), ('127.0.0.1', 'mdns'))
+        self.assertEqual(resolver.resolve('321'), ('127.0.0.1', 'cache'))
+        self.assertEqual(resolver.lookups, 1)
+
+        self.assertEqual(StationResolver(self.path).cached('321'), '127.0.0.1')
+        self.assertEqual(StationResolver(self.path).cached('322'), None)
+
+    def test_refresh(self):
+        """A station is looked up in the background while it boots"""
+
+        resolver = self.Resolver(self.path)
+        resolver.refresh('321').join(5)
+        self.assertEqual(resolver.cached('321'), '127.0.0.1')
+
+    def test_stale_address_falls_back_to_mdns(self):
+        """A cached address that keeps refusing connections is given up on for a fresh lookup"""
+
+        station = self.start_station({})
+        resolver = self.Resolver(self.path)
+        resolver._update('321', '127.0.0.3')
+
+        client = SFTPClient('pi', 'raspberry', '321.local', _resolver=resolver)
+        client.PORT = station.address[1]
+        client.LOCAL_FIELD_DATA_DESTINATION = client.LOCAL_LOG_DESTINATION = self.root
+
+        # The station could still be booting
+        for _ in range(SFTPClient.CACHE_FAILURES):
+            client.connect()
+            self.assertFalse(client.is_connected)
+        self.assertEqual(resolver.lookups, 0)
+
+        client.connect()
+        self.assertTrue(client.is_connected)
+        self.assertEqual(resolver.lookups, 1)
+        self.assertEqual(resolver.cached('321'), '127.0.0.1')
+        client.close()
+
+    def test_unreachable_address_falls_back_to_mdns(self):
+        """A cached address with nothing answering at it is given up on after one attempt"""
+
+        # Connections beyond a full backlog go unanswered, so connecting times out
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(0)
+        self.addCleanup(listener.close)
+        for _ in range(3):
+            backlog = socket.socket()
+            backlog.setblocking(False)
+            backlog.connect_ex(listener.getsockname())
+            self.addCleanup(backlog.close)
+
+        resolver = self.Resolver(self.path)
+        resolver._update('321', '127.0.0.1')
+
+        client = SFTPClient('pi', 'raspberry', '321.local', _resolver=resolver)
+        client.PORT = listener.getsockname()[1]
+        client.CONNECT_TIMEOUT_SECS = 0.3
+        with self.assertRaises(socket.timeout):
+            client.openTransport()
+        self.assertEqual(resolver.lookups, 0)
+
+        with self.assertRaises(socket.timeout):
+            client.openTransport()
+        self.assertEqual(resolver.lookups, 1)
+
+    def test_download_process_copy_keeps_to_itself(self):
+        """A copy of the resolver in a download process doesn't write the cache file"""
+
+        resolver = self.Resolver(self.path)
+        resolver._update('321', '127.0.0.1')
+
+        copy = pickle.loads(pickle.dumps(resolver))
+        copy._update('321', '127.0.0.4')
+        self.assertEqual(copy.cached('321'), '127.0.0.4')
+        self.assertEqual(StationResolver(self.path).cached('321'), '127.0.0.1')
+
+class TestConnectionRace(unittest.TestCase):
+
+    class Transport(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    class Client(object):
+        """Stands in for SFTPClient, opening transports the test hands it"""
+
+        def __init__(self, outcomes):
+            self.outcomes = queue.Queue()
+            for outcome in outcomes:
+                self.outcomes.put(outcome)
+
+        def openTransport(self):
+            delay, transport = self.outcomes.get()
+            time.sleep(delay)
+            if transport == None:
+                raise socket.error("Connection refused")
+            return transport
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+        self.download = Download('321.local', _catalog=Catalog(os.path.join(self.root, 'catalog.db')))
+        self.download.ATTEMPT_STAGGER_SECS = 0.2
+        self.download.BACKOFF_INITIAL_SECS = 0.1
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def race(self, outcomes, timeout=5):
+        self.download._Download__sftp = self.Client(outcomes)
+        return self.download._race(timeout)
+
+    def test_staggered_attempt_overtakes_slow_one(self):
+        """A second attempt starts while the first hangs, and the loser is closed"""
+
+        slow, fast = self.Transport(), self.Transport()
+        self.assertIs(self.race([(1, slow), (0, fast)]), fast)
+        self.assertEqual([a['result'] for a in self.download.attempts], ['abandoned', 'connected'])
+        self.assertAlmostEqual(self.download.attempts[1]['started'], 0.2, delta=0.1)
+
+        time.sleep(1)
+        self.assertTrue(slow.closed)
+        self.assertEqual(self.download.attempts[0]['result'], 'closed')
+        self.assertFalse(fast.closed)
+
+    def test_backoff_after_failures(self):
+        """Failed attempts are retried after a growing delay"""
+
+        transport = self.Transport()
+        self.assertIs(self.race([(0, None), (0, None), (0, None), (0, transport)]), transport)
+
+        starts = [a['started'] for a in self.download.attempts]
+        self.assertEqual([a['result'] for a in self.download.attempts], ['failed']*3 + ['connected'])
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        for i, gap in enumerate(gaps):
+            self.assertGreaterEqual(gap, 0.1 * 2**i / 2)
+            self.assertLess(gap, 0.1 * 2**i + 0.1)
+
+    def test_timeout(self):
+        self.assertEqual(self.race([(0, None)] * 100, timeout=0.5), None)
+        self.assertTrue(all(a['result'] == 'failed' for a in self.download.attempts))
+
+    def test_closed_after_failure(self):
+        """A download failing part way through still indexes what it got and disconnects"""
+
+        class Client(object):
+            closed = False
+
+            def downloadAllFieldData(self, controller, delete):
+                raise socket.error("Connection reset")
+
+            def close(self):
+                self.closed = True
+
+        class Catalog(object):
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        client, catalog = Client(), Catalog()
+        self.download._Download__sftp = client
+        self.download._Download__catalog = catalog
+
+        self.assertRaises(socket.error, self.download._start)
+        self.assertTrue(catalog.closed)
+        self.assertTrue(client.closed)
+
+class TestRemoteDelete(StationTestCase):
+
+    def setUp(self):
+        super(TestRemoteDelete, self).setUp()
+        files = dict(('IMG_%04i.JPG' % i, os.urandom(1024)) for i in range(200))
+        files['logs/station.log'] = b'log\n'
+        self.station = self.start_station(files)
+        self.media = os.path.join(self.station.root, 'media')
+
+        self.local = os.path.join(self.root, 'local')
+        os.makedirs(self.local)
+        self.catalog = Catalog(os.path.join(self.root, 'catalog.db'))
+        self.client = SFTPClient('pi', 'raspberry', '321.local', _catalog=self.catalog,
+                                 _address=self.station.address)
+        self.client.LOCAL_FIELD_DATA_DESTINATION = self.client.LOCAL_LOG_DESTINATION = self.local
+        self.client.connect()
+        self.assertTrue(self.client.is_connected)
+
+    def tearDown(self):
+        self.client.close()
+        super(TestRemoteDelete, self).tearDown()
+
+    def test_parallel_delete(self):
+        """Files are removed in bulk, with a result for each"""
+
+        paths = ['/media/IMG_%04i.JPG' % i for i in range(150)]
+        results = self.client.deleteFiles(paths + ['/media/missing.JPG'])
+
+        self.assertEqual(len(results), 151)
+        self.assertTrue(all(results[path] == None for path in paths))
+        self.assertNotEqual(results['/media/missing.JPG'], None)
+        self.assertEqual(len([f for f in os.listdir(self.media) if f.endswith('.JPG')]), 50)
+
+    def test_delete_during_download(self):
+        """Files are removed from the station once they're downloaded and indexed"""
+
+        self.client.downloadAllFieldData(delete=True)
+        self.catalog.close()
+        results = self.client.deleteAllFieldData()
+
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all(error == None for error in results.values()))
+        self.assertEqual(os.listdir(self.media), ['logs'])
+        self.assertTrue(os.path.exists(os.path.join(self.media, 'logs', 'station.log')))
+        self.assertEqual(len([f for f in os.listdir(self.local) if f.endswith('.JPG')]), 200)
+
+    def test_delete_alongside_transfers(self):
+        """Removals and concurrent transfers share the station's sessions without running out"""
+
+        controller = LinkController(Progress(), None)
+        controller.concurrency = LinkController.MAX_CONCURRENCY
+        with self.assertLogs(level='INFO') as logs:
+            self.client.downloadAllFieldData(controller, delete=True)
+            self.catalog.close()
+            results = self.client.deleteAllFieldData()
+
+        self.assertFalse([line for line in logs.output if 'Unable to open SFTP channel' in line])
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all(error == None for error in results.values()))
+
+    def test_name_collision_is_kept(self):
+        """Files sharing a name, and so a local copy, are never deleted"""
+
+        os.makedirs(os.path.join(self.media, 'card2'))
+        with open(os.path.join(self.media, 'card2', 'IMG_0000.JPG'), 'wb') as f:
+            f.write(b'other')
+
+        self.client.downloadAllFieldData(delete=True)
+        self.catalog.close()
+        results = self.client.deleteAllFieldData()
+
+        self.assertNotIn('/media/IMG_0000.JPG', results)
+        self.assertNotIn('/media/card2/IMG_0000.JPG', results)
+        self.assertTrue(os.path.exists(os.path.join(self.media, 'IMG_0000.JPG')))
+        self.assertTrue(os.path.exists(os.path.join(self.media, 'card2', 'IMG_0000.JPG')))
+        self.assertEqual(len(results), 199)
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from services.heartbeat import Heartbeat
+
+class TestHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        self.is_downloading = threading.Event()
+
+        # 5 Hz so the test doesn't take all day
+        self._heartbeat = Heartbeat(0.2)
+        self._heartbeat.connect()
+
+        self._thread = threading.Thread(target=self._heartbeat.run, args=(self.is_downloading,))
+        self._thread.daemon = True
+
+    def tearDown(self):
+        self._heartbeat.stop()
+        self._thread.join(1)
+
+    def test_status_bytes(self):
+        """Heartbeat reports idle and downloading status"""
+
+        self._thread.start()
+        time.sleep(0.5)
+        self.is_downloading.set()
+        time.sleep(0.5)
+        self._heartbeat.stop()
+        self._thread.join(1)
+
+        if self._heartbeat.heartbeat_port != None:
+            received = self._heartbeat.heartbeat_port.read(self._heartbeat.heartbeat_port.in_waiting)
+            self.assertEqual(received[0:1], Heartbeat.IDLE)
+            self.assertEqual(received[-1:], Heartbeat.DOWNLOADING)
+
+    def test_period_under_load(self):
+        """Heartbeat keeps its period while CPU-bound workers hold the GIL"""
+
+        busy = threading.Event()
+        busy.set()
+
+        def spin():
+            while busy.is_set():
+                sum(i * i for i in range(10000))
+
+        workers = [threading.Thread(target=spin) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+
+        self._thread.start()
+        time.sleep(2)
+        busy.clear()
+        for worker in workers:
+            worker.join()
+
+        stats = self._heartbeat.stats()
+        self.assertEqual(stats['missed'], 0)
+        self.assertGreaterEqual(stats['sent'], 10)
+        self.assertLess(stats['jitter_max'], 0.2)
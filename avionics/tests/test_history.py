@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from services.history import StationHistory
+
+class TestStationHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_defaults_without_history(self):
+        history = StationHistory(self.path)
+
+        self.assertIsNone(history.get('321'))
+        self.assertEqual(history.wake_distance('321', 1000, 15, 5000), 5000)
+        self.assertEqual(history.wake_timeout('321', 240), 240)
+        self.assertEqual(history.download_timeout('321', 120, 600), 600)
+
+    def test_persisted_and_smoothed(self):
+        StationHistory(self.path).record('321', 60, 5, 1e6, 50e6)
+        history = StationHistory(self.path)
+        history.record('321', 100, 7, 3e6, 70e6)
+
+        entry = StationHistory(self.path).get('321')
+        self.assertEqual(entry['visits'], 2)
+        self.assertAlmostEqual(entry['wake_secs'], 80)
+        self.assertAlmostEqual(entry['throughput'], 2e6)
+        self.assertIn('backlog_rate', entry)
+
+    def test_slow_booting_station_woken_earlier(self):
+        history = StationHistory(self.path)
+        history.record('321', wake_secs=20)
+        history.record('322', wake_secs=200)
+
+        # 1000 m + 15 m/s * 20 s * 1.5 is closer than XBee wakeup is worth starting
+        self.assertEqual(history.wake_distance('321', 1000, 15, 5000), StationHistory.MIN_WAKE_DISTANCE)
+        self.assertAlmostEqual(history.wake_distance('322', 1000, 15, 5000), 5500)
+        self.assertEqual(history.wake_distance('322', 1000, 30, 5000), StationHistory.MAX_WAKE_DISTANCE)
+        self.assertEqual(history.wake_timeout('322', 240), 300)
+
+        # Unknown groundspeed leaves the default
+        self.assertEqual(history.wake_distance('322', 1000, None, 5000), 5000)
+
+    def test_download_timeout_from_backlog(self):
+        history = StationHistory(self.path)
+        history.record('321', connect_secs=10, throughput=1e6, backlog_bytes=100e6)
+
+        # (10 s + 100 MB at 1 MB/s) * 1.5
+        self.assertAlmostEqual(history.download_timeout('321', 120, 600), 165)
+
+        # Cut short last time, so the backlog is unknown
+        history.record('322', connect_secs=10, throughput=1e6, backlog_bytes=100e6, completed=False)
+        self.assertEqual(history.download_timeout('322', 120, 600), 600)
+
+if __name__ == '__main__':
+    unittest.main()
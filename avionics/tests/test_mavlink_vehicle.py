@@ -0,0 +1,121 @@
+import threading
+import time
+import unittest
+
+from pymavlink import mavutil
+
+from services.navigation.mavlink_vehicle import connect
+
+mavlink = mavutil.mavlink
+
+class FakeAutopilot(object):
+
+    """Autopilot end of a UDP MAVLink link: heartbeat, position, a mission"""
+
+    def __init__(self, port, mission):
+        self.link = mavutil.mavlink_connection('udpout:127.0.0.1:%i' % port, source_system=1)
+        self.mission = mission      # (command, lat, lon, param3), home first
+        self.current = 1
+        self.requests = []          # Message IDs asked for with SET_MESSAGE_INTERVAL
+        self.streams = []           # Data streams started with REQUEST_DATA_STREAM
+        self.dropped = False
+        self._alive = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._alive = False
+        self._thread.join()
+        self.link.close()
+
+    def _run(self):
+        last = 0
+        while self._alive:
+            if time.monotonic() - last > 0.1:
+                last = time.monotonic()
+                self.link.mav.heartbeat_send(mavlink.MAV_TYPE_FIXED_WING, mavlink.MAV_AUTOPILOT_PX4,
+                                             mavlink.MAV_MODE_FLAG_SAFETY_ARMED, 0, mavlink.MAV_STATE_ACTIVE)
+                self.link.mav.global_position_int_send(0, int(37.5e7), int(-122.25e7), 0, 100000, 1800, 0, 0, 0)
+                self.link.mav.mission_current_send(self.current)
+
+            message = self.link.recv_match(blocking=True, timeout=0.05)
+            if message == None:
+                continue
+
+            kind = message.get_type()
+            if kind == 'COMMAND_LONG' and message.command == mavlink.MAV_CMD_SET_MESSAGE_INTERVAL:
+                self.requests.append(int(message.param1))
+            elif kind == 'REQUEST_DATA_STREAM' and message.start_stop:
+                self.streams.append(message.req_stream_id)
+            elif kind == 'MISSION_REQUEST_LIST':
+                self.link.mav.mission_count_send(255, 0, len(self.mission))
+            elif kind == 'MISSION_REQUEST':
+                # Lose the first request for item 2, the vehicle must ask again
+                if message.seq == 2 and not self.dropped:
+                    self.dropped = True
+                    continue
+                command, lat, lon, param3 = self.mission[message.seq]
+                self.link.mav.mission_item_send(255, 0, message.seq, 0, command, 0, 1,
+                                                0, 0, param3, 0, lat, lon, 100)
+            elif kind == 'MISSION_SET_CURRENT':
+                self.current = message.seq
+
+class TestMavlinkVehicle(unittest.TestCase):
+
+    PORT = 14601
+
+    def setUp(self):
+        self.autopilot = FakeAutopilot(self.PORT, [
+            (16, 37.5, -122.25, 0),     # Home
+            (17, 37.51, -122.25, 0),
+            (201, 37.51, -122.25, 321),
+            (16, 37.52, -122.25, 0),
+        ])
+        self.vehicle = connect('udpin:127.0.0.1:%i' % self.PORT)
+
+    def tearDown(self):
+        self.vehicle.close()
+        self.autopilot.stop()
+
+    def test_state(self):
+        self.assertTrue(self.vehicle.armed)
+        self.assertAlmostEqual(self.vehicle.location.global_relative_frame.lat, 37.5)
+        self.assertAlmostEqual(self.vehicle.location.global_relative_frame.lon, -122.25)
+        self.assertAlmostEqual(self.vehicle.groundspeed, 18)
+
+        deadline = time.monotonic() + 2
+        while len(self.autopilot.requests) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(sorted(self.autopilot.requests), [mavlink.MAVLINK_MSG_ID_GLOBAL_POSITION_INT,
+                                                           mavlink.MAVLINK_MSG_ID_MISSION_CURRENT])
+
+        # Older ArduPilot gets both messages from the streams they're in
+        deadline = time.monotonic() + 2
+        while len(self.autopilot.streams) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(sorted(self.autopilot.streams), [mavlink.MAV_DATA_STREAM_EXTENDED_STATUS,
+                                                          mavlink.MAV_DATA_STREAM_POSITION])
+
+    def test_mission(self):
+        commands = self.vehicle.commands
+        commands.clear()
+        commands.download()
+        commands.wait_ready()
+
+        # Like dronekit, home isn't part of the list
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(commands[0].command, 17)
+        self.assertEqual(commands[1].command, 201)
+        self.assertEqual(int(commands[1].param3), 321)
+        self.assertAlmostEqual(commands[0].x, 37.51, places=5)
+        self.assertTrue(self.autopilot.dropped)
+
+        commands.next = 3
+        deadline = time.monotonic() + 2
+        while self.autopilot.current != 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.autopilot.current, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,43 @@
+import os
 import queue
+import tempfile
 import unittest
 
 from avionics.services.navigation import Navigation
+from avionics.services.history import StationHistory
+
+class Waypoint(object):
+    def __init__(self, command, x=0.0, y=0.0, param3=0):
+        self.command = command
+        self.x = x
+        self.y = y
+        self.param3 = param3
 
 class TestNavigation(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.directory = tempfile.TemporaryDirectory()
+        history = StationHistory(os.path.join(self.directory.name, 'history.json'))
+        self.navigation = Navigation(queue.Queue(), _history=history)
 
     def tearDown(self):
-        pass
+        self.directory.cleanup()
+
+    def station(self, station_id, lat):
+        return [Waypoint(Navigation.LOITER_WAYPOINT_COMMAND, lat, -111.0),
+                Waypoint(Navigation.ROI_WAYPOINT_COMMAND, param3=station_id)]
+
+    def test_station_cluster(self):
+        """Consecutive data stations close to the first are serviced together"""
+
+        # 0.002 deg of latitude is about 220 m, 0.01 about 1100 m
+        waypoints = [Waypoint(Navigation.STANDARD_WAYPOINT_COMMAND, 40.0, -111.0)] + \
+            self.station(1, 40.0) + self.station(2, 40.002) + self.station(3, 40.004) + \
+            self.station(4, 40.01)
+
+        self.assertEqual(self.navigation.station_cluster(waypoints, 1), [1, 3, 5])
+        self.assertEqual(self.navigation.station_cluster(waypoints, 7), [7])
+
+        # Every station from its own waypoint
+        self.navigation.CLUSTER_DISTANCE = 0
+        self.assertEqual(self.navigation.station_cluster(waypoints, 1), [1])
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from services.offload import Offload
+from services.offload import StandInServer
+
+class TestOffload(unittest.TestCase):
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.destination = tempfile.mkdtemp()
+
+        for bundle in ('321-ab12', '322-cd34'):
+            os.makedirs(os.path.join(self.source, bundle, 'DCIM'))
+            for i in range(5):
+                with open(os.path.join(self.source, bundle, 'DCIM', 'IMG_%i.JPG' % i), 'wb') as f:
+                    f.write(os.urandom(1024*(i+1)))
+
+        self.catalog = os.path.join(self.source, 'catalog.db')
+        with open(self.catalog, 'wb') as f:
+            f.write(os.urandom(1024))
+
+        self.server = StandInServer(self.destination, 0)
+        self.server.start()
+        self.target = 'http://localhost:%i/field' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.destination)
+
+    def test_offload_bundles(self):
+        """All bundles are pushed to the target and marked offloaded"""
+
+        self.assertTrue(Offload(self.target, 3, self.source, self.catalog).run())
+
+        for bundle in ('321-ab12', '322-cd34'):
+            self.assertTrue(os.path.exists(os.path.join(self.source, bundle, Offload.OFFLOADED_MARKER)))
+            for i in range(5):
+                relative_path = os.path.join(bundle, 'DCIM', 'IMG_%i.JPG' % i)
+                with open(os.path.join(self.source, relative_path), 'rb') as sent, \
+                     open(os.path.join(self.destination, 'field', relative_path), 'rb') as received:
+                    self.assertEqual(sent.read(), received.read())
+
+        self.assertEqual(Offload(self.target, 3, self.source, self.catalog).bundles(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'field', 'catalog.db')))
+
+    def test_resume(self):
+        """Files already in a bundle's manifest aren't pushed again"""
+
+        with open(os.path.join(self.source, '321-ab12', Offload.MANIFEST), 'w') as f:
+            f.write(os.path.join('DCIM', 'IMG_0.JPG') + '\n')
+
+        self.assertTrue(Offload(self.target, 2, self.source, self.catalog).run())
+
+        self.assertFalse(os.path.exists(os.path.join(self.destination, 'field', '321-ab12', 'DCIM', 'IMG_0.JPG')))
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'field', '321-ab12', 'DCIM', 'IMG_1.JPG')))
+        self.assertTrue(os.path.exists(os.path.join(self.source, '321-ab12', Offload.OFFLOADED_MARKER)))
+
+    def test_unreachable_target(self):
+        """Bundles aren't marked offloaded if their files can't be pushed"""
+
+        self.server.stop()
+
+        self.assertFalse(Offload(self.target, 2, self.source, self.catalog).run())
+        self.assertEqual(len(Offload(self.target, 2, self.source, self.catalog).bundles()), 2)
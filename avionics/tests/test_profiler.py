@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from services.profiler import SamplingProfiler, dump_stacks
+
+def busy_navigation(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=busy_navigation, args=(self.stop_event,), name='Navigation')
+        self.thread.start()
+
+    def tearDown(self):
+        self.stop_event.set()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_collapsed_stacks(self):
+        profiler = SamplingProfiler(['Navigation'], _interval_secs=0.005, _directory=self.directory)
+
+        profiler.toggle()
+        time.sleep(0.5)
+        profiler.toggle()
+
+        self.assertFalse(profiler.is_running)
+        self.assertGreater(profiler.sample_count, 10)
+
+        with open(profiler.path) as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('Navigation;'))
+            self.assertIn('busy_navigation', stack)
+            self.assertGreater(int(count), 0)
+
+    def test_all_threads(self):
+        """By default threads are sampled whatever their name, but not the profiler itself"""
+
+        transfer = threading.Thread(target=busy_navigation, args=(self.stop_event,), name='Transfer 0')
+        transfer.start()
+        self.addCleanup(transfer.join)
+
+        profiler = SamplingProfiler(_interval_secs=0.005, _directory=self.directory)
+        profiler.start()
+        time.sleep(0.5)
+        profiler.stop()
+
+        threads = set(stack.split(';', 1)[0] for stack in profiler.samples)
+        self.assertIn('Navigation', threads)
+        self.assertIn('Transfer 0', threads)
+        self.assertNotIn('Profiler', threads)
+
+    def test_dump_stacks(self):
+        with self.assertLogs(level='INFO') as logs:
+            dump_stacks()
+        self.assertTrue(any('Thread Navigation' in line and 'busy_navigation' in line for line in logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from services.catalog import Catalog
+from services.segment_store import SegmentStore
+from test_catalog import jpeg_with_exif
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, '321-abcd')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_read_export(self):
+        store = SegmentStore(self.path)
+        store.add('IMG_0001.JPG', b'first', 1500000000.0)
+        store.add('IMG_0002.JPG', b'second', 1500000001.0)
+        store.add('EMPTY.TXT', b'')
+
+        self.assertEqual(store.names(), ['EMPTY.TXT', 'IMG_0001.JPG', 'IMG_0002.JPG'])
+        self.assertEqual(bytes(store.read('IMG_0002.JPG')), b'second')
+        self.assertTrue(store.verify('IMG_0001.JPG'))
+        store.close()
+
+        # One segment for all three files
+        self.assertEqual(sorted(os.listdir(self.path)), ['index.jsonl', 'segment-00000.seg'])
+
+        store = SegmentStore(self.path)
+        destination = os.path.join(self.directory, 'export')
+        self.assertEqual(store.export(destination), 3)
+        store.close()
+
+        with open(os.path.join(destination, 'IMG_0001.JPG'), 'rb') as f:
+            self.assertEqual(f.read(), b'first')
+        self.assertEqual(os.path.getmtime(os.path.join(destination, 'IMG_0001.JPG')), 1500000000.0)
+
+    def test_export_plain_files(self):
+        """Striped downloads, written beside the store rather than into it, are exported too"""
+
+        store = SegmentStore(self.path)
+        store.add('IMG_0001.JPG', b'first', 1500000000.0)
+        with open(os.path.join(self.path, 'VID_0001.MP4'), 'wb') as f:
+            f.write(b'video' * 1000)
+        os.utime(os.path.join(self.path, 'VID_0001.MP4'), (1500000002.0, 1500000002.0))
+
+        destination = os.path.join(self.directory, 'export')
+        self.assertEqual(store.export(destination), 2)
+        store.close()
+
+        self.assertEqual(sorted(os.listdir(destination)), ['IMG_0001.JPG', 'VID_0001.MP4'])
+        with open(os.path.join(destination, 'VID_0001.MP4'), 'rb') as f:
+            self.assertEqual(f.read(), b'video' * 1000)
+        self.assertEqual(os.path.getmtime(os.path.join(destination, 'VID_0001.MP4')), 1500000002.0)
+
+    def test_failed_write_discarded(self):
+        store = SegmentStore(self.path)
+        with self.assertRaises(IOError):
+            with store.writer('PARTIAL.JPG') as w:
+                w.write(b'x' * 1000)
+                raise IOError("Connection lost")
+        store.add('IMG_0001.JPG', b'after')
+
+        self.assertNotIn('PARTIAL.JPG', store)
+        self.assertEqual(store.entry('IMG_0001.JPG')['offset'], 0)
+        store.close()
+
+    def test_concurrent_writers(self):
+        store = SegmentStore(self.path)
+        started = threading.Barrier(4)
+
+        def write(i):
+            with store.writer('IMG_%04i.JPG' % i) as w:
+                started.wait()
+                w.write(bytes([i]) * 10000)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(store.entry(name)['segment'] for name in store.names())), 4)
+        for i in range(4):
+            self.assertEqual(bytes(store.read('IMG_%04i.JPG' % i)), bytes([i]) * 10000)
+        store.close()
+
+    def test_crash_recovery(self):
+        store = SegmentStore(self.path)
+        store.add('IMG_0001.JPG', b'a' * 100)
+        store.add('IMG_0002.JPG', b'b' * 100)
+        store.close()
+
+        # Contents of the second file lost, and a torn index line
+        with open(os.path.join(self.path, 'segment-00000.seg'), 'r+b') as f:
+            f.truncate(150)
+        with open(os.path.join(self.path, 'index.jsonl'), 'a') as f:
+            f.write('{"name": "IMG_00')
+
+        store = SegmentStore(self.path)
+        self.assertEqual(store.names(), ['IMG_0001.JPG'])
+        store.close()
+
+    def test_catalog(self):
+        data = jpeg_with_exif('2017:07:14 02:40:00') + os.urandom(4096)
+
+        store = SegmentStore(self.path)
+        store.add('IMG_0001.JPG', data, 1400000000.0)
+
+        catalog = Catalog(os.path.join(self.directory, 'catalog.db'))
+        catalog.add('321', '/media/IMG_0001.JPG', os.path.join(self.path, 'IMG_0001.JPG'), store)
+        catalog.close()
+        store.close()
+
+        entry = catalog.query(station='321')[0]
+        self.assertEqual(entry['kind'], 'image')
+        self.assertEqual(entry['size'], len(data))
+        self.assertEqual(entry['mtime'], 1400000000.0)
+        self.assertEqual(entry['captured_at'], 1500000000.0)
+        self.assertEqual(entry['sha256'], hashlib.sha256(data).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
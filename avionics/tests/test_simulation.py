@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+
+from simulation import SimulatedMission
+
+class TestSimulatedMission(unittest.TestCase):
+
+    def test_mission(self):
+        """Every station is woken, downloaded from and shut down"""
+        mission = SimulatedMission(stations=2, acceleration=50, files_per_station=3,
+                                   file_size=32*1024, spacing_m=2000, port=0)
+        report = mission.run(120)
+
+        self.assertTrue(report['complete'])
+        self.assertGreater(report['bytes_per_minute'], 0)
+        for station in report['stations']:
+            for timing in ('wake', 'connect', 'transfer', 'shutdown'):
+                self.assertIsNotNone(station[timing])
+            self.assertGreaterEqual(station['bytes'], 3*32*1024)
+
+    def test_trace(self):
+        """A mission's trace has its spans, and the XBee commands as async events"""
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            mission = SimulatedMission(stations=1, acceleration=50, files_per_station=3,
+                                       file_size=32*1024, port=0, trace_path=path)
+            self.assertTrue(mission.run(120)['complete'])
+
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            os.remove(path)
+
+        spans = [e for e in events if e['ph'] == 'X']
+        for name in ('approach to wake distance', 'download', 'connect', 'resolve',
+                     'open transport', 'walk', 'transfer'):
+            self.assertIn(name, [e['name'] for e in spans])
+        for name in ('POWER_ON', 'POWER_OFF'):
+            self.assertEqual([e['ph'] for e in events if e['name'] == name], ['b', 'e'])
+        self.assertEqual(len([e for e in spans if e['name'] == 'transfer' and '/DCIM/' in e['args']['file']]), 3)
+
+if __name__ == '__main__':
+    unittest.main()
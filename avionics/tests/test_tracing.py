@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from services.tracing import Tracer
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chrome_trace(self):
+        tracer = Tracer()
+
+        def session():
+            with tracer.span('POWER_ON', 'xbee', station='321') as span:
+                span.args['acknowledged'] = True
+
+        thread = threading.Thread(target=session, name='Session 321')
+        thread.start()
+        thread.join()
+        with tracer.span('downloading', 'navigation'):
+            pass
+
+        self.assertEqual(tracer.export(self.path), self.path)
+        with open(self.path) as f:
+            events = json.load(f)['traceEvents']
+
+        spans = dict((e['name'], e) for e in events if e['ph'] == 'X')
+        self.assertEqual(set(spans), set(['POWER_ON', 'downloading']))
+        self.assertEqual(spans['POWER_ON']['args'], {'station': '321', 'acknowledged': True})
+        self.assertGreaterEqual(spans['POWER_ON']['dur'], 0)
+        self.assertNotEqual(spans['POWER_ON']['tid'], spans['downloading']['tid'])
+
+        names = dict((e['tid'], e['args']['name']) for e in events if e['name'] == 'thread_name')
+        self.assertEqual(names[spans['POWER_ON']['tid']], 'Session 321')
+
+        # Exported spans aren't written again with the next flight
+        self.assertEqual(tracer.events(), ([], {}))
+        self.assertIsNone(tracer.export(self.path))
+
+    def test_async(self):
+        """Spans ended on another thread are async, each with an id of its own"""
+        tracer = Tracer()
+
+        power_on = tracer.begin('POWER_ON', 'xbee', station='321')
+        power_off = tracer.begin('POWER_OFF', 'xbee', station='322')
+
+        def scheduler():
+            power_on.args['acknowledged'] = True
+            power_off.end()
+            power_on.end()
+
+        thread = threading.Thread(target=scheduler, name='XBee')
+        thread.start()
+        thread.join()
+
+        events, threads = tracer.events()
+        self.assertEqual([(e['name'], e['ph']) for e in events],
+                         [('POWER_ON', 'b'), ('POWER_OFF', 'b'), ('POWER_OFF', 'e'), ('POWER_ON', 'e')])
+        self.assertNotEqual(power_on.id, power_off.id)
+        self.assertEqual(set(e['id'] for e in events if e['name'] == 'POWER_ON'), set([power_on.id]))
+        self.assertEqual(events[3]['args'], {'station': '321', 'acknowledged': True})
+
+        # On the submitting thread's track
+        self.assertEqual(len(threads), 1)
+
+    def test_error(self):
+        tracer = Tracer()
+
+        with self.assertRaises(IOError):
+            with tracer.span('transfer', 'sftp'):
+                raise IOError('gone')
+
+        events, threads = tracer.events()
+        self.assertEqual(events[0]['args'], {'error': 'OSError: gone'})
+
+    def test_bounded(self):
+        tracer = Tracer(max_events=10)
+
+        for i in range(25):
+            with tracer.span('transfer', 'sftp', file=i):
+                pass
+
+        events, threads = tracer.events()
+        self.assertEqual([e['args']['file'] for e in events], list(range(15, 25)))
+
+    def test_merge(self):
+        tracer = Tracer()
+        child = Tracer()
+        with child.span('connect', 'download'):
+            pass
+
+        tracer.merge(*child.events())
+        events, threads = tracer.events()
+        self.assertEqual([e['name'] for e in events], ['connect'])
+        self.assertEqual(len(threads), 1)
+
+if __name__ == '__main__':
+    unittest.main()